@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Evaluation of files of expressions, one per line.
+
+    python -m math_parser batch formulas.txt -o results.csv -D R1=4.7k -D R2=10k
+
+The lines are evaluated in chunks by a pool of processes and written in the input order. Only a bounded number of
+chunks is in flight, so the memory used doesn't depend on the size of the input.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import math_parser
+import varstore
+import worker
+import worksheet
+from formatting import format_result
+
+COLUMNS = ('line', 'expression', 'value', 'type', 'error')
+
+_variables = {}
+
+
+def _init_worker(variables: dict, definitions: list = ()):
+    global _variables
+    _variables = variables
+    for name, data in definitions:
+        math_parser.define_function(math_parser.UserFunction.from_data(name, data, variables))
+
+
+def evaluate_lines(first: int, lines: list, variables: dict = None) -> list:
+    """Evaluates each line, returning one row per line with the fields in COLUMNS."""
+    if variables is None:
+        variables = _variables
+    rows = []
+    for number, line in enumerate(lines, first):
+        expression = line.strip()
+        if not expression:
+            rows.append((number, expression, '', '', ''))
+            continue
+        try:
+            result, _ = worker.evaluate(expression, variables)
+            value = format_result(result)
+        except Exception as err:
+            rows.append((number, expression, '', '', f"{type(err).__name__}: {err}"))
+        else:
+            rows.append((number, expression, value, type(result).__name__, ''))
+    return rows
+
+
+def read_variables(bindings: list, files: list) -> dict:
+    """Reads the name=value bindings given in the command line and in the files. Values can be expressions."""
+    variables = {}
+    sheet = worksheet.Worksheet(variables)
+    lines = []
+    for filename in files:
+        if varstore.is_journal(filename):
+            for name, value in varstore.VariableStore(filename).load().items():
+                if name.endswith(varstore.FUNCTION_SUFFIX):
+                    name = name[:-len(varstore.FUNCTION_SUFFIX)]
+                    math_parser.define_function(math_parser.UserFunction.from_data(name, value, variables))
+                    continue
+                if isinstance(value, dict):
+                    sheet.define(name, value['formula'], recompute=False)
+                    continue
+                if isinstance(value, str):  # Arrays are stored as the expression creating them
+                    try:
+                        value, _ = worker.evaluate(value, variables)
+                    except Exception:
+                        pass
+                variables[name] = value
+            continue
+        with open(filename) as f:
+            lines.extend(line for line in f if '=' in line)
+    sheet.recompute_all()
+    for binding in lines + list(bindings):  # The command line overrides the files
+        name, _, text = binding.partition('=')
+        value, _ = worker.evaluate(text.strip(), variables)
+        sheet.assign(name.strip(), value)
+    return variables
+
+
+class CsvWriter:
+    def __init__(self, output):
+        self.writer = csv.writer(output, lineterminator='\n')
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+
+class JsonLinesWriter:
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, rows):
+        self.output.writelines(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in rows)
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonLinesWriter}
+
+
+def chunks(lines, size: int):
+    first = 1
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield first, chunk
+        first += len(chunk)
+
+
+def run(lines, writer, variables: dict, workers: int = None, chunk_size: int = 1000) -> int:
+    """Evaluates the lines and writes the results in order. Returns the number of lines evaluated.
+
+    With workers=0 everything is evaluated in this process."""
+    count = 0
+    if workers == 0:
+        for first, chunk in chunks(lines, chunk_size):
+            writer.write(evaluate_lines(first, chunk, variables))
+            count += len(chunk)
+        return count
+
+    workers = workers or os.cpu_count() or 1
+    definitions = [(f.name, f.to_data()) for f in math_parser.user_functions()]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(variables, definitions)) as executor:
+        pending = deque()
+        for first, chunk in chunks(lines, chunk_size):
+            pending.append(executor.submit(evaluate_lines, first, chunk))
+            if len(pending) >= 2 * workers:  # Bounds the memory, while keeping all the workers busy
+                rows = pending.popleft().result()
+                writer.write(rows)
+                count += len(rows)
+        while pending:
+            rows = pending.popleft().result()
+            writer.write(rows)
+            count += len(rows)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m math_parser batch",
+                                     description="Evaluates a file of expressions, one per line.")
+    parser.add_argument('input', nargs='?', default='-', help="file with the expressions, - for stdin")
+    parser.add_argument('-o', '--output', default='-', help="output file, - for stdout")
+    parser.add_argument('-f', '--format', choices=WRITERS, help="output format, guessed from the output extension")
+    parser.add_argument('-D', '--define', action='append', default=[], metavar='NAME=VALUE',
+                        help="binds a variable, the value can be an expression")
+    parser.add_argument('--vars', action='append', default=[], metavar='FILE',
+                        help="file the plugin stores the variables in, or with NAME=VALUE lines")
+    parser.add_argument('-j', '--workers', type=int, help="number of processes, 0 evaluates in this process")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="lines sent to a process at a time")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ('jsonl' if args.output.endswith(('.jsonl', '.json')) else 'csv')
+    variables = read_variables(args.define, args.vars)
+    source = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        start = time.perf_counter()
+        count = run(source, WRITERS[output_format](output), variables, args.workers, args.chunk_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print(f"{count} lines in {elapsed:.2f}s, {count / elapsed if elapsed else 0:.0f} lines/s", file=sys.stderr)
+    return 0
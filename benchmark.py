@@ -0,0 +1,478 @@
+"""Benchmarks of the calculator internals.
+
+Run ``python benchmark.py`` to run all of them or ``python benchmark.py compile`` to run only the ones named.
+
+``python benchmark.py suite --check`` times each stage of the calculation over the CORPUS and fails when one is
+slower than its threshold in THRESHOLDS_PATH. The times are compared as ratios to the time of the evaluation with
+the builtin eval of the text of the AST, as the plugin first did, so that the thresholds hold on other machines.
+Each ratio is the median over ROUNDS rounds, each timing all the stages one after the other, so that a slower
+moment of the machine slows a stage and its baseline alike. ``--update`` stores the current ratios as the thresholds
+and ``--json`` writes the results.
+
+``python benchmark.py startup --check`` does the same for the time ``python -X importtime`` reports for importing
+main.py, without the wox module of the host, and math_parser, against the import of STARTUP_BASELINE. It also fails
+when main.py loads one of the DEFERRED_MODULES, which the first query doesn't need.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import math_parser
+
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_thresholds.json')
+TOLERANCE = 2.0  # A stage regresses when its ratio to the baseline exceeds the threshold times this
+NOISE_RATIO = 0.02  # Thresholds below this ratio are raised to it, as such short times are mostly noise
+ROUNDS = 7  # The suite compares the median of the ratios of the stages to the baseline over that many rounds
+STARTUP_BASELINE = 'argparse'  # Its import also loads re and enum, and little else
+DEFERRED_MODULES = ('traceback', 'subprocess', 'pickle', 'typing', 'ctypes', 'columns')
+IMPORT_TIME = re.compile(r'^import time:\s*(\d+) \|\s*(\d+) \| *(\S+)$', re.MULTILINE)
+
+
+def per_call(function, number=None, repeat=5, duration=None):
+    """Returns the time of one call to function in seconds, taking the best of the repetitions. Each one lasts
+    about duration seconds, or at least 0.2 s by default."""
+    timer = timeit.Timer(function)
+    if number is None:
+        if duration is None:
+            number, _ = timer.autorange()
+        else:
+            timer.timeit(1)  # Warms up the caches
+            number = max(1, int(duration / max(timer.timeit(1), 1e-9)))
+    return min(timer.repeat(repeat, number)) / number
+
+
+def bench_compile():
+    """Node.eval against the closures returned by Node.compile, for repeated evaluations."""
+    env = {'R1': 4.7e3, 'R2': 10e3, 'C': 100e-9, 'f': 1e3, 'x': 3}
+    expressions = (
+        "R1 // R2",
+        "20*log10(1/abs(1 + 2j*pi*f*R1*C))",
+        "R1*R2/(R1+R2) + x^2 - sin(x) * cos(x)",
+        "+".join(f"{i}*x" for i in range(100)),
+    )
+    for expression in expressions:
+        ast = math_parser.Parser(expression).parse()
+        function = ast.compile()
+        t_eval = per_call(lambda: ast.eval(env))
+        t_compiled = per_call(lambda: function(env))
+        t_compile = per_call(ast.compile)
+        print(f"{expression[:40]:40} eval {t_eval * 1e6:9.2f}us  compiled {t_compiled * 1e6:9.2f}us "
+              f"({t_eval / t_compiled:.1f}x)  compile {t_compile * 1e6:9.2f}us")
+
+
+def bench_optimize():
+    """Evaluation of the parsed tree against the tree returned by math_parser.optimize."""
+    env = {'R': 4.7e3, 'f': 1e3, 'x': 3}
+    expressions = (
+        "2*pi*f*R*100n",
+        "20*log10(1/abs(1 + 2j*pi*1k*R*1n)) + sqrt(2)/2",
+        "x^2^3 + (1k // 2k // 3k) * sin(pi/4)",
+    )
+    for expression in expressions:
+        ast = math_parser.Parser(expression).parse()
+        optimized = math_parser.optimize(ast)
+        t_eval = per_call(lambda: ast.eval(env))
+        t_optimized = per_call(lambda: optimized.eval(env))
+        print(f"{expression[:40]:40} eval {t_eval * 1e6:9.2f}us  optimized {t_optimized * 1e6:9.2f}us "
+              f"({t_eval / t_optimized:.1f}x)")
+
+
+def bench_scaling():
+    """Parse and evaluation time against the number of terms of pasted columns, with and without percentages."""
+    for terms in (1_000, 10_000, 100_000):
+        for percentages in (False, True):
+            expression = "+".join(f"{i * 37 % 1000}.{i % 100:02}" + ("%" if percentages and i % 2 else "")
+                                  for i in range(terms))
+            t_parse = per_call(lambda: math_parser.Parser(expression).parse(), repeat=3, duration=0.2)
+            ast = math_parser.Parser(expression).parse()
+            t_eval = per_call(lambda: ast.eval({}), repeat=3, duration=0.2)
+            print(f"{terms:7} terms{' with %' if percentages else '       '}  parse {t_parse * 1e3:9.2f}ms "
+                  f"({t_parse / terms * 1e9:6.0f}ns/term)  eval {t_eval * 1e3:9.2f}ms")
+
+
+def bench_share():
+    """Evaluation of optimized trees against the same trees with their repeated subexpressions shared."""
+    env = {'R': 4.7e3, 'L': 10e-3, 'C': 100e-9, 'f': 1e3}
+    impedance = "sqrt(R^2 + (2*pi*f*L - 1/(2*pi*f*C))^2)"
+    expressions = (
+        "1/(2*pi*f*C) + (2*pi*f*C)^2 + sqrt(R^2 + (2*pi*f*C)^2)",
+        f"20*log10(R/{impedance}) + atan2(2*pi*f*L - 1/(2*pi*f*C), R) * {impedance}",
+        " + ".join(f"{impedance}/(R + {i})" for i in range(50)),
+    )
+    for expression in expressions:
+        tree = math_parser.optimize(math_parser.Parser(expression).parse())
+        shared = math_parser.optimize(math_parser.Parser(expression).parse(), share=True)
+        t_tree = per_call(lambda: tree.eval(env))
+        t_shared = per_call(lambda: shared.eval(env))
+        compiled_tree, compiled_shared = tree.compile(), shared.compile()
+        t_compiled = per_call(lambda: compiled_shared(env)) / per_call(lambda: compiled_tree(env))
+        print(f"{expression[:40]:40} nodes {len(math_parser.postorder(tree)):5} -> "
+              f"{len(math_parser.postorder(shared)):4}  eval {t_tree * 1e6:9.2f}us -> {t_shared * 1e6:9.2f}us "
+              f"({t_tree / t_shared:.1f}x)  compiled {1 / t_compiled:.1f}x")
+
+
+def allocated(function) -> tuple:
+    """Returns the bytes still allocated after calling function, along with its result, and the peak of the bytes
+    allocated during the call."""
+    tracemalloc.start()
+    try:
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+
+def bench_program():
+    """Memory and evaluation of Node trees against the same trees as a math_parser.Program."""
+    env = {'x': 3, 'R': 4.7e3, 'L': 10e-3, 'C': 100e-9, 'f': 1e3}
+    expressions = (
+        "sqrt(R^2 + (2*pi*f*L - 1/(2*pi*f*C))^2)",
+        "+".join(f"{i}*x" for i in range(100_000)),
+        "-" * 100_000 + "x",
+    )
+    for expression in expressions:
+        tree, tree_bytes, _ = allocated(lambda: math_parser.optimize(math_parser.Parser(expression).parse()))
+        program, program_bytes, _ = allocated(lambda: math_parser.Program.from_tree(tree))
+        nodes = len(math_parser.postorder(tree))
+        _, _, tree_peak = allocated(lambda: tree.eval(env))
+        _, _, program_peak = allocated(lambda: program.eval(env))
+        t_tree = per_call(lambda: tree.eval(env), repeat=3, duration=0.2)
+        t_program = per_call(lambda: program.eval(env), repeat=3, duration=0.2)
+        print(f"{expression[:30]:30} {nodes:6} nodes  {tree_bytes / nodes:6.0f} -> {program_bytes / nodes:5.0f} "
+              f"bytes/node  eval peak {tree_peak / 1e3:8.1f} -> {program_peak / 1e3:8.1f}kB  "
+              f"eval {t_tree * 1e3:8.3f} -> {t_program * 1e3:8.3f}ms ({t_tree / t_program:.1f}x)")
+
+
+def legacy_tokenize(expr: str):
+    """The tokenizer before the single pass scanner, classifying each token with a chain of re.match calls."""
+    Parser = math_parser.Parser
+    tokens = re.findall(r'0x[0-9a-fA-F]+|0b[01]+|\d*\.?\d+(?:[eE][+-]?\d+)?[jfpnumkMGT]?|[a-zA-Z]\w*|[+\-*/^&(),!%]', expr)
+    processed_tokens = []
+    for i, t in enumerate(tokens):
+        if t in Parser.OPERATORS:
+            processed_tokens.append(t)
+        elif t in Parser.CONSTANTS:
+            if i > 0 and isinstance(processed_tokens[-1], (int, float)):  # numbers before constants taken as *
+                processed_tokens.append("*")
+            processed_tokens.append(Parser.CONSTANTS[t])
+        elif re.match(r'\d+$', t):
+            processed_tokens.append(int(t))
+        elif re.match(r'0x[0-9A-F]+$', t, re.IGNORECASE):
+            processed_tokens.append((int(t, 16)))
+        elif re.match(r'0b[01]+$', t, re.IGNORECASE):
+            processed_tokens.append((int(t, 2)))
+        elif re.match(r'\d*\.?\d+(?:[eE][+-]?\d+)?j$', t):
+            processed_tokens.append(complex(t))
+        elif re.match(r'\d*\.?\d+(?:[eE][+-]?\d+)?[fpnumkMGT]$', t):
+            value, prefix = float(t[:-1]), t[-1]
+            processed_tokens.append(value * Parser.ENGINEERING_PREFIXES[prefix])
+        elif re.match(r'\d*\.?\d+(?:[eE][+-]?\d+)?$', t):
+            value = float(t)
+            processed_tokens.append(value)
+        else:
+            if i > 0 and isinstance(processed_tokens[-1], (int, float)):  # numbers before functions taken as *
+                processed_tokens.append("*")
+            processed_tokens.append(t)
+    return processed_tokens
+
+
+def bench_tokenize():
+    """The single pass scanner of Parser.tokenize against the previous findall and re.match implementation."""
+    terms = ("12", "3.5", "4.7k", "2j", "0x1F", "0b101", "1e-3", "2pi", "sin(R1)", "R2", "e", "5!")
+    expression = ""
+    i = 0
+    while len(expression) < 10000:
+        expression += terms[i % len(terms)] + "+-*/"[i % 4]
+        i += 1
+    expression += "1"
+    parser = math_parser.Parser("")
+    assert parser.tokenize(expression) == legacy_tokenize(expression)
+    t_legacy = per_call(lambda: legacy_tokenize(expression))
+    t_scanner = per_call(lambda: parser.tokenize(expression))
+    print(f"{len(expression)} characters  legacy {t_legacy * 1e3:8.3f}ms  scanner {t_scanner * 1e3:8.3f}ms "
+          f"({t_legacy / t_scanner:.1f}x)")
+
+
+def bench_daemon():
+    """A query answered by a new process, as Wox does, against one forwarded by main.py to the resident daemon."""
+    os.environ.setdefault('TMP', tempfile.gettempdir())
+    import daemon
+    import host
+    query = "4.7k // 10k + sin(pi/4)"
+    t_cold = per_call(lambda: host.invoke('query', query, env=dict(os.environ, WOX_PYCALC_DAEMON='0')), 5)
+    host.invoke('query', query)  # Starts the daemon
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            daemon.call({'method': 'ping'})
+            break
+        except (OSError, ValueError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    t_client = per_call(lambda: host.invoke('query', query), 5)
+    t_round_trip = per_call(lambda: daemon.call({'method': 'query', 'parameters': [query]}))
+    print(f"cold spawn {t_cold * 1e3:8.2f}ms  main.py forwarding to the daemon {t_client * 1e3:8.2f}ms "
+          f"({t_cold / t_client:.1f}x)  daemon round trip {t_round_trip * 1e3:8.3f}ms")
+
+
+FIRST_QUERY = '''\
+import time
+start = time.perf_counter()
+import main
+main.calculate({query!r})
+print(time.perf_counter() - start)
+'''
+
+
+def bench_warm_start():
+    """The first query of a new process, with the snapshot left by the previous one and without it."""
+    import host
+    env = host.plugin_env(dict(os.environ, TMP=tempfile.mkdtemp(prefix='wox_pycalc_bench_'), WOX_PYCALC_DAEMON='0'))
+    path = os.path.join(env['TMP'], "wox_pycalc_snapshot.bin")
+    variables = {'R1': '4.7k', 'R2': '10k', 'V': '5'}
+    for name, value in variables.items():
+        host.invoke('store_result', name, value, env=env)
+    for query in ("+".join(f"{i}*R1/R2" for i in range(2000)), "V * R2/(R1+R2) + sin(pi/4)"):
+        def first_query():
+            process = subprocess.run([sys.executable, '-c', FIRST_QUERY.format(query=query)], cwd=host.PLUGIN_DIR,
+                                     env=env, stdout=subprocess.PIPE, check=True, text=True)
+            return float(process.stdout.split()[-1])
+
+        def cold():
+            if os.path.exists(path):
+                os.unlink(path)
+            return first_query()
+        host.invoke('query', query, env=env)  # Leaves the snapshot
+        size = os.path.getsize(path)
+        warm_times = [first_query() for _ in range(5)]
+        cold_times = [cold() for _ in range(5)]
+        print(f"{query[:30]:30} import and first query: cold {min(cold_times) * 1e3:8.2f}ms  "
+              f"warm {min(warm_times) * 1e3:8.2f}ms ({min(cold_times) / min(warm_times):.1f}x)  "
+              f"snapshot {size / 1e3:.1f}kB")
+
+
+def _keystrokes(expression: str) -> list:
+    """The prefixes of the expression typed one character at a time, which can be evaluated."""
+    prefixes = []
+    for i in range(1, len(expression) + 1):
+        try:
+            math_parser.Parser(expression[:i]).parse().eval(SUITE_ENV)
+        except Exception:
+            continue
+        prefixes.append(expression[:i])
+    return prefixes
+
+
+def _nested(depth: int) -> str:
+    expression = "x"
+    for i in range(depth):
+        expression = f"({i % 9 + 1} {'+-*/'[i % 4]} {expression})"
+    return expression
+
+
+SUITE_ENV = {'x': 3, 't': 1e-3, 'n': 20, 'R1': 4.7e3, 'R2': 10e3, 'C': 100e-9}
+
+CORPUS = {
+    'keystrokes': _keystrokes("4.7k // 10k + 20*log10(1/abs(1 + 2j*pi*1k*R1*C))"),
+    'long_sum': ["+".join(f"{i * 37 % 1000}.{i % 100:02}" for i in range(500)),
+                 "+".join(f"{i}*x" for i in range(200))],
+    'deep_parens': [_nested(20), _nested(60)],
+    'factorials': ["100!", "150!", "(n + 30)!", "factorial(120) / factorial(118)"],
+    'complex': ["(1+2j)*(3-4j)/abs(2+1j)", "(2+3j)^2 + 1j*x", "1/(1 + 2j*pi*1k*R1*C)"],
+    'engineering': ["4.7k*100n + 2.2M/3.3u + 1p*5T", "1/(2*pi*sqrt(10u*100n))", "3.3k*1m + 12f*4G"],
+    'parallel': ["1k//2k//3k//4k//5k//6k//7k//8k", "R1//R2//x", "(R1 + 1k)//(R2 - 1k)//4.7k"],
+}
+
+STAGES = ('tokenize', 'parse', 'optimize', 'eval', 'format', 'baseline')
+
+
+def measure(expressions: list, env: dict, rounds: int = ROUNDS) -> dict:
+    """Returns the times in seconds of each of the STAGES, for all the expressions, in each of the rounds. Each
+    round times all the stages one after the other, so that a stage and the baseline of the same round ran under
+    the same load."""
+    from formatting import format_result
+    tokenizer = math_parser.Parser("")
+    parsers, trees, optimized, results = [], [], [], []
+    for expression in expressions:
+        parser = math_parser.Parser(expression)
+        parsers.append(parser)
+        trees.append(parser.parse())
+        optimized.append(math_parser.optimize(trees[-1]))
+        results.append(optimized[-1].eval(env) if isinstance(optimized[-1], math_parser.Node) else optimized[-1])
+    texts = [str(ast) for ast in trees]
+    baseline_env = {**math_parser.Parser.FUNCTIONS, **env}
+
+    def parse():
+        for parser in parsers:
+            parser.index = 0
+            parser.percentages = 0
+            parser.parse()
+
+    def evaluate():
+        for ast in optimized:
+            if isinstance(ast, math_parser.Node):
+                ast.eval(env)
+
+    stages = {
+        'tokenize': lambda: [tokenizer.tokenize(expression) for expression in expressions],
+        'parse': parse,
+        'optimize': lambda: [math_parser.optimize(ast) for ast in trees],
+        'eval': evaluate,
+        'format': lambda: [format_result(result) for result in results],
+        'baseline': lambda: [eval(text, baseline_env) for text in texts],
+    }
+    times = {stage: [] for stage in STAGES}
+    for _ in range(rounds):
+        for stage in STAGES:
+            times[stage].append(per_call(stages[stage], repeat=3, duration=0.02))
+    return times
+
+
+def check(ratios: dict, thresholds: dict) -> list:
+    """Returns the stages whose ratio to the baseline exceeds their threshold, as (category, stage, ratio,
+    threshold) tuples."""
+    regressions = []
+    for category, stages in ratios.items():
+        for stage, ratio in stages.items():
+            threshold = thresholds.get(category, {}).get(stage)
+            if threshold is not None and ratio > max(threshold, NOISE_RATIO) * TOLERANCE:
+                regressions.append((category, stage, ratio, threshold))
+    return regressions
+
+
+def bench_suite(json_path: str = None, check_thresholds: bool = False, update: bool = False) -> int:
+    """Each stage of the calculation over the corpus, against the builtin eval of the text of the AST."""
+    times, ratios = {}, {}
+    print(f"{'':12}" + "".join(f"{stage:>12}" for stage in STAGES) + "  (us per expression)")
+    for category, expressions in CORPUS.items():
+        rounds = measure(expressions, SUITE_ENV)
+        times[category] = {stage: statistics.median(t) for stage, t in rounds.items()}
+        ratios[category] = {stage: statistics.median(t / b for t, b in zip(rounds[stage], rounds['baseline']))
+                            for stage in STAGES if stage != 'baseline'}
+        print(f"{category:12}" + "".join(f"{t / len(expressions) * 1e6:12.2f}" for t in times[category].values()))
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'corpus': {k: len(v) for k, v in CORPUS.items()},
+                       'seconds': times, 'ratios': ratios}, f, indent=2)
+    if update:
+        store_thresholds(ratios)
+    if check_thresholds:
+        return 1 if report_regressions(ratios) else 0
+    return 0
+
+
+def import_times(module: str, env: dict, runs: int = 5) -> dict:
+    """The least cumulative time in seconds, over the runs, python -X importtime reports for each module loaded by
+    importing the module. The bytecode is written to a temporary folder by a first run, which isn't counted."""
+    env = {key: value for key, value in env.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+    command = [sys.executable, '-X', 'importtime', '-X', f"pycache_prefix={tempfile.mkdtemp(prefix='wox_pycalc_pyc_')}",
+               '-c', f"import {module}"]
+    times = {}
+    for run in range(runs + 1):
+        process = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True, text=True)
+        if run:
+            for _, cumulative, name in IMPORT_TIME.findall(process.stderr):
+                times[name] = min(times.get(name, float('inf')), int(cumulative) * 1e-6)
+    return times
+
+
+def startup_ratios(runs: int = 5) -> tuple:
+    """Returns the import times of main.py, without the wox module, and of math_parser as ratios to the import time
+    of STARTUP_BASELINE, along with the modules main.py loads."""
+    import host
+    env = host.plugin_env(dict(os.environ, TMP=tempfile.mkdtemp(prefix='wox_pycalc_bench_'), WOX_PYCALC_DAEMON='0'))
+    main_times = import_times('main', env, runs)
+    baseline = import_times(STARTUP_BASELINE, env, runs)[STARTUP_BASELINE]
+    times = {'main': main_times['main'] - main_times.get('wox', 0),
+             'math_parser': import_times('math_parser', env, runs)['math_parser']}
+    for name, t in times.items():
+        print(f"{name:12} {t * 1e3:8.2f}ms  ({t / baseline:.3f} of {STARTUP_BASELINE}, {baseline * 1e3:.2f}ms)")
+    return {'startup': {name: t / baseline for name, t in times.items()}}, set(main_times)
+
+
+def bench_startup(check_thresholds: bool = False, update: bool = False) -> int:
+    """The import of main.py and math_parser by a new process, as Wox starts one for each query."""
+    ratios, loaded = startup_ratios()
+    deferred = sorted(loaded.intersection(DEFERRED_MODULES))
+    if deferred:
+        print(f"REGRESSION main.py loads {', '.join(deferred)}, not needed by the first query")
+    if update:
+        store_thresholds(ratios)
+    if check_thresholds:
+        return 1 if report_regressions(ratios) or deferred else 0
+    return 0
+
+
+def store_thresholds(ratios: dict):
+    """Stores the ratios as the thresholds of their categories, keeping those of the other categories."""
+    try:
+        with open(THRESHOLDS_PATH) as f:
+            thresholds = json.load(f)
+    except FileNotFoundError:
+        thresholds = {}
+    thresholds.update({category: {stage: round(ratio, 4) for stage, ratio in stages.items()}
+                       for category, stages in ratios.items()})
+    with open(THRESHOLDS_PATH, 'w') as f:
+        json.dump(thresholds, f, indent=2)
+        f.write('\n')
+
+
+def report_regressions(ratios: dict) -> list:
+    """Prints and returns the regressions of the ratios against the stored thresholds."""
+    with open(THRESHOLDS_PATH) as f:
+        regressions = check(ratios, json.load(f))
+    for category, stage, ratio, threshold in regressions:
+        print(f"REGRESSION {category} {stage}: {ratio:.3f} of the baseline, threshold {threshold:.3f}")
+    return regressions
+
+
+BENCHMARKS = {
+    'compile': bench_compile,
+    'optimize': bench_optimize,
+    'scaling': bench_scaling,
+    'share': bench_share,
+    'program': bench_program,
+    'tokenize': bench_tokenize,
+    'daemon': bench_daemon,
+    'warm_start': bench_warm_start,
+    'suite': bench_suite,
+    'startup': bench_startup,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the calculator internals.")
+    parser.add_argument('names', nargs='*', choices=[[]] + list(BENCHMARKS), metavar='name',
+                        help="benchmarks to run: " + ", ".join(BENCHMARKS))
+    parser.add_argument('--json', metavar='FILE', help="writes the results of the suite to FILE")
+    parser.add_argument('--check', action='store_true', help="fails if a stage of the suite or the startup regressed")
+    parser.add_argument('--update', action='store_true',
+                        help="stores the ratios of the suite or the startup as the thresholds")
+    args = parser.parse_args(argv)
+    status = 0
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}: {BENCHMARKS[name].__doc__}")
+        if name == 'suite':
+            status = bench_suite(args.json, args.check, args.update) or status
+        elif name == 'startup':
+            status = bench_startup(args.check, args.update) or status
+        else:
+            BENCHMARKS[name]()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
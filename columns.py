@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Columns of numbers pasted from spreadsheets and logs.
+
+The text is read value by value into an array('d'), 8 bytes per value, without splitting it into a list of fields
+nor making tokens for the parser. The values are separated by new lines, tabs, semicolons, commas or spaces. The
+values may end with an engineering prefix, like 4.7k. The fields that aren't numbers, like headers, are skipped.
+
+In a column, with one value per line or per cell, a comma or a space between groups of 3 digits is a thousands
+separator, so "1,234" is one value and "1,2,3" three. On a single line, as in CSV, commas and spaces separate the
+values, so "100,200,300" is three values, unless the number has decimals, like "1,234.5", or is grouped with
+apostrophes or no-break spaces. A table, whose lines have the same number of tabs, semicolons or commas, is read as
+its only column of numbers.
+"""
+import re
+from array import array
+
+from math_parser import Column, Parser
+
+_EXPONENT_PREFIX = r"(?:[eE][-+]?\d+)?[a-zA-Z]?"
+_FIELD_END = r"(?=[ ]*(?:[\r\n\t;,]|\Z))"
+# A number with thousands separators, or a field between the separators. The number only matches when followed by
+# the end of the field, so that "1,2345" is taken as two values
+FIELD = re.compile(rf"[-+]?\d{{1,3}}(?:,\d{{3}})+(?:\.\d*)?{_EXPONENT_PREFIX}{_FIELD_END}|[^\r\n\t;,]+")
+LINE_FIELD = re.compile(rf"[-+]?\d{{1,3}}(?:,\d{{3}})+\.\d*{_EXPONENT_PREFIX}{_FIELD_END}|[^\r\n\t;,]+")
+GROUPED = re.compile(rf"[-+]?\d{{1,3}}(?:[ ,'\u00a0\u202f]\d{{3}})+(?:\.\d*)?{_EXPONENT_PREFIX}")
+LINE_GROUPED = re.compile(rf"[-+]?\d{{1,3}}(?:(?:['\u00a0\u202f]\d{{3}})+(?:\.\d*)?|(?:[ ,]\d{{3}})+\.\d*)"
+                          rf"{_EXPONENT_PREFIX}")
+GROUP_SEPARATORS = re.compile(r"[ ,'\u00a0\u202f]")
+COLUMN_SEPARATORS = re.compile(r"[\r\n\t;]")
+TABLE_SEPARATORS = '\t;,'
+TABLE_SAMPLE_LINES = 8  # Lines looked at to tell whether the text is a table
+
+
+def values(text: str):
+    """Iterates over the numbers in the text."""
+    return (value for value in _fields(text) if value is not None)
+
+
+def _fields(text: str):
+    """Iterates over the values of the fields, and of the words within them, None for those that aren't numbers."""
+    single_line = COLUMN_SEPARATORS.search(text.strip()) is None
+    field_pattern, grouped = (LINE_FIELD, LINE_GROUPED) if single_line else (FIELD, GROUPED)
+    for match in field_pattern.finditer(text):
+        field = match.group()
+        try:
+            yield float(field)  # Most fields are plain numbers, surrounding spaces included
+        except ValueError:
+            field = field.strip()
+            if field:
+                yield from _field_values(field, grouped)
+
+
+def _field_values(field: str, grouped=GROUPED):
+    if grouped.fullmatch(field):
+        yield _word_value(GROUP_SEPARATORS.sub('', field))
+    else:
+        for word in field.split():
+            yield _word_value(word)
+
+
+def _word_value(word: str):
+    try:
+        return float(word)
+    except ValueError:
+        pass
+    prefix = Parser.ENGINEERING_PREFIXES.get(word[-1])
+    if prefix is None:
+        return None
+    try:
+        return float(word[:-1]) * prefix
+    except ValueError:
+        return None
+
+
+def parse_column(text: str) -> array:
+    """Returns the numbers in the text, as an array('d')."""
+    return array('d', values(text))
+
+
+def read_column(text: str):
+    """Returns the numbers in the text as an array('d') when the text is a column of numbers, or None. Most of its
+    fields must be numbers, so that "Room 101" isn't taken for 101. A table must have a single column of numbers,
+    which is returned."""
+    table = _table_layout(text)
+    if table is not None:
+        return _table_column(text, *table)
+    column = array('d')
+    others = 0
+    for value in _fields(text):
+        if value is None:
+            others += 1
+        else:
+            column.append(value)
+    return column if len(column) > others else None
+
+
+def _table_layout(text: str):
+    """Returns the separator and the number of fields of the lines when the text is a table, or None."""
+    lines = [line for line in text.strip().split('\n', TABLE_SAMPLE_LINES)[:TABLE_SAMPLE_LINES] if line.strip()]
+    if len(lines) < 2:
+        return None
+    for separator in TABLE_SEPARATORS:
+        counts = {line.count(separator) for line in lines}
+        if len(counts) == 1 and 0 not in counts:
+            return separator, counts.pop() + 1
+    return None
+
+
+def _table_column(text: str, separator: str, width: int):
+    rows = [line.split(separator) for line in text.strip().splitlines() if line.strip()]
+    if any(len(row) != width for row in rows):
+        return None
+    grouped = LINE_GROUPED if separator == ',' else GROUPED
+    numeric = []
+    for j in range(width):
+        column = array('d', (value for value in (_cell_value(row[j].strip(), grouped) for row in rows)
+                             if value is not None))
+        if len(column) > len(rows) - len(column):
+            numeric.append(column)
+    return numeric[0] if len(numeric) == 1 else None
+
+
+def _cell_value(cell: str, grouped):
+    """The number in the cell of a table, or None unless it holds a single one."""
+    words = list(_field_values(cell, grouped)) if cell else []
+    return words[0] if len(words) == 1 else None
+
+
+def as_variable(column: array):
+    """The value of a variable holding the column: a numpy array sharing its memory when numpy is installed, or
+    else a math_parser.Column. Both are evaluated element-wise like the other arrays."""
+    try:
+        import numpy
+    except ImportError:
+        return Column(column)
+    return numpy.frombuffer(column, dtype=numpy.float64)
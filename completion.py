@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Completion of the identifier at the end of a query, among the functions, the constants and the variables.
+
+The names are kept in a prefix trie whose nodes hold their best completions, ranked, so that a lookup walks the
+prefix and returns the list of its node. Adding a name updates the nodes of its path, and removing one merges again
+the lists of the children of those nodes, instead of scanning all the names on each keystroke.
+"""
+import bisect
+import re
+from collections import namedtuple
+
+import math_parser
+
+COMPLETIONS = 5  # Completions kept per node of the trie
+KINDS = ('variable', 'user function', 'function', 'constant')  # Ranked in this order, then shorter names first
+IDENTIFIER_AT_END = re.compile(r'(?<![\w.])[a-zA-Z]\w*$')
+
+Completion = namedtuple('Completion', 'name kind signature doc')
+
+
+def rank(completion: Completion) -> tuple:
+    return KINDS.index(completion.kind), len(completion.name), completion.name
+
+
+class CompletionIndex:
+    """Prefix trie of completions. Each node is a list [children, best, ending], best being the sorted (rank,
+    completion) pairs of the best completions below the node, and ending the completions of the name ending at the
+    node, one per kind, as a variable can have the name of a constant."""
+
+    def __init__(self, size: int = COMPLETIONS):
+        self.size = size
+        self.root = [{}, [], []]
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, completion: Completion):
+        """Adds the completion, replacing the one of the same name and kind."""
+        key = completion.name, completion.kind
+        if key in self.entries:
+            self.remove(*key)
+        self.entries[key] = completion
+        item = rank(completion), completion
+        node = self.root
+        self._offer(node, item)
+        for char in completion.name:
+            node = node[0].setdefault(char, [{}, [], []])
+            self._offer(node, item)
+        node[2].append(completion)
+
+    def _offer(self, node: list, item: tuple):
+        best = node[1]
+        if len(best) < self.size or item < best[-1]:
+            bisect.insort(best, item)
+            del best[self.size:]
+
+    def remove(self, name: str, kind: str):
+        completion = self.entries.pop((name, kind), None)
+        if completion is None:
+            return
+        path = [self.root]
+        for char in name:
+            path.append(path[-1][0][char])
+        path[-1][2].remove(completion)
+        for node in reversed(path):  # The children are updated before their parent
+            if not any(c is completion for _, c in node[1]):
+                break  # Nor is it in the lists of the ancestors
+            items = [item for child in node[0].values() for item in child[1]]
+            items.extend((rank(c), c) for c in node[2])
+            node[1] = sorted(items)[:self.size]
+
+    def complete(self, prefix: str) -> list:
+        """Returns the best completions of the prefix, ranked."""
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        return [completion for _, completion in node[1]]
+
+
+def signature(name: str, function) -> str:
+    """The signature of the function, read from its attributes instead of with inspect, which is slow to import."""
+    text = getattr(function, '__text_signature__', None)  # Functions of the math module
+    if text:
+        parameters = [p.strip() for p in text.strip('()').split(',')]
+        return f"{name}({', '.join(p for p in parameters if p not in ('$module', '/', '*'))})"
+    code = getattr(function, '__code__', None)
+    if code is None:
+        doc = first_line(function.__doc__)  # Some functions of the math module start their docstring with it
+        return doc if doc.startswith(name + '(') and doc.endswith(')') else f"{name}(…)"
+    parameters = list(code.co_varnames[:code.co_argcount])
+    defaults = function.__defaults__ or ()
+    for i, default in enumerate(defaults, len(parameters) - len(defaults)):
+        parameters[i] = f"{parameters[i]}={default}"
+    if code.co_flags & 0x04:  # CO_VARARGS
+        parameters.append('*' + code.co_varnames[code.co_argcount])
+    return f"{name}({', '.join(parameters)})"
+
+
+def first_line(doc: str) -> str:
+    return doc.strip().split('\n', 1)[0] if doc else ''
+
+
+def function_completion(name: str, function) -> Completion:
+    if isinstance(function, math_parser.UserFunction):
+        return Completion(name, 'user function', function.signature, function.body)
+    return Completion(name, 'function', signature(name, function), first_line(function.__doc__))
+
+
+def builtin_completions() -> list:
+    completions = [function_completion(name, function) for name, function in math_parser.Parser.FUNCTIONS.items()
+                   if not isinstance(function, math_parser.UserFunction)]
+    completions.extend(Completion(name, 'constant', name, repr(value))
+                       for name, value in math_parser.Parser.CONSTANTS.items())
+    return completions
+
+
+index = CompletionIndex()
+for _completion in builtin_completions():
+    index.add(_completion)
+
+
+def add_variable(name: str):
+    index.add(Completion(name, 'variable', name, ''))
+
+
+def remove_variable(name: str):
+    index.remove(name, 'variable')
+
+
+def add_function(function):
+    index.add(function_completion(function.name, function))
+
+
+def remove_function(name: str):
+    index.remove(name, 'user function')
+
+
+def identifier_at_end(query: str) -> str:
+    match = IDENTIFIER_AT_END.search(query.rstrip())
+    return match.group() if match else ''
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Resident evaluator, so that each query doesn't pay for starting Python and loading the calculator.
+
+The daemon keeps main.py loaded, with its variables and caches, and listens on a Unix socket, or on a loopback TCP
+port where Unix sockets aren't available. main.py forwards the JSON-RPC request it gets from Wox and prints back
+what the daemon would have printed. When there is no daemon, main.py answers the request itself and starts one in
+the background, which exits after IDLE_TIMEOUT seconds without requests. Setting the environment variable
+WOX_PYCALC_DAEMON to 0 disables it.
+
+Each request and response is one line of JSON. The request is the one Wox passes to the plugin, with the token
+from the info file added. The response has either the "stdout" or the "error" of the call.
+"""
+import json
+import os
+import socket
+import sys
+
+IDLE_TIMEOUT = 30 * 60
+TMP_DIR = os.environ.get('TMP') or os.environ.get('TMPDIR') or '/tmp'
+INFO_PATH = os.path.join(TMP_DIR, "wox_pycalc_daemon.json")  # Address of the daemon and its token
+SOCKET_PATH = os.path.join(TMP_DIR, "wox_pycalc_daemon.sock")
+LOCK_PATH = os.path.join(TMP_DIR, "wox_pycalc_daemon.lock")  # Held by the daemon, so that only one starts
+CONNECT_TIMEOUT = 0.5
+
+
+def enabled() -> bool:
+    return os.environ.get('WOX_PYCALC_DAEMON', '1') != '0'
+
+
+def _connect(info: dict) -> socket.socket:
+    address = info['address']
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = tuple(address)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return sock
+
+
+def call(request: dict) -> dict:
+    """Sends the request to the daemon and returns its response. Raises OSError or ValueError if there is no
+    daemon running."""
+    with open(INFO_PATH) as f:
+        info = json.load(f)
+    with _connect(info) as sock:
+        request = dict(request, token=info['token'])
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection")
+    return json.loads(line)
+
+
+def forward(argv: list) -> bool:
+    """Forwards the JSON-RPC request in argv to the daemon and prints its output. Returns False if the daemon
+    couldn't be reached, in which case the caller should handle the request."""
+    if not enabled() or len(argv) < 2:
+        return False
+    try:
+        response = call(json.loads(argv[1]))
+    except (OSError, ValueError):
+        spawn()
+        return False
+    if 'error' in response:  # Not handled again here, as the request may have changed the state before failing
+        sys.stderr.write(response['error'] + '\n')
+        return True
+    sys.stdout.write(response['stdout'])
+    return True
+
+
+def spawn():
+    """Starts a daemon in the background."""
+    import subprocess
+    command = [sys.executable, os.path.abspath(__file__), 'serve']
+    if sys.platform.startswith("win"):
+        flags = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        subprocess.Popen(command, creationflags=flags, close_fds=True, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=os.path.dirname(command[1]))
+    else:
+        subprocess.Popen(command, start_new_session=True, close_fds=True, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=os.path.dirname(command[1]))
+
+
+def dispatch(calculator, request: dict) -> str:
+    """Calls the method of the calculator the way Wox does, returning what it prints."""
+    import contextlib
+    import io
+    method = request.get('method')
+    parameters = request.get('parameters') or []
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        results = getattr(calculator, method)(*parameters)
+        if method in ('query', 'context_menu'):
+            print(json.dumps({"result": results}))
+    return output.getvalue()
+
+
+class Server:
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT):
+        import secrets
+        import threading
+        import main
+        import pipeline
+        self.main = main
+        self.calculator = main.Calculator.__new__(main.Calculator)  # Wox.__init__ would handle sys.argv
+        self.lock = threading.Lock()  # The calculator state and the stdout redirection are shared
+        self.token = secrets.token_hex(16)
+        self.idle_timeout = idle_timeout
+        self.sock = None
+        self.pipeline = pipeline.QueryPipeline(self.query)
+
+    def query(self, query: str, cancelled) -> str:
+        """Calculates the query as dispatch() would, unless it is cancelled by a newer one."""
+        with self.lock:
+            self.refresh('query')
+            results = self.main.calculate(query, cancelled)
+        return json.dumps({"result": results}) + '\n'
+
+    def refresh(self, method: str):
+        """Reloads what may have changed since the last request: the variables stored by another process and x,
+        the number in the clipboard."""
+        self.main.refresh_variables()
+        if method == 'query':
+            self.main.read_clipboard()
+
+    def listen(self):
+        if hasattr(socket, 'AF_UNIX'):
+            try:
+                os.unlink(SOCKET_PATH)
+            except OSError:
+                pass
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            old_umask = os.umask(0o077)
+            try:
+                self.sock.bind(SOCKET_PATH)
+            finally:
+                os.umask(old_umask)
+            address = SOCKET_PATH
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.bind(('127.0.0.1', 0))
+            address = self.sock.getsockname()
+        self.sock.listen()
+        self.sock.settimeout(self.idle_timeout)
+        temp_path = f"{INFO_PATH}.{os.getpid()}"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'address': address, 'token': self.token, 'pid': os.getpid()}, f)
+        os.replace(temp_path, INFO_PATH)
+
+    def handle(self, conn: socket.socket):
+        with conn, conn.makefile('rb') as reader:
+            try:
+                request = json.loads(reader.readline())
+                if request.pop('token', None) != self.token:
+                    raise PermissionError("Invalid token")
+                if request.get('method') == 'query':
+                    output = self.pipeline.submit(*request.get('parameters') or [''])
+                    if output is None:  # Stale, before any query completed
+                        output = json.dumps({"result": []}) + '\n'
+                    response = {'stdout': output}
+                else:
+                    with self.lock:
+                        self.refresh(request.get('method'))
+                        response = {'stdout': dispatch(self.calculator, request)}
+            except Exception as err:
+                response = {'error': f"{type(err).__name__}: {err}"}
+            conn.sendall(json.dumps(response).encode() + b'\n')
+
+    def serve_forever(self):
+        import threading
+        self.listen()
+        try:
+            while True:
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.timeout:
+                    return  # Idle for too long
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        self.sock.close()
+        self.pipeline.close()
+        with self.lock:
+            self.main.save_snapshot()
+        try:
+            with open(INFO_PATH) as f:
+                if json.load(f).get('pid') == os.getpid():
+                    os.unlink(INFO_PATH)
+        except (OSError, ValueError):
+            pass
+
+
+def _try_lock(path: str):
+    """Locks the file without waiting. Returns its descriptor, or None when another process holds the lock, which
+    is released when that process exits."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def serve(idle_timeout: float = IDLE_TIMEOUT):
+    # Each query arriving before the daemon listens spawns another one, which must not replace its socket
+    lock = _try_lock(LOCK_PATH)
+    if lock is None:
+        return  # Another one is starting or running
+    try:
+        try:
+            call({'method': 'ping'})
+        except (OSError, ValueError):
+            Server(idle_timeout).serve_forever()
+        # else there is already one running
+    finally:
+        os.close(lock)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['serve']:
+        serve()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import math
+import sys
+from array import array
+
+
+def is_array(value) -> bool:
+    """Tells whether the value is a numpy array or a column of numbers, an array('d')."""
+    if isinstance(value, array):
+        return True
+    np = sys.modules.get('numpy')  # numpy is only loaded when an array was created
+    return np is not None and isinstance(value, np.ndarray)
+
+
+def to_eng(value):
+    e = 0
+    p = 1
+    avalue = abs(value)
+    while p < avalue:
+        e += 1
+        p *= 1000
+    while p > avalue:
+        e -= 1
+        p /= 1000
+    if -5 <= e < 0:
+        suffix = "fpnum"[e]
+    elif e == 0:
+        suffix = ''
+    elif e == 1:
+        suffix = "k"
+    elif e == 2:
+        suffix = 'Meg'
+    elif e == 3:
+        suffix = 'Giga'
+    else:
+        return f'{value:E}'
+    return f'{value * 1000 ** -e:g}{suffix:}'
+
+
+def divide_groups_4(s: str) -> str:
+    """Divides the text in segments of 4 characters separated by spaces. Division is right aligned."""
+    first_space = len(s) % 4
+    return s[:first_space] + " " + " ".join(s[i:i+4] for i in range(first_space, len(s), 4))
+
+
+BIG_INT_DIGITS = 40  # Integers with more digits are shown as a mantissa, an exponent and the number of digits
+BIG_INT_EDGE = 16  # Number of digits shown at each end of the full text of a big integer
+
+
+def decimal_digits(value: int) -> int:
+    """Returns the number of decimal digits of the integer, without converting it to text."""
+    value = abs(value)
+    if value < 10:
+        return 1
+    log = math.log10(value)
+    digits = int(log) + 1
+    if log - int(log) < 1e-9 or log - int(log) > 1 - 1e-9:  # Too close to a power of 10 to tell
+        digits = int(round(log)) + (value >= 10 ** int(round(log)))
+    return digits
+
+
+def is_big_int(value) -> bool:
+    return isinstance(value, int) and value.bit_length() > BIG_INT_DIGITS * 3.33
+
+
+def format_big_int(value: int) -> str:
+    """Shows the leading digits of the integer, in a time that doesn't depend on its size."""
+    digits = decimal_digits(value)
+    mantissa = f"{10 ** (math.log10(abs(value)) - (digits - 1)):.6f}"
+    if mantissa.startswith('10'):  # Rounded up
+        mantissa = "9.999999"
+    sign = '-' if value < 0 else ''
+    return f"{sign}{mantissa}e{digits - 1} ({digits:,} digits)".replace(',', ' ')
+
+
+def int_to_decimal(value: int) -> str:
+    """Returns the decimal text of the integer. Unlike str(), it isn't limited in the number of digits and it takes
+    a time less than quadratic in the number of digits: the integer is split in halves, converted to Decimal and
+    put together with the multiplication of the decimal module, which is subquadratic."""
+    if value.bit_length() < 13000:  # Less than 4000 digits, below the limit of str()
+        return str(value)
+    import decimal
+    two = decimal.Decimal(2)
+    powers = {}
+
+    def power_of_2(w):
+        result = powers.get(w)
+        if result is None:
+            if w <= 128:
+                result = two ** w
+            elif w - 1 in powers:
+                result = powers[w - 1] * 2
+            else:
+                result = power_of_2(w >> 1) * power_of_2(w - (w >> 1))
+            powers[w] = result
+        return result
+
+    def convert(n, w):
+        if w <= 128:
+            return decimal.Decimal(n)
+        half = w >> 1
+        high = n >> half
+        low = n - (high << half)
+        return convert(low, half) + convert(high, w - half) * power_of_2(half)
+
+    with decimal.localcontext() as context:
+        context.prec = decimal.MAX_PREC
+        context.Emax = decimal.MAX_EMAX
+        context.Emin = decimal.MIN_EMIN
+        context.traps[decimal.Inexact] = True
+        text = str(convert(abs(value), abs(value).bit_length()))
+    return '-' + text if value < 0 else text
+
+
+def abbreviate(text: str, edge: int = BIG_INT_EDGE) -> str:
+    """Shows the first and the last characters of a long text."""
+    if len(text) <= 2 * edge + 1:
+        return text
+    return f"{text[:edge]}…{text[-edge:]}"
+
+
+ARRAY_SUMMARY_EDGE = 3  # Number of values shown at each end of a long array
+
+
+def format_array(result) -> str:
+    if isinstance(result, array):
+        values, shape = result, (len(result),)
+    else:
+        values, shape = result.flatten(), result.shape
+    if len(values) == 1:
+        return format_result(values.tolist()[0])
+    if len(values) <= 2 * ARRAY_SUMMARY_EDGE + 1:
+        return '[' + ', '.join(map(format_result, values.tolist())) + ']'
+    head = ', '.join(map(format_result, values[:ARRAY_SUMMARY_EDGE].tolist()))
+    tail = ', '.join(map(format_result, values[-ARRAY_SUMMARY_EDGE:].tolist()))
+    shape = 'x'.join(map(str, shape))
+    return f'[{head}, …, {tail}] ({shape} values)'
+
+
+def format_result(result):
+    if hasattr(result, '__call__'):
+        # show docstring for other similar methods
+        raise NameError
+    if isinstance(result, str):
+        return result
+    if is_array(result):
+        return format_array(result)
+    if is_big_int(result):
+        return format_big_int(result)
+    if isinstance(result, int) or isinstance(result, float):
+        if isinstance(result, int) or result.is_integer():
+            return f'{int(result):,}'.replace(',', ' ')
+        else:
+            return f'{round(float(result), 5):,}'.replace(',', ' ')
+    elif hasattr(result, '__iter__'):
+        return '[' + ', '.join(list(map(format_result, list(result)))) + ']'
+    elif isinstance(result, bool):
+        return 'True' if result else 'False'
+    else:
+        return str(result)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Stand-in for the Wox host, to try the plugin and measure it outside of Wox.
+
+    python host.py "R1 // R2"
+    python host.py -m context_menu 1234
+
+Like Wox, each call starts ``python main.py`` with the JSON-RPC request as its argument and reads the JSON it prints.
+When the wox module of the host isn't installed, an equivalent one is put in the path of the plugin.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The part of wox.py, shipped with Wox, used by the plugin
+WOX_SOURCE = '''\
+import inspect
+import json
+import sys
+
+
+class Wox(object):
+    def __init__(self):
+        rpc_request = json.loads(sys.argv[1])
+        self.proxy = rpc_request.get("proxy", {})
+        request_method_name = rpc_request.get("method")
+        request_parameters = rpc_request.get("parameters")
+        methods = inspect.getmembers(self, predicate=inspect.ismethod)
+        request_method = dict(methods)[request_method_name]
+        results = request_method(*request_parameters)
+        if request_method_name == "query" or request_method_name == "context_menu":
+            print(json.dumps({"result": results}))
+
+
+class WoxAPI(object):
+    @classmethod
+    def change_query(cls, query, requery=False):
+        print(json.dumps({"method": "Wox.ChangeQuery", "parameters": [query, requery]}))
+'''
+
+_wox_dir = None
+
+
+def plugin_env(env: dict = None) -> dict:
+    """The environment the plugin is started with."""
+    global _wox_dir
+    env = dict(os.environ if env is None else env)
+    env.setdefault('TMP', tempfile.gettempdir())
+    if importlib.util.find_spec('wox') is None:
+        if _wox_dir is None:
+            _wox_dir = tempfile.mkdtemp(prefix='wox_host_')
+            with open(os.path.join(_wox_dir, 'wox.py'), 'w') as f:
+                f.write(WOX_SOURCE)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [_wox_dir, env.get('PYTHONPATH')]))
+    return env
+
+
+def invoke(method: str, *parameters, env: dict = None) -> list:
+    """Calls a method of the plugin in a new process, as Wox does. Returns the JSON objects it printed."""
+    request = json.dumps({'method': method, 'parameters': list(parameters)})
+    process = subprocess.run([sys.executable, os.path.join(PLUGIN_DIR, 'main.py'), request], cwd=PLUGIN_DIR,
+                             env=plugin_env(env), stdout=subprocess.PIPE, check=True, text=True)
+    return [json.loads(line) for line in process.stdout.splitlines() if line.startswith('{')]
+
+
+def _json_or_text(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calls the plugin as Wox does.")
+    parser.add_argument('parameters', nargs='*')
+    parser.add_argument('-m', '--method', default='query')
+    args = parser.parse_args(argv)
+    parameters = args.parameters
+    if args.method != 'query':  # The context data and the values stored are given as JSON
+        parameters = [_json_or_text(parameter) for parameter in parameters]
+    for output in invoke(args.method, *parameters):
+        for result in output.get('result') or [output]:
+            print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
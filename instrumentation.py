@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Timings and counters of the calculator.
+
+The samples are kept in memory, in ring buffers holding the last RING_SIZE durations of each phase, and can also be
+appended to a buffered sink file. While disabled, clock() returns 0 and record() returns at once, so the
+instrumented code only pays for a couple of function calls.
+"""
+import atexit
+import math
+import os
+import time
+from collections import Counter, deque
+
+RING_SIZE = 1000
+SINK_MAX_SIZE = 1 << 20  # The sink is rotated when it gets bigger than this
+
+enabled = False
+samples = {}  # phase -> durations in nanoseconds
+counters = Counter()
+histograms = {}  # name -> Counter of the values, rounded up to a power of 2
+_sink = None
+
+
+def enable(sink_path: str = None):
+    """Starts recording. If sink_path is given, the samples are also appended to that file."""
+    global enabled, _sink
+    enabled = True
+    if sink_path and _sink is None:
+        try:
+            if os.path.getsize(sink_path) > SINK_MAX_SIZE:
+                os.replace(sink_path, sink_path + '.1')
+        except OSError:
+            pass
+        _sink = open(sink_path, 'a', buffering=1 << 16)
+        atexit.register(_sink.close)
+
+
+def disable():
+    global enabled, _sink
+    enabled = False
+    if _sink is not None:
+        _sink.close()
+        atexit.unregister(_sink.close)
+        _sink = None
+
+
+def reset():
+    samples.clear()
+    counters.clear()
+    histograms.clear()
+
+
+def clock() -> int:
+    """Returns the start time to be given to record(), or 0 when disabled."""
+    return time.perf_counter_ns() if enabled else 0
+
+
+def record(phase: str, start: int) -> int:
+    """Records the time elapsed since start as a sample of phase. Returns the current clock, so that consecutive
+    phases can be chained."""
+    if not start:
+        return 0
+    now = time.perf_counter_ns()
+    add_sample(phase, now - start)
+    if _sink is not None:
+        _sink.write(f"{phase} {now - start}\n")
+    return now
+
+
+def add_sample(phase: str, duration: int):
+    ring = samples.get(phase)
+    if ring is None:
+        ring = samples[phase] = deque(maxlen=RING_SIZE)
+    ring.append(duration)
+
+
+def count(name: str, n: int = 1):
+    if enabled:
+        counters[name] += n
+
+
+def observe(name: str, value: int):
+    """Adds value to the histogram name."""
+    if enabled:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Counter()
+        histogram[1 << max(value - 1, 0).bit_length()] += 1
+
+
+def load(sink_path: str):
+    """Reads the samples of a sink into the ring buffers. This gives the statistics of the previous runs when each
+    query is made by a new process."""
+    if _sink is not None:
+        _sink.flush()
+    try:
+        with open(sink_path) as f:
+            lines = deque(f, maxlen=RING_SIZE * 8)
+    except OSError:
+        return
+    for line in lines:
+        phase, _, duration = line.partition(' ')
+        try:
+            add_sample(phase, int(duration))
+        except ValueError:
+            pass  # A line truncated by a crash
+
+
+def percentile(values, p: float):
+    """Nearest rank percentile of the values, p going from 0 to 100."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+
+
+def summary() -> dict:
+    """Returns a dictionary with the number of samples and the p50 and p99 in milliseconds of each phase."""
+    return {phase: (len(ring), percentile(ring, 50) / 1e6, percentile(ring, 99) / 1e6)
+            for phase, ring in samples.items() if ring}
@@ -1,70 +1,267 @@
 # -*- coding: utf-8 -*-
+if __name__ == '__main__':
+    import sys
+    import daemon
+    if daemon.forward(sys.argv):  # Answered by the resident process, without loading the calculator here
+        sys.exit(0)
+
 import os
-import traceback
+import sys
+from array import array
 from math import atan2, degrees
 
-try:
-    import pyperclip
-except ImportError:
+_clipboard = None  # The (copy, paste) functions, found on first use as the query rarely needs them
 
-    try:
-        import clipboard
-    except ImportError:
-        import sys
-        def copy_to_clipboard(text):
-            if sys.platform.startswith("win"):
-                command = f'echo {text.strip()} | clip'
-            elif sys.platform.startswith("darwin"):
-                command = f'echo "{text.strip()}" | pbcopy'
-            elif sys.platform.startswith("linux"):
-                command = f'echo "{text.strip()}" | xclip -selection clipboard'
+
+def _clipboard_functions():
+    global _clipboard
+    if _clipboard is None:
+        try:
+            import pyperclip
+        except ImportError:
+            try:
+                import clipboard
+            except ImportError:
+                _clipboard = _system_copy, _system_paste
             else:
-                raise RuntimeError("Unsupported operating system")
+                _clipboard = clipboard.copy, clipboard.paste
+        else:
+            _clipboard = pyperclip.copy, pyperclip.paste
+    return _clipboard
 
-            os.system(command)
 
-        def paste_from_clipboard():
-            if sys.platform.startswith("win"):
-                return os.popen("powershell Get-Clipboard").read().strip()
-            elif sys.platform.startswith("darwin"):
-                return os.popen("pbpaste").read().strip()
-            elif sys.platform.startswith("linux"):
-                return os.popen("xclip -selection clipboard -o").read().strip()
-            else:
-                raise RuntimeError("Unsupported operating system")
+def _system_copy(text):
+    if sys.platform.startswith("win"):
+        command = f'echo {text.strip()} | clip'
+    elif sys.platform.startswith("darwin"):
+        command = f'echo "{text.strip()}" | pbcopy'
+    elif sys.platform.startswith("linux"):
+        command = f'echo "{text.strip()}" | xclip -selection clipboard'
     else:
-        copy_to_clipboard = clipboard.copy
-        paste_from_clipboard = clipboard.paste
+        raise RuntimeError("Unsupported operating system")
+
+    os.system(command)
+
+
+def _system_paste():
+    if sys.platform.startswith("win"):
+        return os.popen("powershell Get-Clipboard").read().strip()
+    elif sys.platform.startswith("darwin"):
+        return os.popen("pbpaste").read().strip()
+    elif sys.platform.startswith("linux"):
+        return os.popen("xclip -selection clipboard -o").read().strip()
+    else:
+        raise RuntimeError("Unsupported operating system")
+
+
+def copy_to_clipboard(text):
+    _clipboard_functions()[0](text)
 
+
+def paste_from_clipboard():
+    return _clipboard_functions()[1]()
+
+
+if sys.platform.startswith("win"):
+    def clipboard_sequence_number():
+        import ctypes
+        return ctypes.windll.user32.GetClipboardSequenceNumber()
 else:
-    copy_to_clipboard = pyperclip.copy
-    paste_from_clipboard = pyperclip.paste
+    def clipboard_sequence_number():
+        return None  # No cheap way to tell whether the clipboard changed
 
+import completion
+import instrumentation
 import math_parser
+import snapshot
+import varstore
+import worker
+import worksheet
+from formatting import (is_array, to_eng, divide_groups_4, format_result, is_big_int, format_big_int,
+                        int_to_decimal, abbreviate)
+
+
+class ClipboardNumber:
+    """The number in the clipboard, or the column of numbers when it holds several, as copied from a spreadsheet.
+    The clipboard is read again only when its sequence number changed or, where there is no sequence number, after
+    invalidate() is called."""
+
+    def __init__(self):
+        self.valid = False
+        self.sequence = None
+        self.value = None
+
+    def __call__(self):
+        sequence = clipboard_sequence_number()
+        if not self.valid or sequence != self.sequence:
+            try:
+                text = paste_from_clipboard().strip()
+            except Exception:
+                text = None
+            self.value = clipboard_value(text) if text else None
+            self.sequence = sequence
+            self.valid = True
+        if self.value is None:
+            raise LookupError("The clipboard is empty")
+        return self.value
+
+    def invalidate(self):
+        if self.sequence is None:
+            self.valid = False
+
+
+def clipboard_value(text):
+    """The number or the column of numbers in the text, or None when it holds neither, so that x keeps its value."""
+    value = math_parser.number(text)
+    if not isinstance(value, str):
+        return value
+    import columns  # Only needed when the clipboard holds text
+    column = columns.read_column(text)
+    if not column:
+        return None
+    if len(column) == 1:
+        return column[0]  # A number with thousands separators or an engineering prefix
+    return columns.as_variable(column)
+
+
+variables = math_parser.LazyEnv()
+clipboard_x = ClipboardNumber()
+array_definitions = {}  # Arrays are stored as the expression that creates them, or else as {'array': values}
+sheet = worksheet.Worksheet(variables)  # Variables defined by formulas are stored as {'formula': expression}
+
+
+def is_formula(value) -> bool:
+    return isinstance(value, dict) and 'formula' in value
+
+
+def stored_value(varname, value):
+    """Converts the value stored for a variable into its value. Arrays are stored as the expression creating them,
+    or as their values when the expression can't create them again."""
+    array_definitions.pop(varname, None)
+    if isinstance(value, dict) and 'array' in value:
+        import columns
+        return columns.as_variable(array('d', value['array']))
+    if isinstance(value, str):
+        try:
+            result, _ = worker.evaluate(value, variables)
+        except Exception:
+            pass
+        else:
+            if is_array(result):
+                names = math_parser.variable_names(math_parser.parse_cache.lookup(value)[0])
+                if varname not in names and not names & variables.lazy.keys():  # Nor the clipboard, which will change
+                    array_definitions[varname] = value
+                return result
+    return value
+
+
+TMP_DIR = os.environ.get('TMP') or os.environ.get('TMPDIR') or '/tmp'
+xFilePath = TMP_DIR + os.sep + "wox_pycalc_x.txt"  # Where the previous versions stored the variables
+varsFilePath = TMP_DIR + os.sep + "wox_pycalc_vars.txt"
+statsFilePath = TMP_DIR + os.sep + "wox_pycalc_stats.txt"
+snapshotFilePath = TMP_DIR + os.sep + "wox_pycalc_snapshot.bin"
+if os.environ.get('WOX_PYCALC_STATS', '0') != '0':  # Recording is opt-in, as each query would append to the file
+    instrumentation.enable(statsFilePath)
+store = varstore.VariableStore(varsFilePath, legacy_path=xFilePath)
+
+
+def load_function(key, data):
+    """Defines the user function stored under key, from its parsed body."""
+    name = key[:-len(varstore.FUNCTION_SUFFIX)]
+    if data is None:
+        math_parser.undefine_function(name)
+        completion.remove_function(name)
+        sheet.function_changed(name)
+        return
+    try:
+        function = math_parser.UserFunction.from_data(name, data, variables)
+        math_parser.define_function(function)
+    except (LookupError, TypeError, ValueError, NameError):
+        return
+    completion.add_function(function)
+    sheet.function_changed(name)
+
+
+def load_variables(state: tuple = None):
+    """Loads the stored variables and functions, reading the journal from the state of a snapshot if given."""
+    for varname in variables.stored():
+        completion.remove_variable(varname)
+    variables.clear()
+    array_definitions.clear()
+    sheet.clear()
+    for function in math_parser.user_functions():
+        math_parser.undefine_function(function.name)
+        completion.remove_function(function.name)
+    try:
+        stored = store.load(state)
+    except OSError:
+        return
+    formulas = {}
+    for varname, varvalue in stored.items():  # The functions first, as the expressions are parsed with them
+        if varname.endswith(varstore.FUNCTION_SUFFIX):
+            load_function(varname, varvalue)
+    for varname, varvalue in stored.items():
+        if varname.endswith(varstore.FUNCTION_SUFFIX):
+            continue
+        elif is_formula(varvalue):
+            formulas[varname] = varvalue['formula']
+        else:
+            variables[varname] = stored_value(varname, varvalue)
+            completion.add_variable(varname)
+    for varname, text in formulas.items():
+        try:
+            sheet.define(varname, text, recompute=False)
+        except Exception:
+            continue
+        completion.add_variable(varname)
+    sheet.recompute_all()
 
 
-variables = {}
+def refresh_variables():
+    """Updates the variables changed by other processes since they were loaded."""
+    try:
+        changed = store.refresh()
+    except OSError:
+        return
+    for varname in changed:
+        if varname.endswith(varstore.FUNCTION_SUFFIX):
+            load_function(varname, store.values.get(varname))
+        elif is_formula(store.values.get(varname)):
+            try:
+                sheet.define(varname, store.values[varname].get('formula'))
+            except Exception:
+                continue
+            completion.add_variable(varname)
+        elif varname in store.values:
+            sheet.assign(varname, stored_value(varname, store.values[varname]))
+            completion.add_variable(varname)
+        else:
+            sheet.remove(varname)
+            array_definitions.pop(varname, None)
+            completion.remove_variable(varname)
 
-xFilePath = os.environ['TMP'] + os.sep + "wox_pycalc_x.txt"
 
-try:
-    with open(xFilePath, "r") as xFile:
-        for line in xFile.readlines():
-            try:
-                varname, varvalue = line.split('=', 2)
-            except:
-                pass
-            else:
-                variables[varname.strip()] = math_parser.number(varvalue.strip())
-except:
-    pass
-
-try:
-    x = math_parser.number(paste_from_clipboard())
-except:
-    pass
+def read_clipboard():
+    """Binds x to the number in the clipboard. The clipboard is only read if an expression uses x."""
+    clipboard_x.invalidate()
+    variables.bind_lazy('x', clipboard_x)
+
+
+def save_snapshot():
+    snapshot.save(snapshotFilePath, store, previous=warm_start)
+
+
+warm_start = snapshot.load(snapshotFilePath)
+if warm_start is not None:
+    math_parser.parse_cache.preload = warm_start.expressions
+    try:
+        load_variables(warm_start.variables)
+    except (TypeError, ValueError):  # A snapshot of another version of the store
+        load_variables()
 else:
-    variables['x'] = x
+    load_variables()
+read_clipboard()
+completion.add_variable('x')
 
 
 # TODO: Implement storing of variables. Eliminates = operators
@@ -72,75 +269,149 @@ else:
 # TODO: Implement the XOR operator that existed on previous version
 # TODO: Storing configurations such as formatting precision, preferred copy to clipboard format
 
-def write_to_file(variables2store):
+def store_variable(varname):
+    if varname in sheet.formulas:
+        value = {'formula': sheet.formulas[varname].text}
+    else:
+        value = variables.stored()[varname]
+    if is_array(value):
+        value = array_definitions.get(varname) or {'array': [float(v) for v in value]}
     try:
-        with open(xFilePath, "w") as xFile:
-            for varname, varvalue in variables2store.items():
-                xFile.write(f"{varname}={varvalue}\n")
-    except:
+        store.set(varname, value)
+    except (OSError, TypeError, ValueError):
         pass
 
 
-def to_eng(value):
-    e = 0
-    p = 1
-    avalue = abs(value)
-    while p < avalue:
-        e += 1
-        p *= 1000
-    while p > avalue:
-        e -= 1
-        p /= 1000
-    if -5 <= e < 0:
-        suffix = "fpnum"[e]
-    elif e == 0:
-        suffix = ''
-    elif e == 1:
-        suffix = "k"
-    elif e == 2:
-        suffix = 'Meg'
-    elif e == 3:
-        suffix = 'Giga'
-    else:
-        return f'{value:E}'
-    return f'{value * 1000 ** -e:g}{suffix:}'
+def stats_results():
+    if not instrumentation.samples:
+        instrumentation.load(statsFilePath)  # Each query may have been answered by a different process
+    results = []
+    if not instrumentation.enabled:
+        results.append({
+            "Title": "Latencies not recorded",
+            "SubTitle": "Set the environment variable WOX_PYCALC_STATS=1 to record them",
+            "IcoPath": "icons/app.png",
+        })
+    for phase, (count, p50, p99) in instrumentation.summary().items():
+        results.append({
+            "Title": f"{phase}: p50 {p50:.3f} ms  p99 {p99:.3f} ms",
+            "SubTitle": f"{count} samples",
+            "IcoPath": "icons/app.png",
+        })
+    cache = math_parser.parse_cache.stats()
+    results.append({
+        "Title": f"parse cache: {cache['hits']} hits  {cache['misses']} misses  {cache['evictions']} evictions",
+        "SubTitle": f"{cache['entries']} entries, {cache['size']} characters, "
+                    f"{cache['preloaded']} loaded from the snapshot of the previous process",
+        "IcoPath": "icons/app.png",
+    })
+    calls = math_parser.call_cache.stats()
+    results.append({
+        "Title": f"call cache: {calls['hits']} hits  {calls['misses']} misses",
+        "SubTitle": f"{calls['entries']} memoized calls of the user functions, factorials and powers",
+        "IcoPath": "icons/app.png",
+    })
+    if instrumentation.counters:
+        results.append({
+            "Title": "  ".join(f"{name}: {n}" for name, n in sorted(instrumentation.counters.items())),
+            "SubTitle": "Queries of the daemon discarded because a newer one arrived",
+            "IcoPath": "icons/app.png",
+        })
+    for name, histogram in instrumentation.histograms.items():
+        results.append({
+            "Title": f"{name}: " + "  ".join(f"<={bucket}: {n}" for bucket, n in sorted(histogram.items())),
+            "SubTitle": f"Histogram of the {name} of the parsed expressions",
+            "IcoPath": "icons/app.png",
+        })
+    return results
 
 
-def divide_groups_4(s: str) -> str:
-    """Divides the text in segments of 4 characters separated by spaces. Division is right aligned."""
-    first_space = len(s) % 4
-    return s[:first_space] + " " + " ".join(s[i:i+4] for i in range(first_space, len(s), 4))
+def function_results(signature, body):
+    """Shows the function defined by `f(a, b) = body`, which is stored when the result is selected."""
+    name = signature.group(1)
+    parameters = [p.strip() for p in signature.group(2).split(',')]
+    try:
+        if name in math_parser.Parser.FUNCTIONS and not isinstance(math_parser.Parser.FUNCTIONS[name],
+                                                                   math_parser.UserFunction):
+            raise NameError(f"{name} is a built-in function")
+        function = math_parser.UserFunction(name, parameters, body, environment=variables)
+    except Exception as err:
+        return [{
+            "Title": f"Error: {type(err)}",
+            "SubTitle": str(err),
+            "IcoPath": "icons/app.png",
+        }]
+    return [{
+        "Title": f"{function.signature} := {body.strip()}",
+        "SubTitle": f"{function.signature} = {function.ast}" + ("" if function.pure else
+                                                                f"  (uses {', '.join(sorted(function.free))})"),
+        "IcoPath": "icons/app.png",
+        "JsonRPCAction": {
+            'method': 'store_function',
+            'parameters': [function.signature, body.strip()],
+            'dontHideAfterAction': True
+        }
+    }]
+
+
+def completion_results(query):
+    """Completions of the identifier at the end of the query. Functions are completed with their parenthesis."""
+    identifier = completion.identifier_at_end(query)
+    if not identifier:
+        return []
+    head = query.rstrip()[:-len(identifier)]
+    stored = variables.stored()
+    results = []
+    for c in completion.index.complete(identifier):
+        is_function = c.kind.endswith('function')
+        if c.name == identifier and not is_function:
+            continue
+        doc = abbreviate(format_result(stored[c.name]), 20) if c.name in stored and c.kind == 'variable' else c.doc
+        results.append({
+            "Title": c.signature,
+            "SubTitle": f"{c.kind}: {doc}" if doc else c.kind,
+            "IcoPath": "icons/app.png",
+            "JsonRPCAction": {
+                'method': 'change_query_method' if is_function else 'complete_query',
+                'parameters': [head + c.name],
+                'dontHideAfterAction': True
+            }
+        })
+    return results
 
 
-def format_result(result):
-    if hasattr(result, '__call__'):
-        # show docstring for other similar methods
-        raise NameError
-    if isinstance(result, str):
-        return result
-    if isinstance(result, int) or isinstance(result, float):
-        if int(result) == float(result):
-            return f'{int(result):,}'.replace(',', ' ')
-        else:
-            return f'{round(float(result), 5):,}'.replace(',', ' ')
-    elif hasattr(result, '__iter__'):
+def budget_results(query):
+    """Shows the budget of the evaluations, after changing it with `:budget 5s 512M`."""
+    budget = math_parser.budget
+    for setting in query.split()[1:]:
         try:
-            return '[' + ', '.join(list(map(format_result, list(result)))) + ']'
-        except TypeError:
-            import numpy as np
-            # check if ndarray
-            result = result.flatten()
-            if len(result) > 1:
-                return '[' + ', '.join(list(map(format_result, result.flatten()))) + ']'
+            if setting.endswith('s'):
+                budget.seconds = float(setting[:-1])
             else:
-                return format_result(np.asscalar(result))
-    elif isinstance(result, bool):
-        return 'True' if result else 'False'
-    else:
-        return str(result)
-
-
-def calculate(query):
+                budget.memory = int(math_parser.Parser(setting).parse())
+        except Exception:
+            return [{
+                "Title": f"Invalid budget {setting}",
+                "SubTitle": "Example: :budget 5s 512M",
+                "IcoPath": "icons/app.png",
+            }]
+    return [{
+        "Title": f"Budget: {budget.seconds:g} s  {budget.memory / 1e6:g} MB",
+        "SubTitle": "Time and memory an evaluation may take. Example: :budget 5s 512M",
+        "IcoPath": "icons/app.png",
+    }]
+
+
+def calculate(query, cancelled=None):
+    """Returns the results of the query. When given, cancelled() is checked between the phases of the calculation,
+    which raises worker.Cancelled if it returns True."""
+    if query.strip() == ':stats':
+        return stats_results()
+    if query.strip().startswith(':budget'):
+        return budget_results(query)
+    query_start = instrumentation.clock()
+    completions = completion_results(query)
+    instrumentation.record('complete', query_start)
     results = []
     try_vardef = query.split('=', 2)
     if len(try_vardef) == 2:
@@ -148,12 +419,22 @@ def calculate(query):
         query = try_vardef[1]
     else:
         vardef = None
+    signature = math_parser.FUNCTION_SIGNATURE.fullmatch(vardef) if vardef else None
+    if signature:
+        return function_results(signature, query)
 
     try:
-        result, expression = math_parser.evaluate(query, variables)
+        result, expression = worker.evaluate(query, variables, cancelled=cancelled)
     except NameError or SyntaxError:
         pass
+    except math_parser.TooExpensive as err:
+        results.append({
+            "Title": "Too expensive",
+            "SubTitle": f"{err}. The budget can be changed with :budget",
+            "IcoPath": "icons/app.png",
+        })
     except Exception as err:
+        import traceback
         err_text = traceback.format_exc()
         results.append({
             "Title": f"Error: {type(err)}",
@@ -161,20 +442,71 @@ def calculate(query):
             "IcoPath": "icons/app.png",
         })
     else:
-        if vardef:
-            fmt = format_result(result)
+        if cancelled is not None and cancelled():
+            raise worker.Cancelled()
+        start = instrumentation.clock()
+        if type(result).__module__ == 'numpy' and getattr(result, 'ndim', None) == 0:
+            result = result.item()  # numpy scalars are shown as the python ones
+        fmt = format_result(result)
+        start = instrumentation.record('format', start)
+        if cancelled is not None and cancelled():
+            raise worker.Cancelled()
+        if is_array(result):
+            # Arrays are stored as the expression that creates them, and copied as shown
+            stored, context_data = query.strip(), fmt
+        elif is_big_int(result):
+            # Passed in hexadecimal, which unlike decimal is converted in linear time and without limit of digits
+            stored = context_data = hex(result)
+        else:
+            stored, context_data = str(result), result
+        if vardef and sheet.tracks(vardef, query):
+            try:
+                formula = sheet.check(vardef, query)
+            except worksheet.CycleError as err:
+                results.append({
+                    "Title": "Circular definition",
+                    "SubTitle": str(err),
+                    "IcoPath": "icons/app.png",
+                })
+            else:
+                results.append({
+                    "Title": f"{vardef} := {fmt}",
+                    "SubTitle": f"{vardef} = {formula.text}, updated when "
+                                f"{', '.join(sorted(formula.dependencies))} change",
+                    "IcoPath": "icons/app.png",
+                    "ContextData": context_data,
+                    "JsonRPCAction": {
+                        'method': 'store_formula',
+                        'parameters': [vardef, formula.text],
+                        'dontHideAfterAction': True
+                    }
+                })
+        elif vardef:
             results.append({
                 "Title": f"{vardef} := {fmt}",
                 "SubTitle": f'{expression} = {fmt}',
                 "IcoPath": "icons/app.png",
-                "ContextData": result,
+                "ContextData": context_data,
                 "JsonRPCAction": {
                     'method': 'store_result',
-                    'parameters': [vardef, str(result)],
+                    'parameters': [vardef, stored],
                     'dontHideAfterAction': True
                 }
             })
-        if isinstance(result, float):
+        if is_array(result):
+            results.append({
+                "Title": fmt,
+                "SubTitle": f'{expression} : min {format_result(math_parser.minimum(result))} '
+                            f'max {format_result(math_parser.maximum(result))}',
+                "IcoPath": "icons/app.png",
+                "ContextData": context_data,
+                "JsonRPCAction": {
+                    'method': 'store_result',
+                    'parameters': ['x', stored],
+                    'dontHideAfterAction': True
+                }
+            })
+        elif isinstance(result, float):
             fmt = f"{result:,}".replace(',', ' ')
             eng_repr = to_eng(result)
             results.append({
@@ -188,6 +520,18 @@ def calculate(query):
                     'dontHideAfterAction': True
                 }
             })
+        elif is_big_int(result):
+            results.append({
+                "Title": fmt,
+                "SubTitle": f'{expression} = {fmt}',
+                "IcoPath": "icons/app.png",
+                "ContextData": context_data,
+                "JsonRPCAction": {
+                    'method': 'store_result',
+                    'parameters': ['x', stored],
+                    'dontHideAfterAction': True
+                }
+            })
         elif isinstance(result, int):
             fmt = f"{result:,}".replace(',', ' ')
             results.append({
@@ -246,6 +590,9 @@ def calculate(query):
                 "IcoPath": "icons/app.png",
                 "ContextData": result
             })
+        instrumentation.record('build', start)
+    results.extend(completions)
+    instrumentation.record('query', query_start)
     return results
 
 
@@ -258,7 +605,27 @@ class Calculator(Wox):
 
     def context_menu(self, result):
         results = []
-        if isinstance(result, float):
+        if isinstance(result, str) and result.lstrip('-').startswith('0x'):  # A big integer
+            try:
+                result = int(result, 16)
+            except ValueError:
+                pass
+        if is_big_int(result):
+            hex_repr = hex(result)
+            digits = f"{len(hex_repr) - hex_repr.index('x') - 1:,}".replace(',', ' ')
+            for title, subtitle, base in ((format_big_int(result), 'Decimal', 'decimal'),
+                                          (abbreviate(hex_repr), f'Hexadecimal, {digits} digits', 'hex')):
+                results.append({
+                    "Title": title,
+                    "SubTitle": subtitle,
+                    "IcoPath": "Images/copy.png",
+                    "JsonRPCAction": {
+                        'method': 'copy_number',
+                        'parameters': [hex_repr, base],
+                        'dontHideAfterAction': False,
+                    }
+                })
+        elif isinstance(result, float):
             fmt = f"{result:,}"
             eng_repr = to_eng(result)
             results.append({
@@ -386,17 +753,50 @@ class Calculator(Wox):
     def change_query(self, query):
         # change query and copy to clipboard after pressing enter
         WoxAPI.change_query(query)
-        write_to_file(variables)
         copy_to_clipboard(query)
 
+    def store_formula(self, vardef, text):
+        try:
+            sheet.define(vardef, text)
+        except worksheet.CycleError:
+            return
+        completion.add_variable(vardef)
+        store_variable(vardef)
+        if vardef in variables:
+            copy_to_clipboard(str(variables[vardef]))
+
+    def store_function(self, signature, body):
+        signature = math_parser.FUNCTION_SIGNATURE.fullmatch(signature)
+        name = signature.group(1)
+        parameters = [p.strip() for p in signature.group(2).split(',')]
+        function = math_parser.UserFunction(name, parameters, body, environment=variables)
+        math_parser.define_function(function)
+        completion.add_function(function)
+        sheet.function_changed(name)
+        try:
+            store.set(name + varstore.FUNCTION_SUFFIX, function.to_data())
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def copy_number(self, hex_repr, base):
+        """Copies the integer in the base, converting it only now as big integers take long to convert."""
+        value = int(hex_repr, 16)
+        copy_to_clipboard(int_to_decimal(value) if base == 'decimal' else hex(value))
+
     def change_query_method(self, query):
         WoxAPI.change_query(query + '(')
 
+    def complete_query(self, query):
+        WoxAPI.change_query(query)
+
     def store_result(self, vardef, result):
-        variables[vardef] = result
-        write_to_file(variables)
-        copy_to_clipboard(result)
+        value = math_parser.number(result) if isinstance(result, str) else result
+        sheet.assign(vardef, stored_value(vardef, value))
+        completion.add_variable(vardef)
+        store_variable(vardef)
+        copy_to_clipboard(int_to_decimal(value) if is_big_int(value) else result)
 
 
 if __name__ == '__main__':
     Calculator()
+    save_snapshot()
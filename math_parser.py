@@ -1,11 +1,13 @@
 import re
+import sys
 import math
+import operator
 import time
-from typing import Union, List
+from array import array
+from collections import ChainMap, OrderedDict
+from itertools import repeat
 
-def log(text):
-    with open(r"C:\sandbox\WoxPythonCalculator\log.txt", 'a') as f:
-        f.write(time.asctime() + ':' + text + '\n')
+import instrumentation
 
 
 def number(x):
@@ -18,62 +20,491 @@ def number(x):
             try:
                 y = complex(x)
             except ValueError:
-                return x
+                try:
+                    y = int(x, 0)  # Big integers are passed in hexadecimal
+                except ValueError:
+                    return x
     return y
 
 
+class TooExpensive(ArithmeticError):
+    """Raised when the result of an operation would exceed the budget of the evaluation."""
+
+
+class NeedsWorker(Exception):
+    """Raised when an operation is too slow to be made inline, but may fit the budget in a worker process."""
+
+
+class Budget:
+    """Limits of the evaluations: the time in seconds and the memory in bytes it may take.
+
+    The operations that can take long, the factorials and the powers of integers, estimate the size of their result
+    first. Those beyond inline_bits raise NeedsWorker, to be made in a worker process that is killed when it exceeds
+    the budget. With inline_bits None everything within the memory budget is made inline. The arrays made by
+    linspace, logspace and arange are checked against the memory budget, and the calls of user functions, which
+    can multiply, raise NeedsWorker once evaluate() has run inline for inline_seconds. The other operations take a
+    time bounded by the size of their operands, and aren't checked.
+    """
+
+    def __init__(self, seconds: float = 2.0, memory: int = 256_000_000, inline_bits: int = 1 << 17,
+                 inline_seconds: float = 0.05):
+        self.seconds = seconds
+        self.memory = memory
+        self.inline_bits = inline_bits
+        self.inline_seconds = inline_seconds
+        self.deadline = None  # When the evaluation made inline by evaluate() should move to a worker
+
+    def check(self, bits: float):
+        """Checks that a result of that many bits can be computed."""
+        if bits > 8 * self.memory:
+            raise TooExpensive(f"The result would take {int(bits) // 8_000_000:,} MB")
+        if self.inline_bits is not None and bits > self.inline_bits:
+            raise NeedsWorker()
+
+    def check_array(self, count: float):
+        """Checks that an array of that many values, 8 bytes each, can be made. Arrays are made inline, as they
+        take a time proportional to their memory."""
+        if count * 8 > self.memory:
+            raise TooExpensive(f"The array would take {int(count) // 125_000:,} MB")
+
+    def check_time(self):
+        """Raises NeedsWorker when the evaluation made inline took too long."""
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise NeedsWorker()
+
+
+budget = Budget()
+
+
+MEMO_MIN_BITS = 1 << 12  # Integer results of more bits than this are memoized by call_cache
+
+
+def _expensive(function, arguments: tuple, bits: float):
+    """Calls function, whose result has that many bits, after checking the budget. Big results are memoized."""
+    if bits <= MEMO_MIN_BITS:
+        budget.check(bits)
+        return function(*arguments)
+
+    def compute(*arguments):
+        budget.check(bits)
+        return function(*arguments)
+    return call_cache.call(function, arguments, compute)
+
+
+def factorial(n):
+    if isinstance(n, int) and n > 2:
+        return _expensive(math.factorial, (n,), n * (math.log2(n) - math.log2(math.e)))
+    return math.factorial(n)
+
+
+def power(a, b):
+    if isinstance(a, int) and isinstance(b, int) and b > 1 and (a > 1 or a < -1):
+        return _expensive(pow, (a, b), b * a.bit_length())
+    return a ** b
+
+
+def linspace(start, stop, num=50):
+    budget.check_array(num)
+    import numpy
+    return numpy.linspace(start, stop, int(num))
+
+
+def logspace(start, stop, num=50):
+    """Returns num values evenly spaced on a log scale from start to stop. Note: unlike numpy, start and stop are
+    the end values and not their exponents."""
+    budget.check_array(num)
+    import numpy
+    return numpy.geomspace(start, stop, int(num))
+
+
+def arange(start, stop=None, step=1):
+    first, last = (0, start) if stop is None else (start, stop)
+    if step:
+        budget.check_array((last - first) / step)
+    import numpy
+    return numpy.arange(start, stop, step)
+
+
+def _element_wise(operation):
+    """The method of Column for the binary operation, and its reflected method."""
+    def method(self, other):
+        return self._map(operation, other)
+
+    def reflected(self, other):
+        return self._map(operation, other, reflected=True)
+    return method, reflected
+
+
+class Column(array):
+    """A column of numbers, as pasted, whose operations are element-wise like those of the numpy arrays, for when
+    numpy isn't installed. Each operation makes a new column, with a scalar or a column of the same length."""
+
+    def __new__(cls, values=()):
+        return super().__new__(cls, 'd', values)
+
+    def __reduce_ex__(self, protocol):
+        return Column, (array('d', self),)
+
+    def _map(self, operation, other, reflected=False):
+        if isinstance(other, array):
+            if len(other) != len(self):
+                raise ValueError(f"The columns have {len(self)} and {len(other)} values")
+            return Column(map(operation, other, self) if reflected else map(operation, self, other))
+        if isinstance(other, (int, float)):
+            if reflected:
+                return Column(operation(other, value) for value in self)
+            return Column(operation(value, other) for value in self)
+        return NotImplemented
+
+    __add__, __radd__ = _element_wise(operator.add)
+    __sub__, __rsub__ = _element_wise(operator.sub)
+    __mul__, __rmul__ = _element_wise(operator.mul)
+    __truediv__, __rtruediv__ = _element_wise(operator.truediv)
+    __floordiv__, __rfloordiv__ = _element_wise(operator.floordiv)
+    __mod__, __rmod__ = _element_wise(operator.mod)
+    __pow__, __rpow__ = _element_wise(operator.pow)
+    __iadd__, __imul__ = __add__, __mul__  # Instead of the concatenation and repetition of array
+
+    def __neg__(self):
+        return Column(-value for value in self)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Column(map(abs, self))
+
+
+def _sample(operands):
+    """The values the aggregate functions are taken over: those of the arrays and columns among the operands, and
+    the others. Returns a numpy array, or a sequence that is iterated once, without copying a single column."""
+    np = sys.modules.get('numpy')
+    if len(operands) == 1:
+        values = operands[0]
+        if isinstance(values, array) or np is not None and isinstance(values, np.ndarray):
+            return values
+    if np is not None and any(isinstance(x, np.ndarray) for x in operands):
+        return np.concatenate([np.ravel(x) for x in operands])
+    values = []
+    for x in operands:
+        if isinstance(x, (array, list, tuple)):
+            values.extend(x)
+        else:
+            values.append(x)
+    return values
+
+
+def _is_ndarray(values) -> bool:
+    np = sys.modules.get('numpy')
+    return np is not None and isinstance(values, np.ndarray)
+
+
+def total(*operands):
+    values = _sample(operands)
+    return values.sum() if _is_ndarray(values) else sum(values)
+
+
+def mean(*operands):
+    values = _sample(operands)
+    if _is_ndarray(values):
+        return values.mean()
+    if not values:
+        raise ValueError("mean of no values")
+    return math.fsum(values) / len(values)
+
+
+def std(*operands):
+    """Sample standard deviation, as the STDEV of spreadsheets. Made in a single pass with Welford's method, which
+    unlike the sum of the squares doesn't lose the precision when the values are large and close."""
+    values = _sample(operands)
+    if _is_ndarray(values):
+        return values.std(ddof=1)
+    count, average, squares = 0, 0.0, 0.0
+    for x in values:
+        count += 1
+        delta = x - average
+        average += delta / count
+        squares += delta * (x - average)
+    if count < 2:
+        raise ValueError("std needs at least two values")
+    return math.sqrt(squares / (count - 1))
+
+
+def minimum(*operands):
+    values = _sample(operands)
+    return values.min() if _is_ndarray(values) else min(values)
+
+
+def maximum(*operands):
+    values = _sample(operands)
+    return values.max() if _is_ndarray(values) else max(values)
+
+
+def percentile(*operands):
+    """percentile(values, p) is the value below which p % of the values are, interpolated between the closest
+    ones as numpy does. The values are selected in linear time by numpy. Without numpy they are copied and sorted,
+    unlike the other aggregates which take a single pass, as sorted() is faster than a selection made in Python."""
+    if len(operands) < 2:
+        raise TypeError("percentile takes the values and the percentage")
+    *operands, p = operands
+    if not 0 <= p <= 100:
+        raise ValueError("The percentage must be between 0 and 100")
+    values = _sample(operands)
+    if _is_ndarray(values):
+        np = sys.modules['numpy']
+        return np.percentile(values, p)
+    if not values:
+        raise ValueError("percentile of no values")
+    values = sorted(values)
+    rank = p / 100 * (len(values) - 1)
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def median(*operands):
+    return percentile(*operands, 50)
+
+
+_array_functions = None
+ELEMENT_WISE_FUNCTIONS = frozenset({  # Those of the Parser.FUNCTIONS applied to each value of an array
+    'sin', 'cos', 'tan', 'cotg', 'asin', 'acos', 'atan', 'atan2', 'sinh', 'cosh', 'tanh', 'asinh', 'acosh', 'atanh',
+    'log', 'ln', 'log10', 'sqr', 'sqrt', 'factorial', 'abs', 'round', 'floor', 'ceil'})
+
+
+def array_functions(np) -> dict:
+    """Returns the numpy equivalents of the Parser.FUNCTIONS, which work element-wise on arrays."""
+    global _array_functions
+    if _array_functions is None:
+        _array_functions = {
+            'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'cotg': lambda x: np.cos(x) / np.sin(x),
+            'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan, 'atan2': np.arctan2,
+            'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh,
+            'asinh': np.arcsinh, 'acosh': np.arccosh, 'atanh': np.arctanh,
+            'log': lambda x, base=None: np.log(x) if base is None else np.log(x) / np.log(base),
+            'ln': np.log, 'log10': np.log10,
+            'sqr': np.sqrt, 'sqrt': np.sqrt, 'factorial': np.frompyfunc(factorial, 1, 1),
+            'abs': np.abs, 'round': np.round, 'floor': np.floor, 'ceil': np.ceil,
+        }
+    return _array_functions
+
+
+def _call_array_function(name: str, operands):
+    """Calls the element-wise version of the function when one of the operands is a numpy array, or applies the
+    function to each value when one is a Column. Returns NotImplemented otherwise."""
+    np = sys.modules.get('numpy')  # If numpy wasn't imported there can't be any arrays
+    if np is not None and any(isinstance(x, np.ndarray) for x in operands):
+        function = array_functions(np).get(name)
+        if function is None:
+            return NotImplemented
+        return function(*operands)
+    if name not in ELEMENT_WISE_FUNCTIONS or not any(isinstance(x, Column) for x in operands):
+        return NotImplemented
+    if len({len(x) for x in operands if isinstance(x, Column)}) > 1:
+        raise ValueError("The columns have different lengths")
+    return Column(map(Parser.FUNCTIONS[name], *(x if isinstance(x, Column) else repeat(x) for x in operands)))
+
+
+def call_function(name: str, operands):
+    """Calls the Parser.FUNCTIONS entry name. The math functions only take scalars, so when they refuse an
+    array argument its numpy equivalent is used instead."""
+    try:
+        return Parser.FUNCTIONS[name](*operands)
+    except TypeError:
+        result = _call_array_function(name, operands)
+        if result is NotImplemented:
+            raise
+        return result
+
+
+def _function_caller(name: str):
+    """Same as call_function, with the function looked up only once."""
+    function = Parser.FUNCTIONS[name]
+
+    def call(*operands):
+        try:
+            return function(*operands)
+        except TypeError:
+            result = _call_array_function(name, operands)
+            if result is NotImplemented:
+                raise
+            return result
+    return call
+
+
+COMPILE_MAX_DEPTH = 200
+
+
+def postorder(root) -> list:
+    """Returns the nodes of the tree, each one after its operands, without recursion."""
+    order = []
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+        elif id(node) not in seen:
+            seen.add(id(node))
+            stack.append((node, True))
+            stack.extend((x, False) for x in reversed(node.operands) if isinstance(x, Node))
+    return order
+
+
+def _text_edges(x, edges: dict) -> tuple:
+    """First and last characters of the text of an operand."""
+    if isinstance(x, Node):
+        return edges[id(x)]
+    text = f"{x}"
+    return text[:1], text[-1:]
+
+
+def run_nested(generator):
+    """Runs a generator that yields the generators of the nested calls it needs the results of, and returns its
+    result. The generators waiting for a result are kept on a list instead of the Python stack, so the nesting is
+    only limited by the memory."""
+    stack = [generator]
+    value = None
+    while stack:
+        try:
+            nested = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+        else:
+            stack.append(nested)
+            value = None
+    return value
+
+
 class Node:
-    def __init__(self, op: str, operands: List[Union['Node', float, str]]):
+    __slots__ = ('op', 'operands', 'shared')
+
+    def __init__(self, op: str, operands: list):
         self.op = op
         self.operands = operands
+        self.shared = False  # Set by share_subtrees on the nodes that are operands of several nodes
 
     def __repr__(self):
+        """The text of the tree. The nodes give pieces of text and the operands to put between them, which are taken
+        from a stack and joined once, so the time is linear in the length of the text."""
+        edges = {}  # First and last characters of the text of each node
+        for node in postorder(self):
+            edges[id(node)] = node._edges(edges)
+        out = []
+        stack = [(self, False)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+            else:
+                node, replaced = item
+                stack.extend(reversed(node._pieces(replaced, edges)))
+        return ''.join(out)
+
+    def _edges(self, edges: dict) -> tuple:
         if len(self.operands) == 1:
-            arg_str = f"{self.operands[0]}"
             if self.op == '-':
-                return self.op + arg_str
+                return '-', _text_edges(self.operands[0], edges)[1]
+            if self.op == 'pct':
+                return '(', ')'
+            return self.op[:1], ')'
+        return '(', ')'
+
+    def _pieces(self, replaced: bool, edges: dict) -> list:
+        """The pieces of the text of the node: strings and (operand, replaced) tuples, replaced telling whether
+        ' , ' is replaced by ', ' in the text of the operand, as it is in the arguments of functions."""
+        def text(x, replace=replaced):
+            return (x, replace) if isinstance(x, Node) else f"{x}"
+
+        operands = self.operands
+        if len(operands) == 1:
+            x = operands[0]
+            if self.op == '-':
+                return [self.op, text(x)]
             elif self.op == 'pct':
-                return f"({arg_str}/100)"
-            if arg_str.startswith('(') and arg_str.endswith(')'):
-                return self.op + arg_str.replace(' , ', ', ')  # These are functions
+                return ["(", text(x), "/100)"]
+            if _text_edges(x, edges) == ('(', ')'):
+                return [self.op, text(x, True)]  # These are functions
             else:
-                return f"{self.op}({arg_str})"
+                return [self.op, "(", text(x), ")"]
+        pieces = ["("]
         if self.op == "//":
-            den = '*'.join(f"{p}" for p in self.operands)
-            div = '+'.join('*'.join(f'{q}' for j, q in enumerate(self.operands) if j != i) for i, p in enumerate(self.operands))
-            out = f"({den}/({div}))"
-            return out
+            for i, p in enumerate(operands):
+                pieces.extend(("*", text(p)) if i else (text(p),))
+            pieces.append("/(")
+            for i in range(len(operands)):
+                if i:
+                    pieces.append("+")
+                others = [q for j, q in enumerate(operands) if j != i]
+                for j, q in enumerate(others):
+                    pieces.extend(("*", text(q)) if j else (text(q),))
+            pieces.append("))")
+            return pieces
         if self.op == "**":
             # Power of power is always made on the first operand. X^Y^Z = (X^Y)^Z = X^(Y*Z)
-            if len(self.operands) > 2:
-                exponent = '*'.join(f'{x}' for x in self.operands[1:])
-                return f"({self.operands[0]}**({exponent}))"
-            else:
-                return f"({self.operands[0]}**{self.operands[1]})"
-        if self.op == "apply_pct" and len(self.operands) == 2:
-            if self.operands[1] < 0:
-                return "({0} * (1 - {1}/100))".format(*self.operands)
+            if len(operands) > 2:
+                pieces += [text(operands[0]), "**("]
+                for i, x in enumerate(operands[1:]):
+                    pieces.extend(("*", text(x)) if i else (text(x),))
+                pieces.append("))")
             else:
-                return "({0} * (1 + {1}/100))".format(*self.operands)
+                pieces += [text(operands[0]), "**", text(operands[1]), ")"]
+            return pieces
+        if self.op == "apply_pct" and len(operands) == 2:
+            sign = '-' if operands[1] < 0 else '+'
+            return ["(", text(operands[0]), f" * (1 {sign} ", text(operands[1]), "/100))"]
 
-        return f"({f' {self.op} '.join(map(str, self.operands))})"
+        separator = ', ' if self.op == ',' and replaced else f' {self.op} '
+        for i, x in enumerate(operands):
+            pieces.extend((separator, text(x)) if i else (text(x),))
+        pieces.append(")")
+        return pieces
 
     def eval(self, env: dict):
-        operands = []
-        for x in self.operands:
-            if isinstance(x, str) and x in env:
-                operands.append(env[x])
-            elif isinstance(x, Node):
-                res = x.eval(env)
-                if isinstance(res, list):
-                    operands.extend(res)
+        """Evaluates the tree. The nodes whose operands are being evaluated are kept on a stack, instead of
+        recursing, so that the depth of the tree isn't limited. The shared nodes are evaluated only once."""
+        stack = []
+        results = {}  # Values of the shared nodes
+        node, operands, i = self, [], 0
+        while True:
+            node_operands = node.operands
+            while i < len(node_operands):
+                x = node_operands[i]
+                i += 1
+                if isinstance(x, str):
+                    try:
+                        operands.append(env[x])  # Not an `in` test, so that a LazyEnv resolves its lazy bindings
+                    except KeyError:
+                        operands.append(x)
+                elif isinstance(x, Node):
+                    if x.shared and x in results:
+                        res = results[x]
+                        if isinstance(res, list):
+                            operands.extend(res)
+                        else:
+                            operands.append(res)
+                        continue
+                    stack.append((node, operands, i))
+                    node, operands, i = x, [], 0
+                    node_operands = node.operands
                 else:
-                    operands.append(res)
+                    operands.append(x)
+            res = node.apply(operands)
+            if node.shared:
+                results[node] = res
+            if not stack:
+                return res
+            node, operands, i = stack.pop()
+            if isinstance(res, list):
+                operands.extend(res)
             else:
-                operands.append(x)
+                operands.append(res)
 
+    def apply(self, operands: list):
+        """Returns the result of the operation on the evaluated operands."""
         if self.op in Parser.FUNCTIONS:
-            return Parser.FUNCTIONS[self.op](*operands)  # These are functions
+            return call_function(self.op, operands)  # These are functions
         if len(operands) == 1:
             a = operands[0]
             if self.op == '-':
@@ -82,12 +513,11 @@ class Node:
                 return a/100
 
         if self.op == '+':
-            log(str(operands))
             return sum(operands)
         if self.op == '-':
             a = operands[0]
             for x in operands[1:]:
-                a -= x
+                a = a - x
             return a
         if self.op == '*':
             a = 1
@@ -97,7 +527,7 @@ class Node:
         if self.op == '/':
             a = operands[0]
             for x in operands[1:]:
-                a /= x
+                a = a / x
             return a
         if self.op == ',':  # Gets a list
             return operands
@@ -135,15 +565,401 @@ class Node:
                 exponent = 1
                 for x in operands[1:]:
                     exponent *= x
-                return operands[0] ** exponent
+                return power(operands[0], exponent)
             else:
-                return operands[0] ** operands[1]
+                return power(operands[0], operands[1])
         if self.op == "apply_pct" and len(operands) == 2:
             return operands[0] * (1 + operands[1])
 
         raise NotImplementedError(f"Operation {self.op} not implemented")
 
+    def compile(self):
+        """Returns a function f(env) that computes the same as self.eval(env).
+
+        The tree is walked only once. Function lookups, the choice of the operation and the way each operand is
+        fetched are resolved here instead of on every evaluation. The functions call each other as deep as the
+        tree, so deeper trees than COMPILE_MAX_DEPTH are evaluated as a Program instead. The shared nodes are
+        computed first, each once, into slots of a _Scope that the nodes using them read like variables."""
+        if tree_shape(self)[1] > COMPILE_MAX_DEPTH:
+            return Program.from_tree(self).eval
+        shared = [node for node in postorder(self) if node.shared]
+        if not shared:
+            return self._compile()
+        slots = {}
+        steps = []
+        for node in shared:  # Each one after the shared nodes it uses
+            steps.append((f"#{len(slots)}", node._compile(slots)))  # Names no variable can have
+            slots[node] = steps[-1][0]
+        root = self._compile(slots)
+
+        def run(env):
+            scope = _Scope(env)
+            for slot, function in steps:
+                scope[slot] = function(scope)
+            return root(scope)
+        return run
+
+    def _compile(self, slots: dict = None):
+        getters = []
+        spread = False  # A ',' operand gives a list that is expanded into the operands
+        for x in self.operands:
+            if isinstance(x, Node):
+                getters.append(_variable_getter(slots[x]) if x.shared and slots else x._compile(slots))
+                spread = spread or x.op == ','
+            elif isinstance(x, str):
+                getters.append(_variable_getter(x))
+            else:
+                getters.append(_constant_getter(x))
+
+        if spread:
+            nodes = [isinstance(x, Node) for x in self.operands]
+
+            def gather(env):
+                operands = []
+                for get, is_node in zip(getters, nodes):
+                    res = get(env)
+                    if is_node and isinstance(res, list):
+                        operands.extend(res)
+                    else:
+                        operands.append(res)
+                return operands
+            if self.op in Parser.FUNCTIONS:
+                function = _function_caller(self.op)
+                return lambda env: function(*gather(env))
+            operation = _OPERATIONS.get(self.op) or _not_implemented(self.op)
+            return lambda env: operation(gather(env))  # The number of operands is only known at run time
+
+        if self.op in Parser.FUNCTIONS:
+            function = _function_caller(self.op)
+            if len(getters) == 1:
+                a, = getters
+                return lambda env: function(a(env))
+            return lambda env: function(*[get(env) for get in getters])
+
+        if len(getters) == 1:
+            a, = getters
+            if self.op == '-':
+                return lambda env: -a(env)
+            if self.op == 'pct':
+                return lambda env: a(env) / 100
+        elif len(getters) == 2 and self.op in _BINARY_OPERATIONS:
+            a, b = getters
+            operation = _BINARY_OPERATIONS[self.op]
+            return lambda env: operation(a(env), b(env))
+
+        operation = _OPERATIONS.get(self.op) or _not_implemented(self.op)
+        return lambda env: operation([get(env) for get in getters])
+
+
+class _Scope(dict):
+    """The values of the shared nodes of a compiled tree, in front of the variables."""
+
+    def __init__(self, env: dict):
+        super().__init__()
+        self.env = env
+
+    def __missing__(self, name):
+        return self.env[name]
+
+
+def _variable_getter(name: str):
+    def get(env):
+        try:
+            return env[name]
+        except KeyError:
+            return name
+    return get
+
+
+def _constant_getter(value):
+    return lambda env: value
+
+
+def _not_implemented(op: str):
+    def operation(operands):
+        raise NotImplementedError(f"Operation {op} not implemented")
+    return operation
+
+
+def _subtract(operands):
+    a = operands[0]
+    if len(operands) == 1:
+        return -a
+    for x in operands[1:]:
+        a = a - x
+    return a
+
+
+def _multiply(operands):
+    a = 1
+    for x in operands:
+        a *= x
+    return a
+
+
+def _divide(operands):
+    a = operands[0]
+    for x in operands[1:]:
+        a = a / x
+    return a
+
+
+def _left_fold(operation):
+    def fold(operands):
+        a = operands[0]
+        for x in operands[1:]:
+            a = operation(a, x)
+        return a
+    return fold
+
+
+def _parallel(operands):
+    den = 1
+    for x in operands:
+        den *= x
+    div = 0
+    for i, p in enumerate(operands):
+        m = 1
+        for j, q in enumerate(operands):
+            if j != i:
+                m *= q
+        div += m
+    return den/div
+
+
+def _power(operands):
+    # Power of power is always made on the first operand. X^Y^Z = (X^Y)^Z = X^(Y*Z)
+    if len(operands) > 2:
+        exponent = 1
+        for x in operands[1:]:
+            exponent *= x
+        return power(operands[0], exponent)
+    return power(operands[0], operands[1])
+
+
+def _apply_pct(operands):
+    if len(operands) != 2:
+        raise NotImplementedError("Operation apply_pct not implemented")
+    return operands[0] * (1 + operands[1])
+
+
+def _percentage(operands):
+    if len(operands) != 1:
+        raise NotImplementedError("Operation pct not implemented")
+    return operands[0] / 100
+
+
+# Implementations of the operations of Node.eval, taking the list of evaluated operands
+_OPERATIONS = {
+    '+': sum,
+    '-': _subtract,
+    '*': _multiply,
+    '/': _divide,
+    ',': list,
+    '&': _left_fold(lambda a, b: a & b),
+    '^': _left_fold(lambda a, b: a ^ b),
+    '%': _left_fold(lambda a, b: a % b),
+    '//': _parallel,
+    '**': _power,
+    'apply_pct': _apply_pct,
+    'pct': _percentage,
+}
+
+# Specializations for two operands, giving the same results as the operations above
+_BINARY_OPERATIONS = {
+    '+': lambda a, b: sum((a, b)),
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: 1 * a * b,
+    '/': lambda a, b: a / b,
+    '**': power,
+    '&': lambda a, b: a & b,
+    '^': lambda a, b: a ^ b,
+    '%': lambda a, b: a % b,
+    'apply_pct': lambda a, b: a * (1 + b),
+    '//': lambda a, b: (1 * a * b) / (0 + 1 * b + 1 * a),
+}
+
 
+_CONST, _VAR, _MARK, _APPLY, _STORE, _LOAD = range(6)  # Instructions of a Program
+
+
+class Program:
+    """A tree, or a graph with shared nodes, as a flat list of instructions in postfix order, which takes a few
+    bytes per node instead of a Node object and its list of operands.
+
+    Each instruction is an opcode and an argument, stored in two arrays: _CONST and _VAR push a value of the pools of
+    literals or of names, _MARK records the height of the stack before the operands of a node and _APPLY replaces
+    them by the result of an operator of the pool. _STORE keeps the result of a shared node in a slot, pushed again
+    by _LOAD. The evaluation uses a single stack of values, operations on two operands being made in place on it.
+    """
+
+    def __init__(self):
+        self.opcodes = array('B')
+        self.arguments = array('i')
+        self.constants = []
+        self.names = []
+        self.operators = []
+        self.slots = 0
+        self._pools = {}  # Index of each value in its pool, by kind
+        self._operations = None
+
+    def _index(self, kind: int, pool: list, value, key) -> int:
+        indexes = self._pools.setdefault(kind, {})
+        try:
+            index = indexes.get(key)
+        except TypeError:  # Not hashable
+            index = None
+            key = None
+        if index is None:
+            index = len(pool)
+            pool.append(value)
+            if key is not None:
+                indexes[key] = index
+        return index
+
+    def _emit(self, opcode: int, argument: int = 0):
+        self.opcodes.append(opcode)
+        self.arguments.append(argument)
+
+    @classmethod
+    def from_tree(cls, ast) -> 'Program':
+        """Returns the program computing ast, whose shared nodes are computed once."""
+        program = cls()
+        slots = {}
+        stack = [(ast, False)]
+        while stack:
+            x, expanded = stack.pop()
+            if isinstance(x, Node):
+                if expanded:
+                    program._emit(_APPLY, program._index(_APPLY, program.operators, x.op, x.op))
+                    if x.shared:
+                        slots[x] = program.slots
+                        program._emit(_STORE, program.slots)
+                        program.slots += 1
+                elif x in slots:
+                    program._emit(_LOAD, slots[x])
+                else:
+                    program._emit(_MARK)
+                    stack.append((x, True))
+                    stack.extend((y, False) for y in reversed(x.operands))
+            elif isinstance(x, str):
+                program._emit(_VAR, program._index(_VAR, program.names, x, x))
+            else:
+                program._emit(_CONST, program._index(_CONST, program.constants, x, _literal_key(x)))
+        del program._pools
+        return program
+
+    def to_tree(self):
+        """Returns the tree, or the graph with its shared nodes, that the program computes."""
+        stack = []
+        marks = []
+        slots = [None] * self.slots
+        for opcode, argument in zip(self.opcodes, self.arguments):
+            if opcode == _VAR:
+                stack.append(self.names[argument])
+            elif opcode == _CONST:
+                stack.append(self.constants[argument])
+            elif opcode == _MARK:
+                marks.append(len(stack))
+            elif opcode == _APPLY:
+                mark = marks.pop()
+                node = Node(self.operators[argument], stack[mark:])
+                del stack[mark:]
+                stack.append(node)
+            elif opcode == _STORE:
+                node.shared = True
+                slots[argument] = node
+            else:
+                stack.append(slots[argument])
+        return stack[-1]
+
+    def __repr__(self):
+        return f"{self.to_tree()}"
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def to_data(self) -> tuple:
+        """Returns the program as a tuple of bytes, lists of literals and numbers, which marshal can store."""
+        return (self.opcodes.tobytes(), self.arguments.tobytes(), list(self.constants), list(self.names),
+                list(self.operators), self.slots)
+
+    @classmethod
+    def from_data(cls, data) -> 'Program':
+        """Returns the program stored by to_data. Raises ValueError if data isn't one."""
+        try:
+            opcodes, arguments, constants, names, operators, slots = data
+            program = cls()
+            program.opcodes.frombytes(opcodes)
+            program.arguments.frombytes(arguments)
+            program.constants, program.names, program.operators = list(constants), list(names), list(operators)
+            program.slots = int(slots)
+        except (TypeError, ValueError) as err:
+            raise ValueError(f"Invalid program: {err}") from None
+        if len(program.opcodes) != len(program.arguments) or not program.opcodes:
+            raise ValueError("Invalid program: truncated")
+        del program._pools
+        return program
+
+    def _resolve(self) -> tuple:
+        """The implementations of the operators, taking the list of operands, and those taking two operands."""
+        operations = []
+        binary = []
+        for op in self.operators:
+            if op in Parser.FUNCTIONS:
+                function = _function_caller(op)
+                operations.append(lambda operands, function=function: function(*operands))
+                binary.append(None)
+            else:
+                operations.append(_OPERATIONS.get(op) or _not_implemented(op))
+                binary.append(_BINARY_OPERATIONS.get(op))
+        return operations, binary
+
+    def eval(self, env: dict):
+        """Evaluates the program like Node.eval evaluates its tree. The functions are looked up on the first
+        evaluation, as Node.compile does."""
+        if self._operations is None:
+            self._operations = self._resolve()
+        operations, binary = self._operations
+        names = self.names
+        constants = self.constants
+        stack = []
+        append = stack.append
+        marks = []
+        slots = [None] * self.slots
+        result = None
+        for opcode, argument in zip(self.opcodes, self.arguments):
+            if opcode == _VAR:
+                try:
+                    append(env[names[argument]])  # Not an `in` test, so that a LazyEnv resolves its lazy bindings
+                except KeyError:
+                    append(names[argument])
+                continue
+            if opcode == _CONST:
+                append(constants[argument])
+                continue
+            if opcode == _MARK:
+                marks.append(len(stack))
+                continue
+            if opcode == _APPLY:
+                mark = marks.pop()
+                operation = binary[argument]
+                if operation is not None and len(stack) - mark == 2:
+                    b = stack.pop()
+                    result = operation(stack.pop(), b)
+                else:
+                    result = operations[argument](stack[mark:])
+                    del stack[mark:]
+            elif opcode == _STORE:
+                slots[argument] = result
+                continue
+            else:
+                result = slots[argument]
+            if isinstance(result, list):  # Arguments are expanded into the operands, like in Node.eval
+                stack.extend(result)
+            else:
+                append(result)
+        return result if self.opcodes[-1] != _CONST and self.opcodes[-1] != _VAR else stack[-1]
 
 
 class Parser:
@@ -158,52 +974,97 @@ class Parser:
                  'sinh': math.sinh, 'cosh': math.cosh, 'tanh': math.tanh,
                  'asinh': math.asinh, 'acosh': math.acosh, 'atanh': math.atanh,
                  'log': math.log, 'ln': math.log, 'log10': math.log10,
-                 'sqr': math.sqrt, 'sqrt': math.sqrt, 'factorial': math.factorial,
+                 'sqr': math.sqrt, 'sqrt': math.sqrt, 'factorial': factorial,
                  'abs': abs, 'round': round, 'floor': math.floor, 'ceil': math.ceil,
+                 'linspace': linspace, 'logspace': logspace, 'arange': arange,
+                 'sum': total, 'mean': mean, 'std': std, 'min': minimum, 'max': maximum,
+                 'median': median, 'percentile': percentile,
                  }
 
     def __init__(self, expression: str):
         self.tokens = self.tokenize(expression)
         self.index = 0
+        self.percentages = 0  # Number of pct nodes created. The rewrite into apply_pct is skipped while it is zero
+
+    # The order of the alternatives matters. Ex: 0x1F is an hexadecimal number and not 0 followed by x1F
+    SCANNER = re.compile(r'0x[0-9a-fA-F]+|0b[01]+|\d*\.?\d+(?:[eE][+-]?\d+)?[jfpnumkMGT]?|[a-zA-Z]\w*|[+\-*/^&(),!%]')
+    NAME_START = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
 
-    def tokenize(self, expr: str):
-        tokens = re.findall(r'0x[0-9a-fA-F]+|0b[01]+|\d*\.?\d+(?:[eE][+-]?\d+)?[jfpnumkMGT]?|[a-zA-Z]\w*|[+\-*/^&(),!%]', expr)
-        processed_tokens = []
-        for i, t in enumerate(tokens):
-            if t in self.OPERATORS:
-                processed_tokens.append(t)
-            elif t in self.CONSTANTS:
-                if i > 0 and isinstance(processed_tokens[-1], (int, float)):  # numbers before constants taken as *
-                    processed_tokens.append("*")
-                processed_tokens.append(self.CONSTANTS[t])
-            elif re.match(r'\d+$', t):
-                processed_tokens.append(int(t))
-            elif re.match(r'0x[0-9A-F]+$', t, re.IGNORECASE):
-                processed_tokens.append((int(t, 16)))
-            elif re.match(r'0b[01]+$', t, re.IGNORECASE):
-                processed_tokens.append((int(t, 2)))
-            elif re.match(r'\d*\.?\d+(?:[eE][+-]?\d+)?j$', t):
-                processed_tokens.append(complex(t))
-            elif re.match(r'\d*\.?\d+(?:[eE][+-]?\d+)?[fpnumkMGT]$', t):
-                value, prefix = float(t[:-1]), t[-1]
-                processed_tokens.append(value * self.ENGINEERING_PREFIXES[prefix])
-            elif re.match(r'\d*\.?\d+(?:[eE][+-]?\d+)?$', t):
-                value = float(t)
-                processed_tokens.append(value)
+    def tokenize(self, expr: str, start: int = 0, processed_tokens: list = None, marks: list = None):
+        """Scans expr from start in a single pass, converting the numbers and constants and inserting the implied
+        multiplications. The kind of each token is told by its first characters, as the scanner only matches
+        well-formed ones. When marks is given, a tuple with the position after each match and the number of
+        tokens at that point is appended to it."""
+        if processed_tokens is None:
+            processed_tokens = []
+        if marks is None:
+            tokens = self.SCANNER.findall(expr, start)
+        else:
+            def matches():
+                for match in self.SCANNER.finditer(expr, start):
+                    yield match.group()
+                    marks.append((match.end(), len(processed_tokens)))
+            tokens = matches()
+
+        append = processed_tokens.append
+        operators = self.OPERATORS
+        name_start = self.NAME_START
+        constants = self.CONSTANTS
+        prefixes = self.ENGINEERING_PREFIXES
+        for t in tokens:
+            first = t[0]
+            if first in operators:
+                append(t)
+            elif first in name_start:
+                if processed_tokens and isinstance(processed_tokens[-1], (int, float)):
+                    append("*")  # numbers before constants and functions taken as *
+                append(constants[t] if t in constants else t)
+            elif first == '0' and t[1:2] == 'x':
+                append(int(t, 16))
+            elif first == '0' and t[1:2] == 'b':
+                append(int(t, 2))
             else:
-                if i > 0 and isinstance(processed_tokens[-1], (int, float)):  # numbers before functions taken as *
-                    processed_tokens.append("*")
-                processed_tokens.append(t)
+                suffix = t[-1]
+                if suffix == 'j':
+                    append(complex(t))
+                elif suffix in prefixes:
+                    append(float(t[:-1]) * prefixes[suffix])
+                elif t.isdigit():
+                    append(int(t))
+                else:
+                    append(float(t))
         return processed_tokens
 
     def parse(self):
         return self.parse_expression()
 
-    def parse_expression(self, min_precedence=0):
-        operands = [self.parse_primary()]
-        current_op = None
+    def parse_expression(self, min_precedence=0, checkpoints: list = None, resume: tuple = None):
+        """Parses the tokens from self.index on.
+
+        When a checkpoints list is given, the state of the loop is recorded on it before each operator is read, so
+        that a later parse can resume from it. A checkpoint is a tuple (index, operands, count, last, current_op)
+        where only the first count-1 elements of operands are guaranteed to be unchanged, the last one is kept
+        aside as it can still be replaced by a factorial or a percentage."""
+        return run_nested(self._parse_expression(min_precedence, checkpoints, resume))
+
+    def parse_primary(self):
+        return run_nested(self._parse_primary())
+
+    # The parsing methods are generators, which yield the generator of a nested parse where they would call it and
+    # get back its result, so that nesting isn't limited by the depth of the Python stack. See run_nested.
+
+    def _parse_expression(self, min_precedence=0, checkpoints: list = None, resume: tuple = None):
+        if resume is None:
+            operands = [(yield self._parse_primary())]
+            current_op = None
+        else:
+            self.index, operands, count, last, current_op = resume
+            operands = operands[:count - 1]
+            operands.append(last)
 
         while self.index < len(self.tokens):
+            if checkpoints is not None:
+                checkpoints.append((self.index, operands, len(operands), operands[-1], current_op))
             longer_operator = 0
             op = self.tokens[self.index]
             if op == "!":  # Factorial operator (unary)
@@ -225,6 +1086,7 @@ class Parser:
                 if next_token is None or next_token in self.OPERATORS or next_token == ')':
                     #  divide the x by 100
                     operands[-1] = Node('pct', [operands[-1]])
+                    self.percentages += 1
                     self.index += 1
                     continue
                 else:
@@ -250,26 +1112,45 @@ class Parser:
 
             self.index += 1 + longer_operator
             if self.index < len(self.tokens):
-                operands.append(self.parse_expression(precedence + 1))
+                operand = self._single_token_operand() if precedence >= 1 else None
+                if operand is None:
+                    operand = yield self._parse_expression(precedence + 1)
+                operands.append(operand)
 
-        if len(operands) >= 2 and current_op == '+' or current_op == '-':
+        if (len(operands) >= 2 and current_op == '+' or current_op == '-') and self.percentages:
             # Check if any argument is a percentage. If so, then apply percentage to the argument on the left
-            i = 1
-            while i < len(operands):
-                if isinstance(operands[i], Node) and operands[i].op == 'pct':
+            # The operands are copied, as the list may be shared with the checkpoints of an incremental parse
+            rewritten = [operands[0]]
+            for x in operands[1:]:
+                if isinstance(x, Node) and x.op == 'pct':
                     # replace the addition by an apply percentage
                     if current_op == '-':
                         # invert the sign of the percentage to apply
-                        operands[i] = Node('-', [operands[i]])
-                    operands[i-1] = Node('apply_pct', [operands[i-1], operands[i]])
-                    del operands[i]
+                        x = Node('-', [x])
+                    rewritten[-1] = Node('apply_pct', [rewritten[-1], x])
                 else:
-                    i += 1
+                    rewritten.append(x)
+            operands = rewritten
         if len(operands) == 1:
             return operands[0]
         return Node(current_op, operands)
 
-    def parse_primary(self):
+    SINGLE_TOKEN_FOLLOWERS = frozenset('+-),')
+
+    def _single_token_operand(self):
+        """Returns the operand at self.index and consumes it when it is a single number or variable ended by a
+        token that would end its nested parse anyway, as in the long sums of pasted columns of numbers. Returns
+        None otherwise. Only for the operands of operators of precedence 1 or more."""
+        token = self.tokens[self.index]
+        if isinstance(token, str) and (token in self.OPERATORS or token in self.FUNCTIONS):
+            return None
+        following = self.index + 1
+        if following < len(self.tokens) and self.tokens[following] not in self.SINGLE_TOKEN_FOLLOWERS:
+            return None
+        self.index = following
+        return token
+
+    def _parse_primary(self):
         token = self.tokens[self.index]
 
         if isinstance(token, float):
@@ -279,11 +1160,11 @@ class Parser:
         if token == '-':
             # Negate the next tokens
             self.index += 1
-            return Node(token, [self.parse_primary()])
+            return Node(token, [(yield self._parse_primary())])
 
         if token == "(":
             self.index += 1
-            node = self.parse_expression()
+            node = yield self._parse_expression()
             if self.index < len(self.tokens) and self.tokens[self.index] == ")":
                 self.index += 1  # Consume ')'
             return node
@@ -293,7 +1174,7 @@ class Parser:
                 raise NameError(f"Function {token} not recognized")
             function_name = token
             self.index += 2  # Consume function name and '('
-            arguments = [self.parse_expression()]
+            arguments = [(yield self._parse_expression())]
             self.index += 1  # Consume ')'
             return Node(function_name, arguments)
 
@@ -310,15 +1191,526 @@ class Parser:
         return precedences.get(op, 0)
 
 
+class IncrementalParser(Parser):
+    """Parser that reuses the work done on the previous expression.
+
+    Queries arrive one keystroke at a time, so consecutive expressions usually share a long prefix. Only the tokens
+    that could have been affected by the change are lexed again, and the top level of the parse resumes from the
+    last operand that was complete before the first changed token. Parentheses and function arguments that
+    contain the change are parsed again from their start.
+    """
+    LOOKAHEAD = 3  # Characters after a token that the SCANNER may inspect. Ex: 1e-5
+
+    def __init__(self, expression: str = ''):
+        self.expression = ''
+        self.tokens = []
+        self.index = 0
+        self._marks = []  # Position after each match of the scanner and len(self.tokens) at that point
+        self._checkpoints = []
+        self.percentages = 0
+        self.reused_tokens = 0
+        self.resumed_at = 0
+        if expression:
+            self.update(expression)
+
+    def update(self, expression: str):
+        """Replaces the expression, lexing again only its changed suffix."""
+        old = self.expression
+        if expression.startswith(old):
+            common = len(old)
+        elif old.startswith(expression):
+            common = len(expression)
+        else:
+            common = 0
+            for a, b in zip(old, expression):
+                if a != b:
+                    break
+                common += 1
+
+        # A token is kept if all the characters the scanner inspected to match it are unchanged
+        marks = self._marks
+        kept = len(marks)
+        while kept and marks[kept - 1][0] + self.LOOKAHEAD > common:
+            kept -= 1
+        del marks[kept:]
+        start, count = marks[-1] if marks else (0, 0)
+        del self.tokens[count:]
+        self.reused_tokens = count
+        # The loop in parse_expression looks at most one token past the checkpoint
+        while self._checkpoints and self._checkpoints[-1][0] + 1 >= self.reused_tokens:
+            self._checkpoints.pop()
+
+        self.tokenize(expression, start, self.tokens, marks)
+        self.expression = expression
+
+    def parse(self):
+        checkpoints = self._checkpoints
+        if checkpoints:
+            resume = checkpoints.pop()
+            self.resumed_at = resume[0]
+        else:
+            resume = None
+            self.resumed_at = 0
+            self.index = 0
+            self.percentages = 0
+        return self.parse_expression(checkpoints=checkpoints, resume=resume)
+
+
+# Functions not folded when their arguments are constant, as they create arrays
+UNFOLDED_FUNCTIONS = frozenset({'linspace', 'logspace', 'arange'})
+# Operations where (a op b) op c == a op b op c, the left operand being a node with the same operation
+LEFT_FLATTENED = frozenset({'+', '-', '*', '/', '&', '^'})
+# Operations made from left to right, where the leading literal operands can be replaced by their result
+LEFT_FOLDED = LEFT_FLATTENED | {'%'}
+
+
+def _is_constant(x) -> bool:
+    """Whether x is a literal, or a list of arguments that are all literals."""
+    if isinstance(x, Node):
+        return x.op == ',' and not any(isinstance(y, (Node, str)) for y in x.operands)
+    return not isinstance(x, str)
+
+
+def optimize(ast, share: bool = False):
+    """Returns a tree that evaluates like ast, for any variables, and shares none of its nodes with it.
+
+    Nodes whose operands are all literals are replaced by their value, unless their evaluation raises, so that
+    the error is raised by the evaluation as before, and so are the leading literal operands of the operations
+    made from left to right. Nodes are merged into their first operand when it has the same operation, which keeps
+    the order the operations are made in, and the exponents of a chain of powers are multiplied into a single one.
+    With share, the identical subtrees are merged by share_subtrees. The tree returned by the parser is left
+    unchanged for displaying it."""
+    if not isinstance(ast, Node):
+        return ast
+    optimized = {}
+    for node in postorder(ast):
+        operands = [optimized[id(x)] if isinstance(x, Node) else x for x in node.operands]
+        optimized[id(node)] = _optimize_node(node.op, operands)
+    result = optimized[id(ast)]
+    return share_subtrees(result) if share else result
+
+
+def _literal_key(x):
+    """Key of a literal operand. Floats and complex numbers are told apart by their text, as 0.0 == -0.0."""
+    return x if isinstance(x, (int, str)) else (type(x), repr(x))
+
+
+def share_subtrees(ast):
+    """Returns a graph that evaluates like ast, where the identical subtrees are a single node, marked shared.
+
+    The nodes are hash-consed: each one is looked up by its operation and its operands, once these are merged
+    themselves, and replaced by the node found. The nodes of ast are reused, so it must not be used afterwards."""
+    if not isinstance(ast, Node):
+        return ast
+    unique = {}
+    merged = {}
+    for node in postorder(ast):
+        operands = [merged[id(x)] if isinstance(x, Node) else x for x in node.operands]
+        key = node.op, tuple(x if isinstance(x, Node) else _literal_key(x) for x in operands)
+        found = unique.get(key)
+        if found is None:
+            node.operands = operands
+            unique[key] = found = node
+        merged[id(node)] = found
+    root = merged[id(ast)]
+    used = set()
+    for node in postorder(root):
+        for x in node.operands:
+            if isinstance(x, Node):
+                if x in used:
+                    x.shared = True  # Operand of a second node, or twice of the same one
+                used.add(x)
+    return root
+
+
+def _optimize_node(op: str, operands: list):
+    """Optimizes a node whose operands are optimized already."""
+    if op in LEFT_FLATTENED and len(operands) >= 2:
+        first = operands[0]
+        if isinstance(first, Node) and first.op == op and len(first.operands) >= 2:
+            operands[:1] = first.operands
+    elif op == '**' and len(operands) > 2:
+        operands = [operands[0], _optimize_node('*', operands[1:])]
+    node = Node(op, operands)
+    if op == ',' or op in UNFOLDED_FUNCTIONS or not getattr(Parser.FUNCTIONS.get(op), 'pure', True):
+        return node
+    if not all(map(_is_constant, operands)):
+        if op in LEFT_FOLDED:
+            literals = 0
+            while not isinstance(operands[literals], (Node, str)):
+                literals += 1
+            if literals >= 2:  # The operations are made from left to right, starting with these
+                try:
+                    operands[:literals] = [Node(op, operands[:literals]).eval({})]
+                except Exception:
+                    pass
+        return node
+    try:
+        return node.eval({})
+    except Exception:
+        return node
+
+
+class LazyEnv(dict):
+    """Variables that can be bound to a function, called only when an evaluation looks the variable up.
+
+    The function returns the value of the variable, or raises LookupError when it has none, in which case the value
+    the variable had when it was bound lazily is used. Assigning a value with env[name] = value takes precedence
+    over the lazy binding until the variable is bound lazily again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy = {}
+        self.defaults = {}
+
+    def bind_lazy(self, name: str, resolve):
+        if name in self:
+            self.defaults[name] = super().pop(name)
+        self.lazy[name] = resolve
+
+    def __missing__(self, name):
+        resolve = self.lazy.get(name)
+        if resolve is not None:
+            try:
+                return resolve()
+            except LookupError:
+                pass
+        return self.defaults[name]
+
+    def clear(self):
+        super().clear()
+        self.lazy.clear()
+        self.defaults.clear()
+
+    def stored(self) -> dict:
+        """The values assigned, without resolving the lazy bindings."""
+        return {**self.defaults, **self}
+
+
+class ParseCache:
+    """Bounded LRU cache of parsed expressions.
+
+    Keys are the expression text with whitespace runs collapsed, so that ``2 +  3`` and ``2 + 3`` share an entry.
+    The cache is bounded both in number of entries and in the total length of the cached expressions, and it is
+    flushed whenever Parser.FUNCTIONS or Parser.CONSTANTS no longer match the tables used to fill it.
+    With share, the repeated subexpressions of the optimized trees are single nodes, evaluated once.
+    """
+
+    def __init__(self, max_entries: int = 256, max_size: int = 1 << 20, share: bool = True):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.share = share
+        self._entries = OrderedDict()
+        self._size = 0
+        self._functions = None
+        self._constants = None
+        self._parser = IncrementalParser()
+        self.preload = None  # Called on the first miss, returns the entries of a snapshot by key, decoded when popped
+        self.snapshot = {}  # The entries of the snapshot not looked up yet
+        self.preloaded = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize(expression: str) -> str:
+        return ' '.join(expression.split())
+
+    def _check_tables(self):
+        if self._functions != Parser.FUNCTIONS or self._constants != Parser.CONSTANTS:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._size = 0
+            self.snapshot = {}
+            self._parser = IncrementalParser()
+            self._functions = dict(Parser.FUNCTIONS)
+            self._constants = dict(Parser.CONSTANTS)
+
+    def parse(self, expression: str):
+        """Returns the AST of the expression, parsing it only if it isn't cached."""
+        return self.lookup(expression)[0]
+
+    def lookup(self, expression: str) -> tuple:
+        """Returns the AST of the expression and its optimized version, to be evaluated."""
+        self._check_tables()
+        key = self.normalize(expression)
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            entry = self._preloaded(key)
+            if entry is not None:
+                self.hits += 1
+                self._insert(key, entry)
+                return entry
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        start = instrumentation.clock()
+        self._parser.update(key)
+        start = instrumentation.record('tokenize', start)
+        ast = self._parser.parse()
+        start = instrumentation.record('parse', start)
+        entry = ast, optimize(ast, self.share)
+        instrumentation.record('optimize', start)
+        if instrumentation.enabled:
+            nodes, depth = tree_shape(ast)
+            instrumentation.observe('nodes', nodes)
+            instrumentation.observe('depth', depth)
+        self._insert(key, entry)
+        return entry
+
+    def _insert(self, key: str, entry: tuple):
+        if len(key) <= self.max_size:
+            self._entries[key] = entry
+            self._size += len(key)
+            while len(self._entries) > self.max_entries or self._size > self.max_size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._size -= len(old_key)
+                self.evictions += 1
+
+    def _preloaded(self, key: str):
+        """Returns the entry of the snapshot for key, taken out of it, or None. Only this entry is decoded."""
+        if self.preload is not None:
+            preload, self.preload = self.preload, None
+            self.snapshot = preload()
+        entry = self.snapshot.pop(key, None)
+        if entry is not None:
+            self.preloaded += 1
+        return entry
+
+    def recent(self, count: int) -> list:
+        """The (key, ast, optimized) entries last used, the most recent last."""
+        keys = list(self._entries)[-count:] if count > 0 else []
+        return [(key, *self._entries[key]) for key in keys]
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations, 'entries': len(self._entries), 'size': self._size,
+                'preloaded': self.preloaded}
+
+
+parse_cache = ParseCache()
+
+
+class CallCache:
+    """Bounded LRU cache of the results of pure calls, keyed by the function and the values of the arguments.
+
+    The type of each argument is part of the key, as 2 and 2.0 are equal but don't always give the same result.
+    Calls with unhashable arguments, like arrays, aren't cached."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, function, arguments: tuple, compute):
+        """Returns function(*arguments), calling compute(*arguments) only if it isn't cached."""
+        key = function, tuple((type(x), x) for x in arguments)
+        try:
+            result = self._entries[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return compute(*arguments)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return result
+        self.misses += 1
+        result = compute(*arguments)
+        self._entries[key] = result
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+call_cache = CallCache()
+
+
+def tree_shape(ast) -> tuple:
+    """Returns the number of nodes and the depth of the tree."""
+    nodes = depth = 0
+    stack = [(ast, 1)]
+    while stack:
+        node, level = stack.pop()
+        if isinstance(node, Node):
+            nodes += 1
+            depth = max(depth, level)
+            stack.extend((x, level + 1) for x in node.operands)
+    return nodes, depth
+
+
+def variable_names(ast) -> set:
+    names = set()
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Node):
+            stack.extend(node.operands)
+        elif isinstance(node, str):
+            names.add(node)
+    return names
+
+
+def tree_to_data(ast):
+    """Returns the tree as nested lists [op, operand...], which can be stored as JSON."""
+    def literal(x):
+        return {'complex': [x.real, x.imag]} if isinstance(x, complex) else x
+
+    if not isinstance(ast, Node):
+        return literal(ast)
+    data = {}
+    for node in postorder(ast):
+        data[id(node)] = [node.op] + [data[id(x)] if isinstance(x, Node) else literal(x) for x in node.operands]
+    return data[id(ast)]
+
+
+def tree_from_data(data):
+    """Returns the tree stored by tree_to_data."""
+    def literal(x):
+        return complex(*x['complex']) if isinstance(x, dict) else x
+
+    results = []
+    stack = [(data, False)]
+    while stack:
+        item, expanded = stack.pop()
+        if not isinstance(item, list):
+            results.append(literal(item))
+        elif expanded:
+            start = len(results) - (len(item) - 1)
+            operands = results[start:]
+            del results[start:]
+            results.append(Node(item[0], operands))
+        else:
+            stack.append((item, True))
+            stack.extend((x, False) for x in reversed(item[1:]))
+    return results[0]
+
+
+FUNCTION_SIGNATURE = re.compile(r'\s*([a-zA-Z]\w*)\s*\(\s*([a-zA-Z]\w*(?:\s*,\s*[a-zA-Z]\w*)*)\s*\)\s*')
+
+
+class UserFunction:
+    """A function defined by the user, like f(a, b) = a // b + 10k.
+
+    The body is parsed when the function is defined, and optimized and compiled on its first call. A function is
+    pure when its body only uses its parameters and pure functions. The calls of pure functions are memoized by
+    call_cache. The other variables of the body are looked up in environment on each call."""
+
+    def __init__(self, name: str, parameters, body: str, ast=None, environment: dict = None):
+        self.name = name
+        self.parameters = tuple(parameters)
+        self.body = body
+        self.ast = Parser(body).parse() if ast is None else ast
+        self.environment = {} if environment is None else environment
+        self.free = variable_names(self.ast) - set(self.parameters)
+        self.operations = {node.op for node in postorder(self.ast)} if isinstance(self.ast, Node) else set()
+        self._compiled = None
+
+    @property
+    def pure(self) -> bool:
+        return not self.free and all(getattr(Parser.FUNCTIONS.get(op), 'pure', True) for op in self.operations)
+
+    @property
+    def signature(self) -> str:
+        return f"{self.name}({', '.join(self.parameters)})"
+
+    def __call__(self, *arguments):
+        if len(arguments) != len(self.parameters):
+            raise TypeError(f"{self.signature} takes {len(self.parameters)} arguments, got {len(arguments)}")
+        budget.check_time()  # Functions calling others several times make exponentially many calls
+        if self.pure:
+            return call_cache.call(self, arguments, self._evaluate)
+        return self._evaluate(*arguments)
+
+    def _evaluate(self, *arguments):
+        if self._compiled is None:
+            optimized = optimize(self.ast, parse_cache.share)
+            self._compiled = optimized.compile() if isinstance(optimized, Node) else lambda env: optimized
+        env = dict(zip(self.parameters, arguments))
+        if self.free:
+            env = ChainMap(env, self.environment)
+        return self._compiled(env)
+
+    def invalidate(self):
+        """Compiles the body again on the next call, as the functions it calls may have been redefined."""
+        self._compiled = None
+
+    def to_data(self) -> dict:
+        return {'parameters': list(self.parameters), 'body': self.body, 'tree': tree_to_data(self.ast)}
+
+    @classmethod
+    def from_data(cls, name: str, data: dict, environment: dict = None):
+        return cls(name, data['parameters'], data['body'], tree_from_data(data['tree']), environment)
+
+
+def user_functions() -> list:
+    return [f for f in Parser.FUNCTIONS.values() if isinstance(f, UserFunction)]
+
+
+def define_function(function: UserFunction):
+    """Adds the function to Parser.FUNCTIONS, replacing the user function of the same name."""
+    previous = Parser.FUNCTIONS.get(function.name)
+    if previous is not None and not isinstance(previous, UserFunction):
+        raise NameError(f"{function.name} is a built-in function")
+    Parser.FUNCTIONS[function.name] = function
+    if previous is not None or any(function.name in f.operations for f in user_functions()):
+        for f in user_functions():
+            f.invalidate()
+        call_cache.clear()
+
+
+def undefine_function(name: str):
+    if isinstance(Parser.FUNCTIONS.get(name), UserFunction):
+        del Parser.FUNCTIONS[name]
+        for f in user_functions():
+            f.invalidate()
+        call_cache.clear()
+
+
 def evaluate(equation: str, environment: dict = None):
-    parser = Parser(equation)
-    ast = parser.parse()
-    if isinstance(ast, Node):
-        result = ast.eval(environment)
+    """Returns the value of the expression and its AST. Raises NeedsWorker when it is too slow to be evaluated
+    inline, which worker.evaluate then does in a worker process."""
+    ast, optimized = parse_cache.lookup(equation)
+    if isinstance(optimized, Node):
+        start = instrumentation.clock()
+        outermost = budget.deadline is None and budget.inline_bits is not None  # Not in a worker
+        if outermost:
+            budget.deadline = time.perf_counter() + budget.inline_seconds
+        try:
+            result = optimized.eval(environment)
+        finally:
+            if outermost:
+                budget.deadline = None
+        instrumentation.record('eval', start)
     else:
-        result = ast
+        result = optimized
     return result, ast
 
+def compile(equation: str):
+    """Returns a function f(env) that evaluates the equation for the variables given in env."""
+    _, optimized = parse_cache.lookup(equation)
+    if isinstance(optimized, Node):
+        return optimized.compile()
+    return lambda env: optimized
+
 # def evaluate_old(equation: str, environment: dict = None):
 #     parser = Parser(equation)
 #     ast = parser.parse()
@@ -329,6 +1721,10 @@ def evaluate(equation: str, environment: dict = None):
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['batch']:
+        import batch
+        sys.exit(batch.main(sys.argv[2:]))
+
     def test_equation(equation):
         print("Testing :", equation)
         parser = Parser(equation)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Queries of the daemon, where only the last keystroke matters.
+
+Wox sends a query for each keystroke, and the results of a query are useless once the next one was typed. Each
+query gets a generation number. It waits DEBOUNCE seconds before being evaluated, and it isn't evaluated at all if
+a newer query arrived meanwhile. The evaluation of a query is cancelled when a newer one arrives: the calculation
+checks between its phases whether it is stale, and the worker process of an expensive evaluation is killed. A stale
+query is answered with the results of the most recent query that completed.
+
+The coroutines run in an event loop of their own, in a background thread, so that the threads of the daemon
+handling the connections can submit queries to it. The calculations are made one at a time in another thread.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from worker import Cancelled
+
+DEBOUNCE = 0.015
+
+
+class QueryPipeline:
+    """Runs calculate(query, cancelled) for the queries submitted, where cancelled() tells whether the query was
+    superseded by a newer one, in which case calculate may raise Cancelled."""
+
+    def __init__(self, calculate, debounce: float = DEBOUNCE):
+        self.calculate = calculate
+        self.debounce = debounce
+        self.generation = 0  # Generation of the last query submitted
+        self.latest = None  # Output of the most recent query that completed
+        self.latest_generation = 0
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(1)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, query: str):
+        """Returns the output of the query, or of the most recent completed query if it became stale. Can be called
+        from any thread."""
+        return asyncio.run_coroutine_threadsafe(self._query(query), self.loop).result()
+
+    async def _query(self, query: str):
+        self.generation += 1
+        generation = self.generation
+        if self.debounce:
+            await asyncio.sleep(self.debounce)
+        if generation != self.generation:
+            instrumentation.count('debounced')
+            return self.latest
+
+        def cancelled():
+            return generation != self.generation
+        try:
+            output = await self.loop.run_in_executor(self.executor, self.calculate, query, cancelled)
+        except Cancelled:
+            instrumentation.count('cancelled')
+            return self.latest
+        if generation > self.latest_generation:
+            self.latest, self.latest_generation = output, generation
+        return output
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Snapshot of the state a process builds up, so that the next one starts warm.
+
+Wox starts main.py anew for each query, which would otherwise parse the stored variables and the expressions typed
+again. The snapshot holds the state of the variable store and the expressions last parsed, as math_parser.Program
+data, and is written with marshal to a temporary file that atomically replaces the previous one.
+
+The file starts with a header giving the format version, the Python version, whose marshal format may differ, and
+the CRC of the payload, so that a truncated or corrupted snapshot is ignored. An expression is only decoded when the
+parse cache misses it, and only if the functions and constants are still those it was parsed with. The snapshot
+isn't written again when neither the variables nor the expressions kept changed.
+"""
+import marshal
+import os
+import struct
+import sys
+import zlib
+
+import math_parser
+
+MAGIC = b'wox-pycalc-snapshot'
+VERSION = 1
+HEADER = struct.Struct('<19sHBBI')  # Magic, version, Python major and minor versions, CRC of the payload
+MAX_EXPRESSIONS = 128  # Expressions of the parse cache kept, the last used
+
+
+def fingerprint() -> int:
+    """Identifies Parser.FUNCTIONS and Parser.CONSTANTS, the user functions by their definition, as the parse and
+    the optimization of an expression depend on them."""
+    parts = []
+    for name, function in sorted(math_parser.Parser.FUNCTIONS.items()):
+        if isinstance(function, math_parser.UserFunction):
+            parts.append(f"{function.signature}={function.body}")
+        else:
+            parts.append(f"{name}:{getattr(function, '__qualname__', type(function).__name__)}")
+    parts.extend(f"{name}={value!r}" for name, value in sorted(math_parser.Parser.CONSTANTS.items()))
+    return zlib.crc32('\n'.join(parts).encode())
+
+
+def _expression_data(key: str, ast, optimized):
+    """The entry of the parse cache as marshal data, or None when it holds literals marshal can't store."""
+    data = (key, math_parser.Program.from_tree(ast).to_data(), math_parser.Program.from_tree(optimized).to_data())
+    try:
+        marshal.dumps(data)
+    except ValueError:
+        return None
+    return data
+
+
+def save(path: str, store=None, cache: math_parser.ParseCache = None, max_expressions: int = MAX_EXPRESSIONS,
+         previous: 'Snapshot' = None):
+    """Writes the snapshot of the variable store and of the parse cache, unless it would be the same as previous, the
+    snapshot the process started from. The entries of previous the parse cache didn't look up are kept behind its
+    own."""
+    cache = math_parser.parse_cache if cache is None else cache
+    variables = store.state() if store is not None else None
+    recent = cache.recent(max_expressions)
+    unused = cache.preload() if cache.preload is not None else cache.snapshot
+    kept = list(unused)[max(0, len(unused) - max_expressions + len(recent)):]
+    if previous is not None and (variables, fingerprint()) == (previous.variables, previous.fingerprint) \
+            and kept + [key for key, _, _ in recent] == previous.keys():
+        return
+    expressions = [(key, *unused.data[key]) for key in kept]
+    expressions.extend(data for data in (_expression_data(*entry) for entry in recent) if data)
+    payload = marshal.dumps({
+        'variables': variables,
+        'fingerprint': fingerprint(),
+        'expressions': marshal.dumps(expressions),  # Decoded separately, when the parse cache first misses
+    })
+    header = HEADER.pack(MAGIC, VERSION, *sys.version_info[:2], zlib.crc32(payload))
+    temp_path = f"{path}.{os.getpid()}"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(header + payload)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+
+class Expressions:
+    """The entries of the parse cache in a snapshot, by key, each decoded into its (ast, optimized) trees when
+    popped."""
+
+    def __init__(self, data: dict):
+        self.data = data  # The Program data of the ast and of the optimized tree by key, the last used last
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def pop(self, key: str, default=None):
+        try:
+            ast, optimized = self.data.pop(key)
+            return math_parser.Program.from_data(ast).to_tree(), math_parser.Program.from_data(optimized).to_tree()
+        except (EOFError, ValueError, TypeError, IndexError, KeyError):
+            return default  # Not in the snapshot, or written by an incompatible version
+
+
+class Snapshot:
+    def __init__(self, variables, fingerprint: int, expressions: bytes):
+        self.variables = variables  # State of the variable store, or None
+        self.fingerprint = fingerprint
+        self._expressions = expressions
+        self._index = None
+
+    def _entries(self) -> dict:
+        """The Program data of the expressions by key, the last used last."""
+        if self._index is None:
+            try:
+                self._index = {key: (ast, optimized) for key, ast, optimized in marshal.loads(self._expressions)}
+            except (EOFError, ValueError, TypeError):
+                self._index = {}  # Written by an incompatible version
+        return self._index
+
+    def keys(self) -> list:
+        """The keys of the expressions, the last used last."""
+        return list(self._entries())
+
+    def expressions(self) -> Expressions:
+        """The entries of the parse cache, or none if the functions or the constants changed since they were
+        parsed."""
+        if self.fingerprint != fingerprint():
+            return Expressions({})
+        return Expressions(dict(self._entries()))
+
+
+def load(path: str):
+    """Returns the Snapshot stored at path, or None if there is none or it can't be used."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, major, minor, crc = HEADER.unpack_from(data)
+    payload = data[HEADER.size:]
+    if (magic, version, (major, minor)) != (MAGIC, VERSION, sys.version_info[:2]) or zlib.crc32(payload) != crc:
+        return None
+    try:
+        content = marshal.loads(payload)
+        return Snapshot(content['variables'], content['fingerprint'], content['expressions'])
+    except (EOFError, ValueError, TypeError, KeyError):
+        return None
@@ -0,0 +1,41 @@
+import io
+import json
+import math
+import unittest
+
+import batch
+
+
+class TestBatch(unittest.TestCase):
+    LINES = ["R1 // R2\n", "\n", "1/0\n", "2 + 3\n", "4.7k * 2\n"]
+
+    def _run(self, workers, writer=batch.CsvWriter):
+        output = io.StringIO()
+        variables = batch.read_variables(["R1=1k", "R2=R1 * 4"], [])
+        count = batch.run(iter(self.LINES), writer(output), variables, workers, chunk_size=2)
+        self.assertEqual(len(self.LINES), count)
+        return output.getvalue()
+
+    def test_in_process(self):
+        lines = self._run(0).splitlines()
+        self.assertEqual(",".join(batch.COLUMNS), lines[0])
+        self.assertEqual("1,R1 // R2,800,float,", lines[1])
+        self.assertEqual("2,,,,", lines[2])
+        self.assertEqual("3,1/0,,,ZeroDivisionError: division by zero", lines[3])
+        self.assertEqual("4,2 + 3,5,int,", lines[4])
+
+    def test_process_pool(self):
+        self.assertEqual(self._run(0), self._run(2))
+
+    def test_definitions_above_the_inline_limit(self):
+        variables = batch.read_variables(["N=20000!"], [])
+        self.assertEqual(math.factorial(20000), variables['N'])
+
+    def test_json_lines(self):
+        rows = [json.loads(line) for line in self._run(0, batch.JsonLinesWriter).splitlines()]
+        self.assertEqual({'line': 5, 'expression': '4.7k * 2', 'value': '9 400', 'type': 'float', 'error': ''},
+                         rows[4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import json
+import unittest
+
+import benchmark
+import math_parser
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_corpus_evaluates(self):
+        for category, expressions in benchmark.CORPUS.items():
+            self.assertTrue(expressions, category)
+            for expression in expressions:
+                ast = math_parser.Parser(expression).parse()
+                expected = eval(str(ast), {**math_parser.Parser.FUNCTIONS, **benchmark.SUITE_ENV})
+                result = ast.eval(benchmark.SUITE_ENV) if isinstance(ast, math_parser.Node) else ast
+                self.assertAlmostEqual(expected, result, msg=expression)
+
+    def test_check(self):
+        thresholds = {'parse': {'tokenize': 0.5, 'eval': 0.001}}
+        self.assertEqual([], benchmark.check({'parse': {'tokenize': 0.9, 'eval': 0.03}}, thresholds))
+        self.assertEqual([('parse', 'tokenize', 1.2, 0.5)],
+                         benchmark.check({'parse': {'tokenize': 1.2, 'eval': 0.03, 'format': 9}}, thresholds))
+
+    def test_startup_within_budget(self):
+        ratios, loaded = benchmark.startup_ratios(runs=3)
+        self.assertEqual([], sorted(loaded.intersection(benchmark.DEFERRED_MODULES)))
+        with open(benchmark.THRESHOLDS_PATH) as f:
+            self.assertEqual([], benchmark.check(ratios, json.load(f)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import pickle
+import statistics
+import tempfile
+import unittest
+import unittest.mock
+from array import array
+
+import columns
+import formatting
+import main
+import math_parser
+import varstore
+
+
+class TestParseColumn(unittest.TestCase):
+
+    def test_separators(self):
+        self.assertEqual([1, 2, 3, 4, 5, 6], list(columns.parse_column("1\n2\r\n3\t4;5,6")))
+        self.assertEqual([1.5, -2, 3e-3], list(columns.parse_column(" 1.5 , -2 ,3e-3 ")))
+        self.assertEqual([1, 2, 3], list(columns.parse_column("1 2 3")))
+
+    def test_thousands_separators(self):
+        self.assertEqual([1234.5, 2000, 12345, 1234567],
+                         list(columns.parse_column("1,234.5\n2 000\n12'345\n1,234,567")))
+        self.assertEqual([1, 2345], list(columns.parse_column("1,2345")))
+        self.assertEqual([1234, 5], list(columns.parse_column("1,234\t5")))
+
+    def test_single_line(self):
+        self.assertEqual([100, 200, 300], list(columns.parse_column("100,200,300")))
+        self.assertEqual([100, 200, 300], list(columns.parse_column("100 200 300")))
+        self.assertEqual([1234.5, 12345], list(columns.parse_column("1,234.5; 12'345")))
+
+    def test_engineering_prefixes(self):
+        self.assertEqual([4.7 * 1e3, 100 * 1e-9, 2.2 * 1e6], list(columns.parse_column("4.7k\n100n\n2.2M")))
+
+    def test_skipped_fields(self):
+        self.assertEqual([1, 2], list(columns.parse_column("Price\n1\n\nn/a\n2\n")))
+        self.assertEqual(0, len(columns.parse_column("hello")))
+
+    def test_compact(self):
+        column = columns.parse_column("\n".join(str(i) for i in range(100_000)))
+        self.assertIsInstance(column, array)
+        self.assertEqual(('d', 100_000, 99_999), (column.typecode, len(column), column[-1]))
+
+
+class TestAggregates(unittest.TestCase):
+    VALUES = [3.5, 1, 4, 1, 5, 9, 2, 6]
+
+    def setUp(self):
+        self.env = {'x': array('d', self.VALUES)}
+
+    def _evaluate(self, expression):
+        result, _ = math_parser.evaluate(expression, self.env)
+        return result
+
+    def test_columns(self):
+        self.assertEqual(sum(self.VALUES), self._evaluate("sum(x)"))
+        self.assertAlmostEqual(statistics.mean(self.VALUES), self._evaluate("mean(x)"))
+        self.assertAlmostEqual(statistics.stdev(self.VALUES), self._evaluate("std(x)"))
+        self.assertEqual((1, 9), (self._evaluate("min(x)"), self._evaluate("max(x)")))
+        self.assertEqual(statistics.median(self.VALUES), self._evaluate("median(x)"))
+        self.assertEqual((1, 9, 2.9375), tuple(self._evaluate(f"percentile(x, {p})") for p in (0, 100, 37.5)))
+
+    def test_scalars(self):
+        self.assertEqual(6, self._evaluate("sum(1, 2, 3)"))
+        self.assertEqual(5, self._evaluate("max(1, 5, 2)"))
+        self.assertEqual(2, self._evaluate("median(3, 1, 2)"))
+        self.assertEqual(sum(self.VALUES) + 10, self._evaluate("sum(x, 10)"))
+
+    def test_stable_std(self):
+        self.env['y'] = array('d', [1e9 + v for v in self.VALUES])
+        self.assertAlmostEqual(statistics.stdev(self.VALUES), self._evaluate("std(y)"), 6)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self._evaluate("std(1)")
+        with self.assertRaises(ValueError):
+            self._evaluate("percentile(x, 101)")
+
+
+class TestClipboardColumn(unittest.TestCase):
+
+    def test_clipboard_value(self):
+        self.assertEqual(12, main.clipboard_value("12"))
+        self.assertEqual(1234.5, main.clipboard_value("1,234.5"))
+        self.assertEqual([1, 2, 3], list(main.clipboard_value("1\n2\n3")))
+        self.assertEqual([1, 2, 3], list(main.clipboard_value("Price\n1\n2\n3")))
+        self.assertEqual([100, 200, 300], list(main.clipboard_value("100,200,300")))
+        self.assertEqual([100, 200, 300], list(main.clipboard_value("100 200 300")))
+
+    def test_not_a_column(self):
+        for text in ("hello", "Room 101", "Total: 12 items, 3 boxes"):
+            self.assertIsNone(main.clipboard_value(text), text)
+
+    def test_table(self):
+        self.assertEqual([1.5, 2000], list(main.clipboard_value("a\t1.5\nb\t2,000")))
+        self.assertEqual([4.7e3, 10e3], list(main.clipboard_value("R;Value\nR1;4.7k\nR2;10k")))
+        self.assertIsNone(main.clipboard_value("1\t2\n3\t4"))  # Which column is x is ambiguous
+        self.assertIsNone(main.clipboard_value("100,200,300\n400,500,600"))
+
+    def test_x_kept(self):
+        variables = math_parser.LazyEnv(x=5)
+        clipboard = main.ClipboardNumber()
+        variables.bind_lazy('x', clipboard)
+        with unittest.mock.patch.object(main, 'paste_from_clipboard', return_value="Room 101"):
+            self.assertEqual(6, math_parser.evaluate("x + 1", variables)[0])
+
+    def test_element_wise(self):
+        env = {'x': main.clipboard_value("1\n2\n4")}
+        for expression, expected in (("x * 2", [2, 4, 8]), ("x + 1", [2, 3, 5]), ("2 / x", [2, 1, 0.5]),
+                                     ("x - x", [0, 0, 0]), ("x^2", [1, 4, 16]), ("x + 50%", [1.5, 3, 6]),
+                                     ("-x", [-1, -2, -4]), ("sqrt(x)", [1, 2 ** 0.5, 2]), ("log(x, 2)", [0, 1, 2]),
+                                     ("x // 1", [0.5, 2 / 3, 0.8])):
+            result, _ = math_parser.evaluate(expression, env)
+            self.assertTrue(formatting.is_array(result), expression)
+            for value, expected_value in zip(result, expected):
+                self.assertAlmostEqual(expected_value, value, msg=expression)
+            self.assertEqual(3, len(result), expression)
+        with self.assertRaises(ValueError):
+            math_parser.evaluate("x + y", dict(env, y=math_parser.Column([1, 2])))
+        column = math_parser.Column([1, 2])
+        self.assertEqual(column, pickle.loads(pickle.dumps(column)))
+        self.assertIsInstance(pickle.loads(pickle.dumps(column)), math_parser.Column)
+
+    def test_operands_unchanged(self):
+        class InPlaceColumn(math_parser.Column):  # Changed by -= and /=, as the numpy arrays are
+            def __isub__(self, other):
+                self[:] = array('d', self - other)
+                return self
+
+            def __itruediv__(self, other):
+                self[:] = array('d', self / other)
+                return self
+
+        env = {'x': InPlaceColumn([1, 2, 4])}
+        for expression in ("x - 1", "x / 2 + 0", "x - x"):
+            for _ in range(2):
+                math_parser.evaluate(expression, env)
+                self.assertEqual([1, 2, 4], list(env['x']), expression)
+
+    def test_formatting(self):
+        column = array('d', range(1000))
+        self.assertTrue(formatting.is_array(column))
+        self.assertEqual('[0, 1, 2, …, 997, 998, 999] (1000 values)', formatting.format_result(column))
+        self.assertEqual('[1, 2.5]', formatting.format_result(array('d', [1, 2.5])))
+
+    def test_store_pasted_column(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = varstore.VariableStore(os.path.join(directory.name, 'vars.txt'))
+        calculator = main.Calculator.__new__(main.Calculator)
+        with unittest.mock.patch.object(main, 'store', store), \
+                unittest.mock.patch.object(main, 'paste_from_clipboard', return_value="1\n2\n3"), \
+                unittest.mock.patch.object(main, 'copy_to_clipboard'):
+            main.read_clipboard()
+            result = main.calculate("x * 2")[0]
+            self.assertEqual('[2, 4, 6]', result['ContextData'])
+            calculator.store_result(*result['JsonRPCAction']['parameters'])
+            self.assertEqual({'array': [2, 4, 6]}, store.values['x'])
+            main.load_variables()
+            self.assertEqual([2, 4, 6], list(main.variables['x']))
+        main.load_variables()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import random
+import unittest
+
+import completion
+import main
+from completion import Completion, CompletionIndex
+
+
+class TestCompletionIndex(unittest.TestCase):
+
+    def _names(self, index, prefix):
+        return [c.name for c in index.complete(prefix)]
+
+    def test_ranking(self):
+        index = CompletionIndex(size=3)
+        index.add(Completion('sinh', 'function', 'sinh(x)', ''))
+        index.add(Completion('sin', 'function', 'sin(x)', ''))
+        index.add(Completion('size', 'variable', 'size', ''))
+        index.add(Completion('sigma', 'variable', 'sigma', ''))
+        self.assertEqual(['size', 'sigma', 'sin'], self._names(index, 'si'))
+        self.assertEqual(['sin', 'sinh'], self._names(index, 'sin'))
+        self.assertEqual([], self._names(index, 'cos'))
+
+    def test_same_as_scan(self):
+        rng = random.Random(3)
+        names = [''.join(rng.choices('abc', k=rng.randint(1, 6))) for _ in range(3000)]
+        index = CompletionIndex()
+        for name in names:
+            index.add(Completion(name, 'variable', name, ''))
+        for name in names[:1500]:
+            index.remove(name, 'variable')
+        remaining = sorted(set(names) - set(names[:1500]), key=lambda name: (len(name), name))
+        for prefix in ('', 'a', 'ab', 'abc', 'bb', 'cab'):
+            expected = [name for name in remaining if name.startswith(prefix)][:completion.COMPLETIONS]
+            self.assertEqual(expected, self._names(index, prefix), prefix)
+
+    def test_kinds_of_a_name(self):
+        index = CompletionIndex()
+        index.add(Completion('e', 'constant', 'e', ''))
+        index.add(Completion('e', 'variable', 'e', ''))
+        index.remove('e', 'variable')
+        self.assertEqual([('e', 'constant')], [(c.name, c.kind) for c in index.complete('e')])
+
+    def test_identifier_at_end(self):
+        self.assertEqual('si', completion.identifier_at_end("1 + si"))
+        self.assertEqual('R1', completion.identifier_at_end("2*R1 "))
+        self.assertEqual('', completion.identifier_at_end("1e5"))
+        self.assertEqual('', completion.identifier_at_end("sin(2)"))
+
+    def test_builtins(self):
+        self.assertEqual('atan2(y, x)', completion.index.complete('atan2')[0].signature)
+        self.assertEqual('pi', completion.index.complete('p')[-1].name)
+
+
+class TestCompletionResults(unittest.TestCase):
+
+    def test_functions(self):
+        results = main.completion_results("1 + sq")
+        self.assertEqual(['sqr(x)', 'sqrt(x)'], [r['Title'] for r in results])
+        self.assertEqual(('change_query_method', ['1 + sqrt']),
+                         (results[1]['JsonRPCAction']['method'], results[1]['JsonRPCAction']['parameters']))
+
+    def test_variables(self):
+        main.variables['resistance'] = 4700
+        completion.add_variable('resistance')
+        try:
+            result, = [r for r in main.completion_results("2*res") if r['Title'] == 'resistance']
+            self.assertEqual(('variable: 4 700', ['2*resistance']),
+                             (result['SubTitle'], result['JsonRPCAction']['parameters']))
+            self.assertEqual([], main.completion_results("2*resistance"))
+        finally:
+            del main.variables['resistance']
+            completion.remove_variable('resistance')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import daemon
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        patches = [mock.patch.object(daemon, 'INFO_PATH', os.path.join(directory, 'daemon.json')),
+                   mock.patch.object(daemon, 'SOCKET_PATH', os.path.join(directory, 'daemon.sock')),
+                   mock.patch.object(daemon, 'LOCK_PATH', os.path.join(directory, 'daemon.lock'))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.server = daemon.Server(idle_timeout=0.5)
+        self.server.listen()
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.start()
+
+    def _serve(self):
+        try:
+            while True:
+                conn, _ = self.server.sock.accept()
+                self.server.handle(conn)
+        except OSError:  # Idle timeout, or closed
+            pass
+        finally:
+            self.server.close()
+
+    def tearDown(self):
+        self.thread.join()
+
+    def test_query(self):
+        response = daemon.call({'method': 'query', 'parameters': ['2 + 3 * 4']})
+        results = json.loads(response['stdout'])['result']
+        self.assertEqual("14", results[0]['Title'])
+
+    def test_context_menu(self):
+        response = daemon.call({'method': 'context_menu', 'parameters': [255]})
+        copied = [result['JsonRPCAction']['parameters'][0] for result in json.loads(response['stdout'])['result']]
+        self.assertEqual(["255", "0xFF", "0b11111111"], copied)
+
+    def test_invalid_token(self):
+        with open(daemon.INFO_PATH) as f:
+            info = json.load(f)
+        with daemon._connect(info) as sock, sock.makefile('rb') as reader:
+            sock.sendall(json.dumps({'method': 'query', 'parameters': ['1'], 'token': 'guess'}).encode() + b'\n')
+            response = json.loads(reader.readline())
+        self.assertEqual({'error': "PermissionError: Invalid token"}, response)
+
+    def test_unknown_method(self):
+        self.assertIn('error', daemon.call({'method': 'ping'}))
+
+    def test_single_daemon(self):
+        lock = daemon._try_lock(daemon.LOCK_PATH)
+        self.addCleanup(os.close, lock)
+        self.assertIsNone(daemon._try_lock(daemon.LOCK_PATH))
+        with mock.patch.object(daemon, 'Server') as server, mock.patch.object(daemon, 'call', side_effect=OSError):
+            daemon.serve()
+        server.assert_not_called()  # Not even after the ping failed, while the first one starts
+
+    def test_error_not_handled_again(self):
+        argv = ['main.py', json.dumps({'method': 'store_result', 'parameters': ['x', '5']})]
+        with mock.patch.object(daemon, 'spawn') as spawn, mock.patch('sys.stderr'):
+            with mock.patch.object(daemon, 'call', return_value={'error': "OSError: disk full"}):
+                self.assertTrue(daemon.forward(argv))  # The daemon may have stored x before failing
+            with mock.patch.object(daemon, 'call', side_effect=ConnectionError):
+                self.assertFalse(daemon.forward(argv))
+        spawn.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,15 @@
+import json
 import unittest
+import unittest.mock
 import math
+import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import formatting
 import main
 import math_parser
 from math_parser import Parser, Node  # Replace with the actual module name
@@ -110,5 +119,349 @@ class TestCalculate(unittest.TestCase):
         self.assertAlmostEqual(0.6666666666, result, 6)
 
 
+class TestCompile(unittest.TestCase):
+
+    def test_same_as_eval(self):
+        env = {'a': 5, 'b': 2, 'c': 1.5j}
+        for expression in ("a+b", "a-b-1", "-a", "a*b*3", "a/b/2", "a//b", "a//b//3", "a^b", "a^b^2", "a^^b",
+                           "a&b&3", "a%b", "a+10%", "a-10%", "b%", "atan2(a, b)", "log(a, 2)", "(a-b)! + c", "sin(a)",
+                           "(a, b)", "a + b*c"):
+            ast = Parser(expression).parse()
+            self.assertEqual(ast.eval(env), ast.compile()(env), expression)
+
+    def test_compile_expression(self):
+        function = math_parser.compile("R1 // R2 + 1k")
+        self.assertAlmostEqual(1000 + 1000 * 4700 / 5700, function({'R1': 1000, 'R2': 4700}))
+        self.assertEqual(1001, function({'R1': 2, 'R2': 2}))
+        self.assertEqual(2.5, math_parser.compile("2.5")({}))
+
+
+class TestOptimize(unittest.TestCase):
+
+    def test_same_as_eval(self):
+        env = {'a': 5, 'b': 2.5, 'c': 1.5j}
+        for expression in ("2*pi*4k*a", "(a+b)+c+1", "a-b-1-2", "a/b/2", "a^2^3", "a^b^2", "2^^3^^a", "(a&7)&3",
+                           "1k//2k + a", "a//b//3", "a+10%", "a-1-10%", "sin(pi/4)*a", "atan2(1, 2) + a",
+                           "log(8, 2)*a", "(3-1)! + a", "(a, 1+2)", "sin(2 * pi * 4k) + 3M + 5 // 6 + a"):
+            ast = Parser(expression).parse()
+            optimized = math_parser.optimize(ast)
+            expected = ast.eval(env)
+            result = optimized.eval(env) if isinstance(optimized, Node) else optimized
+            self.assertEqual(expected, result, expression)
+            self.assertEqual(type(expected), type(result), expression)
+
+    def test_folding(self):
+        self.assertEqual("(25132.741228718343 * R)", str(math_parser.optimize(Parser("2*pi*4k*R").parse())))
+        self.assertEqual("(x**6)", str(math_parser.optimize(Parser("x^2^3").parse())))
+        self.assertEqual("(a + b + c)", str(math_parser.optimize(Parser("(a+b)+c").parse())))
+        self.assertEqual(0.4636476090008061, math_parser.optimize(Parser("atan2(1, 2)").parse()))
+
+    def test_shown_unchanged(self):
+        result, ast = math_parser.evaluate("2*pi*R", {'R': 1})
+        self.assertEqual(2 * math.pi, result)
+        self.assertEqual("(2 * 3.141592653589793 * R)", str(ast))
+
+    def test_errors_raised_by_eval(self):
+        optimized = math_parser.optimize(Parser("1/0 + a").parse())
+        self.assertIsInstance(optimized, Node)
+        with self.assertRaises(ZeroDivisionError):
+            math_parser.evaluate("1/0 + a", {'a': 1})
+
+
+class TestShareSubtrees(unittest.TestCase):
+    FILTER = "1/(2*pi*f*C) + (2*pi*f*C)^2 + sqrt(R^2 + (2*pi*f*C)^2)"
+
+    def test_merged(self):
+        shared = math_parser.optimize(Parser(self.FILTER).parse(), share=True)
+        tree = math_parser.optimize(Parser(self.FILTER).parse())
+        self.assertEqual(str(tree), str(shared))
+        self.assertEqual(['*', '**'], [node.op for node in math_parser.postorder(shared) if node.shared])
+        self.assertEqual(7, len(math_parser.postorder(shared)))
+        self.assertEqual(10, len(math_parser.postorder(tree)))
+
+    def test_same_as_tree(self):
+        env = {'a': 5, 'b': 2.5, 'c': 1.5j, 'f': 1e3, 'C': 100e-9, 'R': 4.7e3}
+        for expression in (self.FILTER, "a*b + a*b", "max(a, b) * min(a, b)", "(a, b) + (a, b)", "a//b + a//b//c",
+                           "sin(a)^2 + cos(a)^2 + sin(a)", "(a+10%) * (a+10%)", "-a - -a", "(a^b)^(a^b)"):
+            tree = math_parser.optimize(Parser(expression).parse())
+            shared = math_parser.optimize(Parser(expression).parse(), share=True)
+            expected = tree.eval(env)
+            self.assertEqual(expected, shared.eval(env), expression)
+            self.assertEqual(expected, shared.compile()(env), expression)
+
+    def test_evaluated_once(self):
+        calls = []
+
+        def counted(x):
+            calls.append(x)
+            return 2 * x
+        Parser.FUNCTIONS['counted'] = counted
+        try:
+            shared = math_parser.optimize(Parser("counted(a) + counted(a)^2 + 1/counted(a)").parse(), share=True)
+            self.assertEqual(4 + 16 + 0.25, shared.eval({'a': 2}))
+            self.assertEqual(1, len(calls))
+            self.assertEqual(6 + 36 + 1 / 6, shared.compile()({'a': 3}))
+            self.assertEqual(2, len(calls))
+        finally:
+            del Parser.FUNCTIONS['counted']
+
+    def test_signed_zeros_kept_apart(self):
+        ast = Node('+', [Node('*', ['a', 0.0]), Node('*', ['a', -0.0])])
+        self.assertEqual([], [node for node in math_parser.postorder(math_parser.share_subtrees(ast)) if node.shared])
+
+
+class TestProgram(unittest.TestCase):
+    EXPRESSIONS = ("a+b", "a-b-1", "-a", "a*b*3", "a/b/2", "a//b", "a//b//3", "a^b", "a^b^2", "a^^b", "a&b&3", "a%b",
+                   "b%", "atan2(a, b)", "log(a, 2)", "(a-b)! + c", "sin(a)", "(a, b)", "a + b*c", "max(a, b, 1) * 2",
+                   "2.5", "a")
+
+    def test_same_as_tree(self):
+        env = {'a': 5, 'b': 2, 'c': 1.5j}
+        for expression in self.EXPRESSIONS:
+            ast = Parser(expression).parse()
+            program = math_parser.Program.from_tree(ast)
+            self.assertEqual(str(ast), str(program), expression)
+            expected = ast.eval(env) if isinstance(ast, Node) else env.get(ast, ast)
+            self.assertEqual(expected, program.eval(env), expression)
+
+    def test_lossless(self):
+        for expression in self.EXPRESSIONS + (TestShareSubtrees.FILTER,):
+            ast = math_parser.optimize(Parser(expression).parse(), share=True)
+            tree = math_parser.Program.from_tree(ast).to_tree()
+            self.assertEqual(str(ast), str(tree), expression)
+            if isinstance(ast, Node):
+                self.assertEqual([(n.op, n.shared) for n in math_parser.postorder(ast)],
+                                 [(n.op, n.shared) for n in math_parser.postorder(tree)], expression)
+
+    def test_shared_nodes(self):
+        ast = math_parser.optimize(Parser(TestShareSubtrees.FILTER).parse(), share=True)
+        program = math_parser.Program.from_tree(ast)
+        self.assertEqual(2, program.slots)
+        env = {'f': 1e3, 'C': 100e-9, 'R': 4.7e3}
+        self.assertEqual(ast.eval(env), program.eval(env))
+
+    def test_compact(self):
+        program = math_parser.Program.from_tree(Parser("+".join(["x*2"] * 1000)).parse())
+        self.assertEqual(([2], ['x'], ['*', '+']), (program.constants, program.names, program.operators))
+        self.assertEqual(4 * 1000 + 2, len(program))  # Mark, load x, push 2, multiply, for each term
+        self.assertEqual(6000, program.eval({'x': 3}))
+        self.assertFalse(hasattr(Node('+', []), '__dict__'))
+
+
+class TestDeepNesting(unittest.TestCase):
+    DEPTH = 100_000
+
+    def test_parentheses(self):
+        expression = "(" * self.DEPTH + "x+1" + ")" * self.DEPTH
+        result, ast = math_parser.evaluate(expression, {'x': 2})
+        self.assertEqual(3, result)
+        self.assertEqual("(x + 1)", str(ast))
+        self.assertEqual(3, math_parser.compile(expression)({'x': 2}))
+
+    def test_unary_minus(self):
+        result, ast = math_parser.evaluate("-" * self.DEPTH + "x", {'x': 2})
+        self.assertEqual(2, result)
+        self.assertEqual("-" * self.DEPTH + "x", str(ast))
+
+    def test_functions(self):
+        expression = "abs(" * self.DEPTH + "-x" + ")" * self.DEPTH
+        ast = Parser(expression).parse()
+        self.assertEqual(expression, str(ast))
+        self.assertEqual(2, ast.eval({'x': 2}))
+        self.assertEqual(2, ast.compile()({'x': 2}))
+        self.assertEqual(2, math_parser.optimize(ast).eval({'x': 2}))
+
+    def test_same_as_shallow(self):
+        for expression in ("a - b*(c + 2)", "atan2(a, b + c)", "a * 10%", "a//b//c", "a^b^c", "-(a, b)"):
+            ast = Parser(expression).parse()
+            nested = Parser("(" * 1000 + expression + ")" * 1000).parse()
+            self.assertEqual(str(ast), str(nested))
+            env = {'a': 5, 'b': 2, 'c': 3}
+            self.assertEqual(ast.eval(env), nested.compile()(env), expression)
+
+
+class TestUserFunctions(unittest.TestCase):
+
+    def setUp(self):
+        math_parser.call_cache.clear()
+        self.hits, self.misses = math_parser.call_cache.hits, math_parser.call_cache.misses
+
+    def _calls(self):
+        return math_parser.call_cache.hits - self.hits, math_parser.call_cache.misses - self.misses
+
+    def tearDown(self):
+        for function in math_parser.user_functions():
+            math_parser.undefine_function(function.name)
+
+    def _define(self, signature, body, environment=None):
+        match = math_parser.FUNCTION_SIGNATURE.fullmatch(signature)
+        parameters = [p.strip() for p in match.group(2).split(',')]
+        function = math_parser.UserFunction(match.group(1), parameters, body, environment=environment)
+        math_parser.define_function(function)
+        return function
+
+    def test_calls(self):
+        self._define("f(a, b)", "a // b + 10k")
+        self._define("twice(a)", "2a")
+        result, _ = math_parser.evaluate("twice(f(1k, 1k))", {})
+        self.assertEqual(2 * (500 + 10_000), result)
+        self.assertIsNone(math_parser.FUNCTION_SIGNATURE.fullmatch("two()"))
+        self.assertEqual(10_500, math_parser.compile("f(x, x)")({'x': 1000}))
+        with self.assertRaises(TypeError):
+            math_parser.evaluate("f(1)", {})
+
+    def test_memoized(self):
+        calls = []
+        self._define("f(n)", "n^2")
+        math_parser.Parser.FUNCTIONS['f']._evaluate = lambda n: calls.append(n) or n ** 2
+        for _ in range(3):
+            self.assertEqual(14, math_parser.evaluate("f(n + 1) + f(n + 2) + f(n)", {'n': 1})[0])
+        self.assertEqual([2, 3, 1], calls)
+        self.assertEqual((6, 3), self._calls())
+
+    def test_free_variables(self):
+        env = {'R': 2}
+        function = self._define("g(a)", "a*R", env)
+        self.assertFalse(function.pure)
+        self.assertEqual(6, math_parser.evaluate("g(3)", env)[0])
+        env['R'] = 10
+        self.assertEqual(30, math_parser.evaluate("g(3)", env)[0])
+        self.assertEqual((0, 0), self._calls())
+
+    def test_redefinition(self):
+        self._define("f(a)", "a + 1")
+        self._define("g(a)", "f(a) * 2")
+        self.assertEqual(8, math_parser.evaluate("g(3)", {})[0])
+        self._define("f(a)", "a + 2")
+        self.assertEqual(10, math_parser.evaluate("g(3)", {})[0])
+        with self.assertRaises(NameError):
+            self._define("sin(a)", "a")
+
+    def test_stored_tree(self):
+        function = self._define("f(a, b)", "a // b + 2j - 1k")
+        data = json.loads(json.dumps(function.to_data()))
+        loaded = math_parser.UserFunction.from_data('f', data)
+        self.assertEqual(str(function.ast), str(loaded.ast))
+        self.assertEqual(function(3, 6), loaded(3, 6))
+
+    def test_definition_query(self):
+        result, = main.calculate("f(a, b) = a // b + 10k")
+        self.assertEqual("f(a, b) := a // b + 10k", result['Title'])
+        self.assertEqual(['f(a, b)', 'a // b + 10k'], result['JsonRPCAction']['parameters'])
+        self.assertNotIn('f', math_parser.Parser.FUNCTIONS)  # Defined only when the result is selected
+        self.assertIn("built-in", main.calculate("sin(a) = a")[0]['SubTitle'])
+
+    def test_expensive_builtins(self):
+        math_parser.factorial(3000)
+        math_parser.factorial(3000)
+        math_parser.power(3, 10_000)
+        math_parser.power(3, 10_000)
+        self.assertEqual((2, 2), self._calls())
+
+
+class TestLazyEnv(unittest.TestCase):
+
+    def setUp(self):
+        self.reads = 0
+
+    def _read(self):
+        self.reads += 1
+        return 4
+
+    def test_resolved_only_when_used(self):
+        env = math_parser.LazyEnv(a=2)
+        env.bind_lazy('x', self._read)
+        self.assertEqual(3, math_parser.evaluate("a + 1", env)[0])
+        self.assertEqual(0, self.reads)
+        self.assertEqual(10, math_parser.evaluate("a + x*2", env)[0])
+        self.assertEqual(6, math_parser.compile("a + x")(env))
+        self.assertEqual(2, self.reads)
+
+    def test_assignment_and_fallback(self):
+        env = math_parser.LazyEnv(x=7)
+
+        def empty():
+            raise LookupError
+        env.bind_lazy('x', empty)
+        self.assertEqual(8, math_parser.evaluate("x + 1", env)[0])
+        env.bind_lazy('x', self._read)
+        self.assertEqual(5, math_parser.evaluate("x + 1", env)[0])
+        env['x'] = 1
+        self.assertEqual(2, math_parser.evaluate("x + 1", env)[0])
+        self.assertEqual({'x': 1}, env.stored())
+
+    def test_clipboard_read_once_per_query(self):
+        paste = unittest.mock.Mock(return_value=" 12 ")
+        with unittest.mock.patch.object(main, 'paste_from_clipboard', paste):
+            main.read_clipboard()
+            main.calculate("2 + 3")
+            self.assertEqual(0, paste.call_count)
+            self.assertEqual("24", main.calculate("x + x")[0]['Title'])
+            self.assertEqual(1, paste.call_count)
+            main.read_clipboard()
+            main.calculate("x")
+            main.calculate("x * 2")
+            self.assertEqual(2, paste.call_count)
+
+
+class TestBigIntegers(unittest.TestCase):
+
+    def test_format(self):
+        self.assertEqual("4.149360e9130 (9 131 digits)", main.format_result(math.factorial(3000)))
+        self.assertEqual("-1.000000e45 (46 digits)", main.format_result(-10 ** 45))
+        self.assertEqual("1 000", main.format_result(1000))
+        self.assertEqual("inf", main.format_result(float('inf')))
+        for value in (9, 10, 10 ** 50 - 1, 10 ** 50, 10 ** 300 - 1, 10 ** 300):
+            self.assertEqual(len(str(value)), formatting.decimal_digits(value))
+
+    def test_to_decimal(self):
+        value = 7 ** 9000 + 1
+        limit = getattr(sys, 'get_int_max_str_digits', lambda: 0)()
+        if limit:
+            sys.set_int_max_str_digits(0)
+            self.addCleanup(sys.set_int_max_str_digits, limit)
+        self.assertEqual(str(value), main.int_to_decimal(value))
+        self.assertEqual(str(-value), main.int_to_decimal(-value))
+
+    def test_calculate(self):
+        results = main.calculate("3000!")
+        self.assertEqual("4.149360e9130 (9 131 digits)", results[0]['Title'])
+        self.assertEqual(math.factorial(3000), int(results[0]['ContextData'], 16))
+        menu = main.Calculator.__new__(main.Calculator).context_menu(results[0]['ContextData'])
+        self.assertEqual(['decimal', 'hex'], [result['JsonRPCAction']['parameters'][1] for result in menu])
+        with unittest.mock.patch.object(main, 'copy_to_clipboard') as copy:
+            main.Calculator.__new__(main.Calculator).copy_number(results[0]['ContextData'], 'decimal')
+        self.assertEqual(main.int_to_decimal(math.factorial(3000)), copy.call_args[0][0])
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestArrays(unittest.TestCase):
+
+    def test_element_wise(self):
+        values = math_parser.evaluate("linspace(1k, 100k, 7)", {})[0]
+        for expression in ("R // 4.7k", "20*log10(1/abs(1 + 2j*pi*1k*R*1n))", "R + 10%", "R - 5%", "R^2^0.5",
+                           "atan2(R, 1)", "log(R, 10)", "cotg(R)", "round(R)"):
+            result, _ = math_parser.evaluate(expression, {'R': values})
+            compiled = math_parser.compile(expression)({'R': values})
+            for i, r in enumerate(values.tolist()):
+                expected, _ = math_parser.evaluate(expression, {'R': r})
+                self.assertAlmostEqual(expected, result[i], msg=expression)
+                self.assertAlmostEqual(expected, compiled[i], msg=expression)
+
+    def test_variables_unchanged(self):
+        env = {'R': math_parser.evaluate("linspace(1k, 3k, 3)", {})[0]}
+        for expression in ("R - 1", "R / 2 + 0"):
+            for _ in range(2):
+                math_parser.evaluate(expression, env)
+                self.assertEqual([1e3, 2e3, 3e3], env['R'].tolist(), expression)
+
+    def test_scalars_unchanged(self):
+        self.assertIsInstance(math_parser.evaluate("sin(1) + log(8, 2)", {})[0], float)
+
+    def test_format(self):
+        self.assertEqual("[1, 2, 3]", main.format_result(numpy.array([1, 2, 3])))
+        self.assertEqual("[0, 1, 2, …, 997, 998, 999] (1000 values)", main.format_result(numpy.arange(1000)))
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
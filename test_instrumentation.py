@@ -0,0 +1,45 @@
+import unittest
+
+import instrumentation
+import math_parser
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled(self):
+        instrumentation.disable()
+        start = instrumentation.clock()
+        self.assertEqual(0, start)
+        self.assertEqual(0, instrumentation.record('eval', start))
+        instrumentation.observe('nodes', 3)
+        self.assertEqual({}, instrumentation.samples)
+        self.assertEqual({}, instrumentation.histograms)
+
+    def test_phases(self):
+        instrumentation.enable()
+        math_parser.evaluate("1 + 2 * x - 4", {'x': 3})
+        summary = instrumentation.summary()
+        for phase in ('tokenize', 'parse', 'eval'):
+            count, p50, p99 = summary[phase]
+            self.assertEqual(1, count)
+            self.assertLessEqual(p50, p99)
+        self.assertEqual({4: 1}, instrumentation.histograms['nodes'])  # 3 nodes
+        self.assertEqual({4: 1}, instrumentation.histograms['depth'])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, instrumentation.percentile(values, 50))
+        self.assertEqual(99, instrumentation.percentile(values, 99))
+        self.assertEqual(1, instrumentation.percentile([1], 99))
+
+
+if __name__ == "__main__":
+    unittest.main()
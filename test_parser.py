@@ -1,7 +1,7 @@
 import unittest
 import math
 
-from math_parser import Parser, Node  # Replace with the actual module name
+from math_parser import Parser, Node, ParseCache, IncrementalParser  # Replace with the actual module name
 
 
 class TestMathExpressionParser(unittest.TestCase):
@@ -85,6 +85,95 @@ class TestMathExpressionParser(unittest.TestCase):
         self._test_parser("5^^1", "(5 ^ 1)")
         self._test_parser("1+5&1", "(1 + (5 & 1))")
 
+    def test_tokens(self):
+        tokens = Parser("0x1F+0b101-12*.5/1e-3 2.5k 3j 2 pi 4sin(x) e5 1e5%").tokens
+        self.assertEqual([31, '+', 5, '-', 12, '*', 0.5, '/', 0.001, 2500.0, 3j, 2, '*', math.pi, 4, '*', 'sin',
+                          '(', 'x', ')', 'e5', 100000.0, '%'], tokens)
+        self.assertEqual([int, int, int, float, float, float, complex],
+                         [type(t) for t in tokens if not isinstance(t, str)][:7])
+
+    def test_long_flat_expressions(self):
+        terms = 100_000
+        ast = Parser("+".join(str(i) for i in range(terms))).parse()
+        self.assertEqual(('+', terms), (ast.op, len(ast.operands)))
+        self.assertEqual(terms * (terms - 1) // 2, ast.eval({}))
+        ast = Parser("-".join(f"{i}%" if i % 2 else "x" for i in range(terms))).parse()
+        self.assertEqual(('-', terms // 2), (ast.op, len(ast.operands)))
+        first = ast.operands[0]
+        self.assertEqual(('apply_pct', 'x', '-'), (first.op, first.operands[0], first.operands[1].op))
+        self.assertEqual('pct', first.operands[1].operands[0].op)
+
+    def test_chained_percentages(self):
+        ast = Parser("10+20%+x%+y").parse()
+        self.assertEqual(('+', 2), (ast.op, len(ast.operands)))
+        first = ast.operands[0]
+        self.assertEqual(('apply_pct', 'apply_pct', 'pct'), (first.op, first.operands[0].op, first.operands[1].op))
+        self.assertAlmostEqual(10 * 1.2 * 1.5 + 1, ast.eval({'x': 50, 'y': 1}))
+        ast = Parser("10-20%-x%").parse()
+        self.assertAlmostEqual(10 * 0.8 * 0.5, ast.eval({'x': 50}))
+
+
+class TestParseCache(unittest.TestCase):
+
+    def test_hits_and_normalization(self):
+        cache = ParseCache()
+        first = cache.parse("2 + 3")
+        self.assertIs(first, cache.parse("  2   +  3 "))
+        self.assertEqual({'hits': 1, 'misses': 1}, {k: cache.stats()[k] for k in ('hits', 'misses')})
+
+    def test_eviction(self):
+        cache = ParseCache(max_entries=2)
+        cache.parse("1+1")
+        cache.parse("2+2")
+        cache.parse("1+1")  # 1+1 becomes the most recently used
+        cache.parse("3+3")
+        self.assertEqual(1, cache.evictions)
+        cache.parse("1+1")
+        self.assertEqual(2, cache.hits)
+        cache = ParseCache(max_size=6)
+        cache.parse("1+1")
+        cache.parse("2+2+2")
+        self.assertEqual(1, cache.evictions)
+
+    def test_invalidation(self):
+        cache = ParseCache()
+        cache.parse("sin(1)")
+        Parser.FUNCTIONS['twice'] = lambda x: 2 * x
+        try:
+            cache.parse("sin(1)")
+        finally:
+            del Parser.FUNCTIONS['twice']
+        self.assertEqual((0, 2, 1), (cache.hits, cache.misses, cache.invalidations))
+
+
+class TestIncrementalParser(unittest.TestCase):
+
+    @staticmethod
+    def _parse_result(parse):
+        try:
+            return str(parse())
+        except Exception as err:
+            return type(err)
+
+    def _type(self, parser, expression):
+        for i in range(1, len(expression) + 1):
+            parser.update(expression[:i])
+            expected = self._parse_result(Parser(expression[:i]).parse)
+            self.assertEqual(expected, self._parse_result(parser.parse), expression[:i])
+
+    def test_keystrokes(self):
+        parser = IncrementalParser()
+        self._type(parser, "1+2*3+4/5+6^7+8%9+sin(10*pi)-8!+1e-5+2k+0x1F+3j")
+        self.assertGreater(parser.resumed_at, 0)
+        self._type(parser, "3+11+2%-4*5%+2pi")
+
+    def test_edits(self):
+        parser = IncrementalParser("1+2+3+4")
+        parser.parse()
+        for expression in ("1+2+3", "1+2+3e", "1+2+3e-4", "1+5+3e-4", "1+5+3e-4!"):
+            parser.update(expression)
+            self.assertEqual(str(Parser(expression).parse()), str(parser.parse()))
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
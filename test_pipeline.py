@@ -0,0 +1,59 @@
+import threading
+import time
+import unittest
+
+import pipeline
+from worker import Cancelled
+
+
+class TestQueryPipeline(unittest.TestCase):
+    def setUp(self):
+        self.calculated = []
+        self.pipeline = pipeline.QueryPipeline(self._calculate, debounce=0.01)
+        self.addCleanup(self.pipeline.close)
+
+    def _calculate(self, query, cancelled):
+        self.calculated.append(query)
+        deadline = time.monotonic() + float(query)
+        while time.monotonic() < deadline:  # A heavy evaluation, checking for cancellation between its phases
+            if cancelled():
+                raise Cancelled()
+            time.sleep(0.001)
+        return f"result of {query}"
+
+    def _submit_later(self, query, delay, outputs):
+        def submit():
+            time.sleep(delay)
+            start = time.monotonic()
+            outputs[query] = self.pipeline.submit(query), time.monotonic() - start
+        thread = threading.Thread(target=submit)
+        thread.start()
+        return thread
+
+    def test_single(self):
+        self.assertEqual("result of 0", self.pipeline.submit("0"))
+
+    def test_stale_cancelled(self):
+        self.assertEqual("result of 0", self.pipeline.submit("0"))
+        outputs = {}
+        threads = [self._submit_later("5", 0, outputs), self._submit_later("0.01", 0.1, outputs)]
+        for thread in threads:
+            thread.join()
+        output, latency = outputs["0.01"]
+        self.assertEqual("result of 0.01", output)
+        self.assertLess(latency, 0.5)  # Doesn't wait for the stale query
+        self.assertIn(outputs["5"][0], ("result of 0", "result of 0.01"))  # The latest completed result
+
+    def test_debounce(self):
+        self.pipeline.debounce = 0.2
+        outputs = {}
+        threads = [self._submit_later(query, 0, outputs) for query in ("0", "0.0", "0.00")]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(self.calculated))
+        self.assertEqual([None, None, f"result of {self.calculated[0]}"],
+                         sorted((output for output, _ in outputs.values()), key=bool))
+
+
+if __name__ == "__main__":
+    unittest.main()
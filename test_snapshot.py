@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+
+import math_parser
+import snapshot
+import varstore
+
+
+class TestSnapshot(unittest.TestCase):
+    EXPRESSIONS = ("1/(2*pi*f*C) + (2*pi*f*C)^2 + sqrt(R^2 + (2*pi*f*C)^2)", "2+3j * R", "max(R, 1k) // 2k",
+                   "R", "2.5", "3000!")
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'snapshot.bin')
+        self.store = varstore.VariableStore(os.path.join(directory, 'vars.txt'))
+        self.cache = math_parser.ParseCache()
+        for expression in self.EXPRESSIONS:
+            self.cache.lookup(expression)
+
+    def test_round_trip(self):
+        self.store.update({'R': 4.7e3, 'z': 1 - 2j})
+        snapshot.save(self.path, self.store, self.cache)
+        warm = snapshot.load(self.path)
+        store = varstore.VariableStore(self.store.path)
+        self.assertEqual({'R': 4.7e3, 'z': 1 - 2j}, store.load(warm.variables))
+        cache = math_parser.ParseCache()
+        cache.preload = warm.expressions
+        env = {'R': 4.7e3, 'f': 1e3, 'C': 100e-9}
+        for expression in self.EXPRESSIONS:
+            ast, optimized = cache.lookup(expression)
+            expected_ast, expected = self.cache.lookup(expression)
+            self.assertEqual(str(expected_ast), str(ast), expression)
+            if isinstance(expected, math_parser.Node):
+                self.assertEqual(expected.eval(env), optimized.eval(env), expression)
+                self.assertEqual([n.shared for n in math_parser.postorder(expected)],
+                                 [n.shared for n in math_parser.postorder(optimized)], expression)
+            else:
+                self.assertEqual(expected, optimized, expression)
+        self.assertEqual((len(self.EXPRESSIONS), 0, len(self.EXPRESSIONS)),
+                         (cache.hits, cache.misses, cache.stats()['preloaded']))
+
+    def test_journal_read_from_the_snapshot_on(self):
+        self.store.set('a', 1)
+        snapshot.save(self.path, self.store, self.cache)
+        self.store.set('b', 2)
+        warm = snapshot.load(self.path)
+        store = varstore.VariableStore(self.store.path)
+        self.assertEqual({'a': 1, 'b': 2}, store.load(warm.variables))
+        self.store.compact()  # Another file, read whole
+        self.store.set('a', 3)
+        self.assertEqual({'a': 3, 'b': 2}, varstore.VariableStore(self.store.path).load(warm.variables))
+
+    def test_corrupted(self):
+        snapshot.save(self.path, self.store, self.cache)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for corrupted in (data[:-5], data[:10], b'', data[:-1] + bytes([data[-1] ^ 1]),
+                          data.replace(b'wox-pycalc-snapshot', b'wox-pycalc-snapshoT')):
+            with open(self.path, 'wb') as f:
+                f.write(corrupted)
+            self.assertIsNone(snapshot.load(self.path))
+        self.assertIsNone(snapshot.load(self.path + '.missing'))
+
+    def test_stale_after_function_changes(self):
+        snapshot.save(self.path, self.store, self.cache)
+        function = math_parser.UserFunction('f', ['x'], "x^2")
+        math_parser.define_function(function)
+        try:
+            self.assertEqual(0, len(snapshot.load(self.path).expressions()))
+            snapshot.save(self.path, self.store, self.cache)
+            self.assertEqual(len(self.EXPRESSIONS), len(snapshot.load(self.path).expressions()))
+            math_parser.define_function(math_parser.UserFunction('f', ['x'], "x^3"))
+            self.assertEqual(0, len(snapshot.load(self.path).expressions()))
+        finally:
+            math_parser.undefine_function('f')
+
+    def test_decoded_when_looked_up(self):
+        snapshot.save(self.path, self.store, self.cache)
+        cache = math_parser.ParseCache()
+        cache.preload = snapshot.load(self.path).expressions
+        cache.lookup("1 + R")  # A miss, which decodes none of the snapshot
+        self.assertEqual((0, 6), (cache.stats()['preloaded'], len(cache.snapshot)))
+        cache.lookup("2.5")
+        self.assertEqual((1, 5), (cache.stats()['preloaded'], len(cache.snapshot)))
+        self.assertNotIn("2.5", cache.snapshot)
+
+    def test_entries_cached_since_kept(self):
+        snapshot.save(self.path, self.store, self.cache, max_expressions=3)
+        cache = math_parser.ParseCache()
+        cache.preload = snapshot.load(self.path).expressions
+        cache.lookup("2.5")
+        cache.lookup("1 + R")
+        snapshot.save(self.path, self.store, cache, max_expressions=4)
+        self.assertEqual(["R", "3000!", "2.5", "1 + R"], snapshot.load(self.path).keys())
+
+    def test_not_written_again_unchanged(self):
+        self.store.set('a', 1)
+        snapshot.save(self.path, self.store, self.cache)
+        warm = snapshot.load(self.path)
+        os.unlink(self.path)
+        store = varstore.VariableStore(self.store.path)
+        store.load(warm.variables)
+        cache = math_parser.ParseCache()
+        cache.preload = warm.expressions
+        cache.lookup(self.EXPRESSIONS[-1])  # Already the last used
+        snapshot.save(self.path, store, cache, previous=warm)
+        self.assertFalse(os.path.exists(self.path))
+        cache.lookup("R")
+        snapshot.save(self.path, store, cache, previous=warm)
+        self.assertTrue(os.path.exists(self.path))
+        os.unlink(self.path)
+        cache = math_parser.ParseCache()
+        cache.preload = warm.expressions
+        snapshot.save(self.path, store, cache, previous=warm)  # A process that parsed nothing keeps the expressions
+        self.assertFalse(os.path.exists(self.path))
+        store.set('b', 2)
+        snapshot.save(self.path, store, cache, previous=warm)
+        self.assertTrue(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import varstore
+
+
+class TestVariableStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'vars.txt')
+        self.legacy_path = os.path.join(directory, 'x.txt')
+
+    def _records(self):
+        with open(self.path) as f:
+            return [line for line in f if not line.startswith('#')]
+
+    def test_round_trip(self):
+        for value in (0, -1, 2**100, 0.1, -1e-300, float('inf'), 1.5 - 2j, "linspace(1, 2, 3)", "tab\tand\nline",
+                      {'parameters': ['a'], 'tree': ['+', 'a', 1.5]}):
+            self.assertEqual(('v', value), varstore.decode(varstore.encode('v', value)))
+        self.assertIsInstance(varstore.decode(varstore.encode('v', 3.0))[1], float)
+
+    def test_append_only(self):
+        store = varstore.VariableStore(self.path)
+        store.set('a', 1)
+        store.set('b', 2.5)
+        store.set('a', 3)
+        store.delete('b')
+        self.assertEqual(4, len(self._records()))
+        self.assertEqual({'a': 3}, varstore.VariableStore(self.path).load())
+
+    def test_refresh(self):
+        reader = varstore.VariableStore(self.path)
+        writer = varstore.VariableStore(self.path)
+        writer.set('a', 1)
+        self.assertEqual({'a': 1}, reader.load())
+        writer.update({'b': 2, 'c': 3j})
+        self.assertEqual({'b', 'c'}, reader.refresh())
+        self.assertEqual({'a': 1, 'b': 2, 'c': 3j}, reader.values)
+        with open(self.path, 'a') as f:
+            f.write(varstore.encode('d', 4)[:-1])  # Not written completely yet
+        self.assertEqual(set(), reader.refresh())
+        with open(self.path, 'a') as f:
+            f.write('\n')
+        self.assertEqual({'d'}, reader.refresh())
+
+    def test_compaction(self):
+        reader = varstore.VariableStore(self.path)
+        reader.load()
+        writer = varstore.VariableStore(self.path)
+        for i in range(1000):
+            writer.set('x', i)
+        writer.set('y', 'text')
+        self.assertLess(len(self._records()), varstore.COMPACT_MIN_RECORDS + 2)
+        self.assertEqual({'x', 'y'}, reader.refresh())
+        self.assertEqual({'x': 999, 'y': 'text'}, reader.values)
+        writer.compact()
+        self.assertEqual(2, len(self._records()))
+        self.assertEqual(set(), reader.refresh())
+
+    def test_rewritten_in_place(self):
+        writer = varstore.VariableStore(self.path)
+        writer.update({'a': 1, 'b': 2})
+        reader = varstore.VariableStore(self.path)
+        reader.load()
+        stat = os.stat(self.path)
+        with open(self.path, 'r+b') as f:  # As when a compaction gets the inode back, with the same size
+            data = f.read().replace(b'\ta\t', b'\tc\t')
+            f.seek(0)
+            f.write(data)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual({'a', 'c'}, reader.refresh())
+        self.assertEqual({'b': 2, 'c': 1}, reader.values)
+
+    def test_migration(self):
+        with open(self.legacy_path, 'w') as f:
+            f.write("x=12\nR=4700.0\nz=(1+2j)\n")
+        store = varstore.VariableStore(self.path, legacy_path=self.legacy_path)
+        self.assertEqual({'x': 12, 'R': 4700.0, 'z': 1 + 2j}, store.load())
+        self.assertTrue(varstore.is_journal(self.path))
+        self.assertFalse(varstore.is_journal(self.legacy_path))
+
+    def test_concurrent_writers(self):
+        script = ("import sys, varstore\n"
+                  "store = varstore.VariableStore(sys.argv[1])\n"
+                  "for i in range(200):\n"
+                  "    store.set(f'{sys.argv[2]}{i % 20}', i)\n")
+        processes = [subprocess.Popen([sys.executable, '-c', script, self.path, name],
+                                      cwd=os.path.dirname(os.path.abspath(varstore.__file__)))
+                     for name in 'abcd']
+        for process in processes:
+            self.assertEqual(0, process.wait())
+        expected = {f'{name}{i}': 180 + i for name in 'abcd' for i in range(20)}
+        self.assertEqual(expected, varstore.VariableStore(self.path).load())
+
+
+if __name__ == "__main__":
+    unittest.main()
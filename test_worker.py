@@ -0,0 +1,88 @@
+import math
+import time
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import math_parser
+import worker
+
+
+class TestBudget(unittest.TestCase):
+    def setUp(self):
+        self.budget = math_parser.budget
+        math_parser.budget = math_parser.Budget(seconds=1, memory=16_000_000, inline_bits=1 << 16)
+        math_parser.parse_cache.clear()
+
+    def tearDown(self):
+        math_parser.budget = self.budget
+        math_parser.parse_cache.clear()
+
+    def _evaluate(self, expression, variables=None):
+        start = time.perf_counter()
+        try:
+            result, _ = worker.evaluate(expression, variables or {})
+        finally:
+            self.elapsed = time.perf_counter() - start
+        return result
+
+    def test_inline(self):
+        self.assertEqual(math.factorial(100), self._evaluate("100!"))
+        self.assertEqual(2 ** 1000, self._evaluate("2^1000"))
+        with self.assertRaises(math_parser.NeedsWorker):
+            math_parser.evaluate("10000!", {})
+
+    def test_worker(self):
+        self.assertEqual(math.factorial(20000), self._evaluate("n!", {'n': 20000}))
+        self.assertEqual(3 ** 100000 + 1, self._evaluate("3^100000 + 1"))
+
+    def test_too_big(self):
+        with self.assertRaises(math_parser.TooExpensive):
+            self._evaluate("2^(10^9)")
+        self.assertLess(self.elapsed, 0.1)  # Rejected without computing it
+
+    def test_too_long(self):
+        with self.assertRaises(math_parser.TooExpensive):
+            self._evaluate("factorial(10^6)")
+        self.assertLess(self.elapsed, 1.5)
+
+    def test_cancelled(self):
+        math_parser.budget.seconds = 10
+        deadline = time.perf_counter() + 0.3
+        with self.assertRaises(worker.Cancelled):
+            worker.evaluate("factorial(10^6)", {}, cancelled=lambda: time.perf_counter() > deadline)
+        self.assertLess(time.perf_counter() - deadline, 0.5)
+
+    def test_array_too_big(self):
+        for expression in ("linspace(0, 1, 1e10)", "logspace(1, 1k, 1e10)", "arange(1e10)", "arange(0, 1, 1e-10)"):
+            with self.assertRaises(math_parser.TooExpensive, msg=expression):
+                self._evaluate(expression)
+            self.assertLess(self.elapsed, 0.1)
+
+    def test_calls_too_long(self):
+        # Each function calls the previous one twice, and isn't memoized as it uses k: 2^40 calls
+        env = {'k': 1}
+        for i in range(41):
+            body = f"f{i - 1}(n) + f{i - 1}(n + 1)" if i else "n + k"
+            math_parser.define_function(math_parser.UserFunction(f'f{i}', ['n'], body, environment=env))
+            self.addCleanup(math_parser.undefine_function, f'f{i}')
+        self.assertEqual(12, self._evaluate("f2(1)", env))
+        with self.assertRaises(math_parser.TooExpensive):
+            self._evaluate("f40(1)", env)
+        self.assertLess(self.elapsed, 1.5)
+
+    def test_errors(self):
+        with self.assertRaises(ZeroDivisionError):
+            self._evaluate("20000! / 0")
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_stored_array(self):
+        import main
+        self.assertEqual([1, 2, 3], main.stored_value('R', "linspace(0, 2, 3) + (20000! > 0)").tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import math_parser
+import varstore
+import worksheet
+from worksheet import CycleError, Worksheet
+
+
+class TestWorksheet(unittest.TestCase):
+
+    def setUp(self):
+        self.env = {'Vin': 12, 'R1': 1000, 'R2': 2000}
+        self.sheet = Worksheet(self.env)
+
+    def test_recomputed_when_used_variables_change(self):
+        self.sheet.define('Vout', "Vin * R2/(R1+R2)")
+        self.sheet.define('P', "Vout^2/R2")
+        self.assertEqual((8, 0.032), (self.env['Vout'], self.env['P']))
+        self.sheet.assign('R1', 2000)
+        self.assertEqual((6, 0.018), (self.env['Vout'], self.env['P']))
+        self.sheet.assign('Vout', 5)  # No longer a formula
+        self.sheet.assign('R1', 1000)
+        self.assertEqual((5, 0.0125), (self.env['Vout'], self.env['P']))
+
+    def test_only_affected_formulas(self):
+        self.sheet.define('a', "R1 * 2")
+        self.sheet.define('b', "R2 * 2")
+        self.sheet.define('c', "a + b")
+        self.sheet.define('d', "a * c")  # Diamond: d uses a directly and through c
+        self.assertEqual(['b', 'c', 'd'], self.sheet.downstream(['R2']))
+        self.sheet.recomputed = 0
+        self.sheet.assign('R1', 1)
+        self.assertEqual(3, self.sheet.recomputed)
+        self.assertEqual((2, 4002, 8004), (self.env['a'], self.env['c'], self.env['d']))
+
+    def test_long_chains(self):
+        self.sheet.define('v0', "Vin + 1")
+        for i in range(1, 5000):
+            self.sheet.define(f'v{i}', f"v{i - 1} + 1")
+        self.sheet.define('w', "R2 + 1")
+        self.sheet.recomputed = 0
+        self.sheet.assign('R2', 1)
+        self.assertEqual((1, 2), (self.sheet.recomputed, self.env['w']))
+        self.sheet.assign('Vin', 0)
+        self.assertEqual(5001, self.sheet.recomputed)
+        self.assertEqual(5000, self.env['v4999'])
+
+    def test_cycles(self):
+        self.sheet.define('a', "R1 + 1")
+        self.sheet.define('b', "a * 2")
+        with self.assertRaisesRegex(CycleError, "R1 would depend on itself through b → a → R1"):
+            self.sheet.define('R1', "b / 2")
+        with self.assertRaises(CycleError):
+            self.sheet.define('c', "c + 1")
+        self.assertEqual(1000, self.env['R1'])
+        self.assertFalse(self.sheet.tracks('R1', "R1 * 2"))  # Stored as a value instead
+        self.assertTrue(self.sheet.tracks('c', "R1 * 2"))
+        self.assertFalse(self.sheet.tracks('c', "2 * 2"))
+
+    def test_errors(self):
+        self.sheet.define('a', "1 / R1")
+        self.sheet.define('b', "a + 1")
+        self.sheet.assign('R1', 0)
+        self.assertIsInstance(self.sheet.errors['a'], ZeroDivisionError)
+        self.assertNotIn('a', self.env)
+        self.assertIn('b', self.sheet.errors)
+        self.sheet.assign('R1', 1)
+        self.assertEqual(({}, 2), (self.sheet.errors, self.env['b']))
+
+    def test_user_functions(self):
+        math_parser.define_function(math_parser.UserFunction('divider', ['v'], "v * R2/(R1+R2)", environment=self.env))
+        try:
+            self.sheet.define('Vout', "divider(Vin)")
+            self.assertEqual({'Vin', 'R1', 'R2'}, self.sheet.formulas['Vout'].dependencies)
+            self.sheet.assign('R1', 2000)
+            self.assertEqual(6, self.env['Vout'])
+        finally:
+            math_parser.undefine_function('divider')
+
+    def test_functions_redefined(self):
+        self.addCleanup(math_parser.undefine_function, 'f')
+        self.addCleanup(math_parser.undefine_function, 'g')
+        math_parser.define_function(math_parser.UserFunction('f', ['a'], "a * 2"))
+        math_parser.define_function(math_parser.UserFunction('g', ['a'], "f(a) + 1"))
+        self.sheet.define('W', "f(Vin)")
+        self.sheet.define('C', "g(3)")  # Folded into 7
+        self.assertEqual((24, 7), (self.env['W'], self.env['C']))
+        math_parser.define_function(math_parser.UserFunction('f', ['a'], "a * R1", environment=self.env))
+        self.sheet.function_changed('f')
+        self.assertEqual((12000, 3001), (self.env['W'], self.env['C']))
+        self.sheet.assign('R1', 3)
+        self.assertEqual((36, 10), (self.env['W'], self.env['C']))
+        math_parser.undefine_function('f')
+        self.sheet.function_changed('f')
+        self.assertEqual(set(), {'W', 'C'} & self.env.keys())
+        self.assertIsInstance(self.sheet.errors['W'], NameError)
+        math_parser.define_function(math_parser.UserFunction('f', ['a'], "a + 1"))
+        self.sheet.function_changed('f')
+        self.assertEqual((13, 5), (self.env['W'], self.env['C']))
+
+
+class TestStoredFormulas(unittest.TestCase):
+
+    def test_main(self):
+        import main
+        calculator = main.Calculator.__new__(main.Calculator)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(main.load_variables)  # Those of the real store, which is left untouched
+        store = varstore.VariableStore(os.path.join(directory.name, 'vars.txt'))
+        with mock.patch.object(main, 'store', store), mock.patch.object(main, 'copy_to_clipboard'):
+            main.load_variables()
+            calculator.store_result('sheetIn', '10')
+            result, = [r for r in main.calculate("sheetOut = sheetIn * 2") if r['Title'].startswith('sheetOut')]
+            self.assertEqual('store_formula', result['JsonRPCAction']['method'])
+            calculator.store_formula('sheetOut', "sheetIn * 2")
+            calculator.store_result('sheetIn', '4')
+            self.assertEqual(8, main.variables['sheetOut'])
+            math_parser.parse_cache.clear()
+            main.load_variables()
+            self.assertEqual(0, math_parser.parse_cache.stats()['entries'])  # Left to the queries
+            self.assertEqual((8, "sheetIn * 2"), (main.variables['sheetOut'], main.sheet.formulas['sheetOut'].text))
+            self.assertEqual("Circular definition", main.calculate("sheetIn = sheetOut + 1")[0]['Title'])
+
+    def test_functions_redefined(self):
+        import main
+        calculator = main.Calculator.__new__(main.Calculator)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(main.load_variables)
+        store = varstore.VariableStore(os.path.join(directory.name, 'vars.txt'))
+        with mock.patch.object(main, 'store', store), mock.patch.object(main, 'copy_to_clipboard'):
+            main.load_variables()
+            calculator.store_result('sheetIn', '10')
+            calculator.store_function('sheetF(a)', "a * 2")
+            calculator.store_formula('sheetOut', "sheetF(sheetIn)")
+            self.assertEqual(20, main.variables['sheetOut'])
+            calculator.store_function('sheetF(a)', "a * 3")
+            self.assertEqual(30, main.variables['sheetOut'])
+            calculator.store_result('sheetIn', '20')
+            self.assertEqual(60, main.variables['sheetOut'])
+
+
+if __name__ == "__main__":
+    unittest.main()
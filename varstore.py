@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Storage of the variables, shared by the processes started by Wox.
+
+Each change is appended to a journal as one line: a type tag, the name and the value, separated by tabs. Numbers
+are stored exactly, in hexadecimal, and strings and dictionaries as JSON. Deleting a variable appends a record
+without value. When the journal holds many more records than variables, it is compacted into a new file that
+atomically replaces it.
+
+Writers hold a lock on a separate file, since the journal itself is replaced by the compaction. Readers don't lock:
+they only read up to the last complete line, and remember where they stopped so that the next refresh() only reads
+what other processes appended since.
+"""
+import os
+
+HEADER = "#wox-pycalc-vars 1\n"
+COMPACT_MIN_RECORDS = 256  # The journal isn't compacted before having this many records more than variables
+COMPACT_RATIO = 2  # ... and this many times as many records as variables
+FUNCTION_SUFFIX = '()'  # Suffix of the names the user functions are stored under, as dictionaries
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+    def _unlock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def encode(name: str, value) -> str:
+    """Returns the journal record of the variable. A value of None deletes it."""
+    if '\t' in name or '\n' in name:
+        raise ValueError(f"Invalid variable name {name!r}")
+    if value is None:
+        return f"d\t{name}\t\n"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return f"i\t{name}\t{value:x}\n"
+    if isinstance(value, float):
+        return f"f\t{name}\t{value.hex()}\n"
+    if isinstance(value, complex):
+        return f"c\t{name}\t{value.real.hex()} {value.imag.hex()}\n"
+    import json  # Only needed by the strings and the formulas, not the numbers most variables hold
+    if isinstance(value, str):
+        return f"s\t{name}\t{json.dumps(value)}\n"
+    if isinstance(value, dict):
+        return f"j\t{name}\t{json.dumps(value)}\n"
+    raise TypeError(f"Can't store a value of type {type(value).__name__}")
+
+
+def decode(record: str) -> tuple:
+    """Returns the name and value of a journal record, the value being None for a deletion. Raises ValueError if
+    the record is invalid."""
+    tag, name, payload = record.rstrip('\n').split('\t', 2)
+    if tag == 'i':
+        return name, int(payload, 16)
+    if tag == 'f':
+        return name, float.fromhex(payload)
+    if tag == 'c':
+        real, imag = payload.split(' ')
+        return name, complex(float.fromhex(real), float.fromhex(imag))
+    if tag == 's' or tag == 'j':
+        import json
+        return name, json.loads(payload)
+    if tag == 'd':
+        return name, None
+    raise ValueError(f"Unknown record type {tag!r}")
+
+
+def is_journal(path: str) -> bool:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.readline() == HEADER
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+class VariableStore:
+    """The variables stored in the journal at path, in the dictionary values.
+
+    When there is no journal yet, the variables are imported from the NAME=VALUE lines of legacy_path, the file
+    the previous versions stored them in."""
+
+    def __init__(self, path: str, legacy_path: str = None):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.legacy_path = legacy_path
+        self.values = {}
+        self.records = 0  # Number of records in the journal
+        self._offset = 0  # Where the next refresh starts reading
+        self._file_id = None  # Device, inode, size and mtime of the journal read, replaced when it is compacted
+        self.changed = set()  # Names read since the last refresh
+
+    def load(self, state: tuple = None) -> dict:
+        """Reads the whole journal. Returns the variables.
+
+        Given the state of a store, as returned by state(), only reads what was appended to the journal since, when
+        it is still the same file."""
+        self.values = {}
+        self.records = 0
+        self._offset = 0
+        self._file_id = None
+        if state is not None:
+            values, self.records, self._offset, file_id = state
+            self.values = dict(values)
+            self._file_id = tuple(file_id)
+        if self.legacy_path and not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+            self._migrate()
+        self._read_tail()
+        self.changed.clear()
+        return self.values
+
+    def state(self) -> tuple:
+        """The variables and the position in the journal they were read up to."""
+        return dict(self.values), self.records, self._offset, self._file_id
+
+    def refresh(self) -> set:
+        """Reads the records appended since the last load or refresh. Returns the names of the variables changed by
+        other processes."""
+        self._read_tail()
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def set(self, name: str, value):
+        """Stores the variable. A value of None deletes it."""
+        self._append([encode(name, value)])
+
+    def delete(self, name: str):
+        self.set(name, None)
+
+    def update(self, variables: dict):
+        self._append([encode(name, value) for name, value in variables.items()])
+
+    def compact(self):
+        """Rewrites the journal with only the last value of each variable."""
+        with self._locked():
+            self._read_tail()
+            self._compact()
+
+    def _read_tail(self):
+        """Reads the complete records after the offset, or the whole journal if it was replaced."""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            self.changed.update(self.values)
+            self.values, self.records, self._offset, self._file_id = {}, 0, 0, None
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            if not self._same_file(stat):
+                old_values = self.values
+                self.values, self.records, self._offset = {}, 0, 0
+            else:
+                old_values = None
+            self._file_id = stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # A line without its newline is being written
+        values = self.values
+        for line in data[:end].decode('utf-8').splitlines():
+            if line.startswith('#'):
+                continue
+            try:
+                name, value = decode(line)
+            except ValueError:
+                continue  # Left by a crash
+            if value is None:
+                values.pop(name, None)
+            else:
+                values[name] = value
+            self.records += 1
+            if old_values is None:
+                self.changed.add(name)
+        self._offset += end
+        if old_values is not None:
+            self.changed.update(name for name in old_values.keys() | values.keys()
+                                if old_values.get(name, None) != values.get(name, None))
+
+    def _same_file(self, stat) -> bool:
+        """Whether the journal is the file read, only appended to since. A compaction may reuse its inode, but then
+        the file is either smaller, or of the same size and modified later."""
+        try:
+            dev, ino, size, mtime = self._file_id
+        except (TypeError, ValueError):  # Not read yet, or the state of an older version
+            return False
+        return ((stat.st_dev, stat.st_ino) == (dev, ino) and stat.st_size >= max(size, self._offset)
+                and stat.st_mtime_ns >= mtime and (stat.st_size > size or stat.st_mtime_ns == mtime))
+
+    def _append(self, records: list):
+        with self._locked():
+            self._read_tail()  # Another process may have compacted the journal, or written after the offset
+            with open(self.path, 'ab') as f:
+                if f.tell() == 0:
+                    f.write(HEADER.encode())
+                f.write(''.join(records).encode('utf-8'))
+            self._read_tail()
+            if self.records > max(COMPACT_RATIO * len(self.values), len(self.values) + COMPACT_MIN_RECORDS):
+                self._compact()
+
+    def _compact(self):
+        temp_path = f"{self.path}.{os.getpid()}"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.encode())
+            f.write(''.join(encode(name, value) for name, value in self.values.items()).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.replace(temp_path, self.path)
+        except PermissionError:  # On Windows, while another process is reading it. It will be compacted later.
+            os.unlink(temp_path)
+            return
+        self._read_tail()
+
+    def _migrate(self):
+        from math_parser import number
+        variables = {}
+        with open(self.legacy_path) as f:
+            for line in f:
+                name, sep, text = line.partition('=')
+                if sep:
+                    variables[name.strip()] = number(text.strip())
+        with self._locked():
+            if not os.path.exists(self.path):  # Unless another process migrated them meanwhile
+                self.values = variables
+                self._compact()
+
+    def _locked(self):
+        return _FileLock(self.lock_path)
+
+
+class _FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        _lock(self.fd)
+        return self
+
+    def __exit__(self, *exc_info):
+        _unlock(self.fd)
+        os.close(self.fd)
+        self.fd = None
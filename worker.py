@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Evaluation within the time and memory budget of math_parser.budget.
+
+Expressions are evaluated inline, unless one of their operations raises NeedsWorker. They are then evaluated again
+by a new process, running this module, which is killed when it doesn't answer within the time budget. Where the
+resource module is available, the process is also limited to the memory budget and the CPU time.
+
+The worker reads the pickled (equation, variables, user function definitions, seconds, memory) from stdin and
+writes the pickled (result, error) to stdout.
+"""
+import math
+import os
+import sys
+import time
+
+import math_parser
+
+STARTUP_MEMORY = 64 << 20  # Allowance for the interpreter itself, added to the memory budget of the worker
+POLL_INTERVAL = 0.02  # How often a worker is checked for cancellation
+
+
+class Cancelled(Exception):
+    """Raised by an evaluation that is no longer needed."""
+
+
+def evaluate(equation: str, environment: dict = None, budget: math_parser.Budget = None, cancelled=None):
+    """Same as math_parser.evaluate, raising math_parser.TooExpensive when the evaluation exceeds the budget.
+
+    When given, cancelled() is called while a worker is running, which is killed if it returns True. Cancelled is
+    then raised."""
+    budget = budget or math_parser.budget
+    try:
+        return math_parser.evaluate(equation, environment)
+    except math_parser.NeedsWorker:
+        pass
+    import pickle  # Only needed by the worker, rarely started
+    import subprocess
+    ast, optimized = math_parser.parse_cache.lookup(equation)
+    functions = math_parser.user_functions()
+    names = math_parser.variable_names(optimized).union(*(f.free for f in functions))
+    variables = {}
+    for name in names:
+        try:
+            variables[name] = environment[name]  # Resolves the lazy bindings of a LazyEnv
+        except (KeyError, TypeError):
+            pass
+    definitions = [(f.name, f.to_data()) for f in functions]
+    request = pickle.dumps((equation, variables, definitions, budget.seconds, budget.memory))
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        output = _communicate(process, request, budget.seconds, cancelled)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise math_parser.TooExpensive(f"The evaluation takes more than {budget.seconds:g} s")
+    except Cancelled:
+        process.kill()
+        process.communicate()
+        raise
+    try:
+        result, error = pickle.loads(output)
+    except Exception:  # Killed by the resource limits
+        raise math_parser.TooExpensive("The evaluation exceeds the budget") from None
+    if error is not None:
+        raise error
+    return result, ast
+
+
+def _communicate(process, request: bytes, seconds: float, cancelled) -> bytes:
+    import subprocess
+    if cancelled is None:
+        output, _ = process.communicate(request, timeout=seconds)
+        return output
+    deadline = time.monotonic() + seconds
+    while True:
+        if cancelled():
+            raise Cancelled()
+        try:
+            output, _ = process.communicate(request, timeout=min(POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+            return output
+        except subprocess.TimeoutExpired:
+            if time.monotonic() >= deadline:
+                raise
+        request = None  # Already sent
+
+
+def _limit_resources(seconds: float, memory: int):
+    try:
+        import resource
+    except ImportError:
+        return
+    resource.setrlimit(resource.RLIMIT_CPU, (math.ceil(seconds), math.ceil(seconds) + 1))
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (memory + STARTUP_MEMORY + _used_memory(),) * 2)
+    except (OSError, ValueError):
+        pass
+
+
+def _used_memory() -> int:
+    """The address space used by this process, or 0 if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def main():
+    import pickle
+    equation, variables, definitions, seconds, memory = pickle.load(sys.stdin.buffer)
+    _limit_resources(seconds, memory)
+    math_parser.budget = math_parser.Budget(seconds, memory, inline_bits=None)
+    try:
+        for name, data in definitions:
+            math_parser.define_function(math_parser.UserFunction.from_data(name, data, variables))
+        result, _ = math_parser.evaluate(equation, variables)
+        response = result, None
+    except MemoryError:
+        response = None, math_parser.TooExpensive("The evaluation exceeds the memory budget")
+    except Exception as err:
+        response = None, err
+    try:
+        output = pickle.dumps(response)
+    except Exception as err:  # A result or an error that can't be pickled
+        output = pickle.dumps((None, RuntimeError(f"{type(err).__name__}: {err}")))
+    sys.stdout.buffer.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Variables defined by formulas, like Vout = Vin * R2/(R1+R2), recomputed when the variables they use change.
+
+The formulas and the variables they use form a graph without cycles, a definition that would make one is refused.
+When a variable changes, only the formulas downstream of it are recomputed, each once, after the formulas it uses,
+so that the cost is proportional to the part of the graph affected and not to the number of formulas.
+"""
+from collections import defaultdict
+
+import math_parser
+import worker
+
+
+class CycleError(ValueError):
+    """Raised by a definition that would make a formula depend on itself."""
+
+
+class Formula:
+    def __init__(self, text: str):
+        self.text = text.strip()
+        # Parsed apart from the parse cache, whose entries are for the queries: the formulas are all parsed again at
+        # each start, and would evict them
+        ast = math_parser.Parser(self.text).parse()
+        self.optimized = math_parser.optimize(ast, math_parser.parse_cache.share)
+        self.functions = called_functions(ast)  # Parsed again when one of them is redefined, as it may be folded
+        self.dependencies = dependencies(self.optimized, self.functions)
+        self.error = None  # Raised instead of evaluating, once a function it calls is removed
+        self._compiled = None
+
+    def evaluate(self, env: dict):
+        if self.error is not None:
+            raise self.error
+        if isinstance(self.optimized, str):
+            return env[self.optimized]
+        if not isinstance(self.optimized, math_parser.Node):
+            return self.optimized
+        if self._compiled is None:
+            self._compiled = self.optimized.compile()
+        try:
+            return self._compiled(env)
+        except math_parser.NeedsWorker:
+            result, _ = worker.evaluate(self.text, env)
+            return result
+
+
+def called_functions(tree) -> set:
+    """The names of the user functions the tree calls, directly or through other user functions, those called by
+    the latter but removed since included."""
+    if not isinstance(tree, math_parser.Node):
+        return set()
+    names = set()
+    stack = [node.op for node in math_parser.postorder(tree)]
+    while stack:
+        name = stack.pop()
+        function = math_parser.Parser.FUNCTIONS.get(name)
+        if name in names or not (isinstance(function, math_parser.UserFunction) or
+                                 function is None and name.isidentifier()):
+            continue
+        names.add(name)
+        if function is not None:
+            stack.extend(function.operations)
+    return names
+
+
+def dependencies(optimized, functions=()) -> set:
+    """The variables the tree uses, those of the user functions it calls included."""
+    names = math_parser.variable_names(optimized)
+    for name in functions:
+        function = math_parser.Parser.FUNCTIONS.get(name)
+        if isinstance(function, math_parser.UserFunction):
+            names |= function.free
+    return names
+
+
+class Worksheet:
+    """The formulas of the variables of env, which holds their values along with those of the other variables."""
+
+    def __init__(self, env: dict):
+        self.env = env
+        self.formulas = {}
+        self.dependents = defaultdict(set)  # Formulas using each variable
+        self.errors = {}  # Error of each formula that couldn't be computed, which then has no value
+        self.recomputed = 0
+
+    def tracks(self, name: str, text: str) -> bool:
+        """Tells whether name = text is stored as a formula: when it uses other variables, none of them lazily
+        bound, like the clipboard x, whose changes aren't notified. Otherwise its value is stored."""
+        try:
+            used = Formula(text).dependencies
+        except Exception:
+            return False
+        lazy = getattr(self.env, 'lazy', {})
+        known = [n for n in used if n in self.env or n in self.formulas]
+        return bool(known) and name not in used and not any(n in lazy for n in used)
+
+    def check(self, name: str, text: str) -> Formula:
+        """Returns the formula of name = text. Raises CycleError if it would depend on itself."""
+        formula = Formula(text)
+        if name in formula.dependencies:
+            raise CycleError(f"{name} can't be defined from itself")
+        path = self._path(formula.dependencies, name)
+        if path:
+            raise CycleError(f"{name} would depend on itself through {' → '.join(path)}")
+        return formula
+
+    def define(self, name: str, text: str, recompute: bool = True):
+        """Makes name a formula. Raises CycleError if the formula would depend on itself."""
+        formula = self.check(name, text)
+        self._unlink(name)
+        self.formulas[name] = formula
+        for used in formula.dependencies:
+            self.dependents[used].add(name)
+        if recompute:
+            self.update([name])
+
+    def assign(self, name: str, value):
+        """Gives a value to name, which stops being a formula, and recomputes the formulas using it."""
+        self._unlink(name)
+        self.formulas.pop(name, None)
+        self.errors.pop(name, None)
+        self.env[name] = value
+        self.update([name])
+
+    def remove(self, name: str):
+        self._unlink(name)
+        self.formulas.pop(name, None)
+        self.errors.pop(name, None)
+        self.env.pop(name, None)
+        self.update([name])
+
+    def function_changed(self, function: str):
+        """Parses again the formulas calling the user function, which was defined, redefined or removed, and
+        recomputes them."""
+        calling = [name for name, formula in self.formulas.items()
+                   if function in formula.functions or function in formula.dependencies]
+        for name in calling:
+            try:
+                self.define(name, self.formulas[name].text, recompute=False)
+            except Exception as err:  # The function was removed, or the formula would now depend on itself
+                self.formulas[name].error = err
+        self.update(calling)
+
+    def clear(self):
+        self.formulas.clear()
+        self.dependents.clear()
+        self.errors.clear()
+
+    def _unlink(self, name: str):
+        formula = self.formulas.get(name)
+        if formula is not None:
+            for used in formula.dependencies:
+                self.dependents[used].discard(name)
+
+    def _path(self, starts, target: str) -> list:
+        """A chain of formulas from one of starts to one using target, or an empty list."""
+        parents = {start: None for start in starts}
+        stack = list(starts)
+        while stack:
+            name = stack.pop()
+            formula = self.formulas.get(name)
+            if formula is None:
+                continue
+            if target in formula.dependencies:
+                path = [target]
+                while name is not None:
+                    path.append(name)
+                    name = parents[name]
+                return path[::-1]
+            for used in formula.dependencies:
+                if used not in parents:
+                    parents[used] = name
+                    stack.append(used)
+        return []
+
+    def downstream(self, names) -> list:
+        """The formulas affected by a change of the names, those among them included, in the order they are to be
+        computed: each one after the formulas it uses."""
+        affected = {name for name in names if name in self.formulas}
+        stack = list(names)
+        while stack:
+            for dependent in self.dependents.get(stack.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+        pending = {name: sum(used in affected for used in self.formulas[name].dependencies) for name in affected}
+        ready = [name for name, count in pending.items() if count == 0]
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for dependent in self.dependents.get(name, ()):
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    ready.append(dependent)
+        return order
+
+    def update(self, names):
+        """Recomputes the formulas affected by a change of the names."""
+        for name in self.downstream(names):
+            self.recomputed += 1
+            try:
+                self.env[name] = self.formulas[name].evaluate(self.env)
+            except Exception as err:
+                self.errors[name] = err
+                self.env.pop(name, None)
+            else:
+                self.errors.pop(name, None)
+
+    def recompute_all(self):
+        self.update(list(self.formulas))